@@ -5,19 +5,33 @@ from .units import (
     BaseUnit,
     DbmFileUnit,
     JsonFileUnit,
-    DirUnit
+    DirUnit,
+    BlockUnit
 )
 from .converters import (
     FakeConverter,
+    JsonConverter,
     CompressedJsonConverter,
     Base64CompressedJsonConverter,
+    OrjsonConverter,
+    CompressedOrjsonConverter,
+    MsgpackConverter,
+    CompressedMsgpackConverter,
+    ZdictCompressedJsonConverter,
     handlers
 )
 from .routers import (
     BaseRouter,
     OriginalRouter,
-    StringFormatRouter
+    StringFormatRouter,
+    HashRouter,
+    MultiRootRouter,
+    SplittingRouter,
+    MigratingRouter
 )
 from .main import DB
-from .errors import MyStoreError
+from .index import KeyIndex, NativeStorage
+from .cursors import LazyValue
+from .service import WriterService, RemoteWriter
+from .errors import MyStoreError, DuplicateKeyError
 from .shortcuts import *
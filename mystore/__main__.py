@@ -0,0 +1,237 @@
+"""
+Command line interface:
+    python -m mystore export ROOT [-o FILE]
+    python -m mystore import ROOT [-i FILE] [--params JSON ...]
+    python -m mystore stats ROOT
+    python -m mystore reformat ROOT NEW_ROOT [--params JSON ...]
+    python -m mystore compact ROOT [--min-unit-bytes N]
+    python -m mystore serve ROOT [--socket PATH]
+
+Records are JSON Lines: {"key": key, "value": value}, one per line.
+Files ending with ".gz" are gzip compressed, "-" stands for stdin/stdout.
+Data is streamed, so memory use does not depend on the size of the store.
+Progress (records/sec) is reported to stderr.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import sys
+import json
+import gzip
+import time
+import signal
+import argparse
+import itertools
+
+from mystore import DB, MyStoreError, WriterService
+from mystore.service import SOCKET_FILENAME
+
+
+REPORT_INTERVAL = 10    # seconds between progress reports
+
+
+class Progress:
+    """ Count processed records and report records/sec to stderr. """
+    def __init__(self, action, interval=REPORT_INTERVAL):
+        self.action = action
+        self.interval = interval
+        self.count = 0
+        self.start = self._last_report = time.time()
+
+    def add(self, n=1):
+        self.count += n
+        now = time.time()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._report(now)
+
+    def finish(self):
+        self._report(time.time(), final=True)
+
+    def _report(self, now, final=False):
+        elapsed = max(now - self.start, 1e-9)
+        print("%s %s %s records in %.1fs (%.0f records/s)" % (
+            "done:" if final else "...", self.action, self.count, elapsed, self.count / elapsed),
+            file=sys.stderr)
+
+
+def open_text(path, mode):
+    """ Open text file for reading ("r") or writing ("w"), gzip compressed if it ends with .gz. """
+    if path == "-":
+        return open(sys.stdin.fileno() if mode == "r" else sys.stdout.fileno(),
+                    mode, encoding="utf8", closefd=False)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+
+def export_db(args):
+    db = DB.load(args.root)
+    progress = Progress("exported")
+    with open_text(args.output, "w") as f, db.reader(processes=args.processes) as reader:
+        for k, v in reader.get_all():
+            f.write(json.dumps({"key": db.router.parse_key(k), "value": v}))
+            f.write("\n")
+            progress.add()
+    progress.finish()
+
+
+def import_db(args):
+    db = load_or_create_db(args.root, args)
+    progress = Progress("imported")
+
+    def read_records(f):
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                progress.add()
+                yield (record["key"], record["value"])
+
+    with open_text(args.input, "r") as f:
+        db.bulk_load(read_records(f), chunk_size=args.chunk_size, processes=args.processes)
+    progress.finish()
+
+
+def print_stats(args):
+    db = DB.load(args.root)
+    config = db.load_config(args.root)
+    unit_paths = list(db.get_all_unit_paths())
+    progress = Progress("counted", interval=args.interval)
+    with db.reader() as reader:
+        for keys in _chunks(reader.get_all(keys_only=True), 10000):
+            progress.add(len(keys))
+    progress.finish()
+    stats = {
+        "root": os.path.abspath(args.root),
+        "config": config,
+        "units": len(unit_paths),
+        "bytes": sum(db.unit_cls.get_unit_size(path) for path in unit_paths),
+        "records": progress.count
+    }
+    print(json.dumps(stats, indent=2))
+
+
+def reformat_db(args):
+    old_db = DB.load(args.root)
+    new_db = create_db(args.new_root, args, DB.load_config(args.root))
+    start = time.time()
+    old_db.reformat(new_db)
+    print("done: reformatted %s to %s in %.1fs" % (args.root, args.new_root, time.time() - start),
+          file=sys.stderr)
+
+
+def compact_db(args):
+    db = DB.load(args.root)
+    start = time.time()
+    reclaimed = db.compact(args.min_unit_bytes, args.processes)
+    print("done: reclaimed %s bytes in %.1fs" % (reclaimed, time.time() - start), file=sys.stderr)
+
+
+def serve_writes(args):
+    db = DB.load(args.root)
+    socket_path = args.socket or os.path.join(args.root, SOCKET_FILENAME)
+    service = WriterService(db, socket_path, max_batch=args.max_batch)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("serving writes to %s on %s (see DB.remote_writer)" % (args.root, socket_path),
+          file=sys.stderr)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def load_or_create_db(root, args):
+    try:
+        return DB.load(root)
+    except MyStoreError:
+        return create_db(root, args)
+
+
+def create_db(root, args, defaults=None):
+    """ Create DB with classes and params from command line (or 'defaults' config). """
+    defaults = defaults or {}
+    params = json.loads(args.params) if args.params else defaults.get("params")
+    if params is None:
+        params = {"unit_size": 1000, "subfolder_size": 100, "first_key": 1}
+    return DB(
+        root,
+        params,
+        router_cls=DB.get_router_classes()[args.router or defaults.get("router_cls", "OriginalRouter")],
+        unit_cls=DB.get_unit_classes()[args.unit or defaults.get("unit_cls", "DbmFileUnit")],
+        converter_cls=DB.get_converter_classes()[
+            args.converter or defaults.get("converter_cls", "CompressedJsonConverter")]
+    ).create()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="python -m mystore", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    def add_layout_options(command):
+        command.add_argument("--params", help="router params as JSON (for a new DB)")
+        command.add_argument("--router", help="router class name (for a new DB)")
+        command.add_argument("--unit", help="unit class name (for a new DB)")
+        command.add_argument("--converter", help="converter class name (for a new DB)")
+
+    command = commands.add_parser("export", help="export all records as JSON Lines")
+    command.add_argument("root")
+    command.add_argument("-o", "--output", default="-")
+    command.add_argument("--processes", type=int, help="processes converting values")
+    command.set_defaults(func=export_db)
+
+    command = commands.add_parser("import", help="import JSON Lines records (DB is created if needed)")
+    command.add_argument("root")
+    command.add_argument("-i", "--input", default="-")
+    command.add_argument("--processes", type=int, help="processes converting values")
+    command.add_argument("--chunk-size", type=int, default=100000,
+                         help="records sorted in memory at once (see DB.bulk_load)")
+    add_layout_options(command)
+    command.set_defaults(func=import_db)
+
+    command = commands.add_parser("stats", help="print DB config, size and number of records")
+    command.add_argument("root")
+    command.add_argument("--interval", type=float, default=REPORT_INTERVAL)
+    command.set_defaults(func=print_stats)
+
+    command = commands.add_parser("reformat", help="copy DB to a new one with another layout")
+    command.add_argument("root")
+    command.add_argument("new_root")
+    add_layout_options(command)
+    command.set_defaults(func=reformat_db)
+
+    command = commands.add_parser("compact", help="reclaim space left by deleted values")
+    command.add_argument("root")
+    command.add_argument("--min-unit-bytes", type=int, default=0,
+                         help="only compact units at least this big")
+    command.add_argument("--processes", type=int, help="units compacted in parallel")
+    command.set_defaults(func=compact_db)
+
+    command = commands.add_parser("serve", help="run writer service for remote writers")
+    command.add_argument("root")
+    command.add_argument("--socket", help="Unix socket path (default: %s in ROOT)" % SOCKET_FILENAME)
+    command.add_argument("--max-batch", type=int, default=100000,
+                         help="max records applied at once")
+    command.set_defaults(func=serve_writes)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except MyStoreError as e:   # e.g. missing or invalid DB root
+        print("error: %s" % e, file=sys.stderr)
+        sys.exit(1)
+
+
+# ******* implementation details *******
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    return iter(lambda: list(itertools.islice(iterator, size)), [])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+This module contains BaseStorage, base class of storages mapping
+user provided keys to actual keys (pks) used in a mystore.DB:
+- mystore.storage.Storage keeps the mapping in a SQLite table;
+- mystore.index.NativeStorage keeps it in a KeyIndex.
+
+Subclasses only provide the mapping: key lookups, inserts,
+pk block reservation and iteration over all mappings.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import abc
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .main import DB
+from .shortcuts import get_db
+from .errors import MyStoreError, DuplicateKeyError
+from .units import DbmFileUnit
+from .routers import OriginalRouter
+from .converters import CompressedJsonConverter
+
+
+class BaseStorage(metaclass=abc.ABCMeta):
+    """
+    Abstract Base Class of storages with user keys mapped to DB pks.
+    """
+    _duplicate_key_error = DuplicateKeyError    # raised on duplicate keys
+    def __init__(self, db_path, params=None, router_cls=OriginalRouter,
+                       unit_cls=DbmFileUnit, converter_cls=CompressedJsonConverter,
+                       pk_block_size=1000):
+        """
+        Initialize mystore.DB instance (create if not present yet).
+        pks are reserved by each process in blocks of at least 'pk_block_size'.
+        """
+        try:
+            self.db = get_db(db_path)
+        except MyStoreError:
+            if params is None:
+                params={
+                    "unit_size": 1000,
+                    "subfolder_size": 100,
+                    "first_key": 1
+                }
+            self.db = DB(db_path, params, router_cls, unit_cls, converter_cls).create()
+
+        self.pk_block_size = pk_block_size
+        self._pk_lock = threading.Lock()
+        self._pk_owner = None       # pid of process owning the reserved block
+        self._pk_next = self._pk_end = 0
+
+    def save_one(self, k, v):
+        """
+        Save one key value pair.
+        Doesn't overwrite existing keys.
+        """
+        self.save_many([(k, v)])
+
+    def save_many(self, items):
+        """
+        Save many key-value pairs at once.
+        Raise DuplicateKeyError and write nothing on duplicate keys.
+
+        Values are written before their mappings are added, without holding
+        any lock on the mapping. If a concurrent process adds one of the keys
+        in between, DuplicateKeyError is raised and the values written
+        remain in DB under pks no mapping refers to.
+        """
+        items = list(items)
+        if not items:
+            return
+        keys = [k for k,v in items]
+        existing = self.get_existing_keys(keys)
+        if existing:
+            raise self._duplicate_key_error(
+                "%s keys already saved, e.g. %s" % (len(existing), list(existing)[:10]))
+        if len(set(keys)) < len(keys):
+            raise self._duplicate_key_error("Duplicate keys in items")
+
+        pks = self._reserve_pks(len(items))
+        with self.db.writer() as writer:
+            writer.set_many(zip(pks, (v for k,v in items)))
+        self._insert_mappings(pks, keys)
+
+    def save_many_if_missing(self, items):
+        """
+        Same as the save_many, but won't raise an error if a key is already there.
+        Only saves those that aren't in DB yet.
+        """
+        items = list(items)
+        if not items:
+            return
+        keys_in_db = self.get_existing_keys([k for k,v in items])
+        missing = {}
+        for k,v in items:
+            if k not in keys_in_db and k not in missing:
+                missing[k] = v
+        if not missing:
+            return
+
+        pks = self._reserve_pks(len(missing))
+        with self.db.writer() as writer:
+            writer.set_many(zip(pks, missing.values()))
+        # keys saved by another process meanwhile are skipped:
+        self._insert_mappings(pks, list(missing.keys()), ignore_existing=True)
+
+    def get_one(self, k, default=None):
+        """
+        Get one value from storage for specified key.
+        """
+        pk = self._get_pk_map([k]).get(k)
+        if pk is None:
+            return default
+        with self.db.reader() as reader:
+            return reader[pk]
+
+    def get_many(self, keys, default=None):
+        """
+        Get list of values for given list of keys.
+        """
+        keys = list(keys)
+        pk_map = self._get_pk_map(keys)
+        if pk_map:
+            with self.db.reader() as reader:
+                pkv_dict = reader.get_many(pk_map.values())
+        else:
+            pkv_dict = {}
+
+        values = []
+        for key in keys:
+            pk = pk_map.get(key)
+            if pk is not None:
+                values += [pkv_dict.get(pk, default)]
+            else:
+                values += [default]
+
+        return values
+
+    def yield_many(self, keys, default=None, chunk_size = 1000):
+        """
+        Generator to avoid reading all items at once.
+        Returns tuples (key, value).
+
+        'keys' can be any iterable, it is consumed chunk by chunk.
+        The next chunk is read in a background thread
+        while the caller processes the current one.
+        """
+        keys = iter(keys)
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = self._prefetch(executor, keys, default, chunk_size)
+            while future is not None:
+                chunk_of_keys, values = future.result()
+                future = self._prefetch(executor, keys, default, chunk_size)
+                for key, value in zip(chunk_of_keys, values):
+                    yield (key, value)
+        finally:
+            # generator closed early: do not wait for the pending chunk
+            executor.shutdown(wait=False)
+
+    def get_missing_keys(self, keys):
+        """
+        Get list of keys that are not in storage for given list of keys.
+        """
+        keys = list(keys)
+        keys_in_db = self.get_existing_keys(keys)
+        return [k for k in keys if k not in keys_in_db]
+
+    def get_existing_keys(self, keys):
+        """
+        Get set of keys that are in storage for given list of keys.
+        """
+        return set(self._get_pk_map(keys))
+
+    def get_all(self, chunk=1000, max_chunk=100000):
+        """
+        Generator.
+        Get all (k,v) pairs stored in storage (in order of '_iter_mapping_pages').
+
+        Mappings are read in pages, page size starts at 'chunk'
+        and doubles up to 'max_chunk'.
+        Values of each page are read by a single reader, unit by unit.
+        """
+        with self.db.reader() as reader:
+            for rows in self._iter_mapping_pages(chunk, max_chunk):
+                pkv_dict = reader.get_many([pk for key, pk in rows])
+                # don't keep the last unit locked while values are consumed:
+                reader.release_unit()
+                for key, pk in rows:
+                    yield (key, pkv_dict[pk])
+
+    # ******* implementation details *******
+    @abc.abstractmethod
+    def _get_pk_map(self, keys):
+        """ Return {key: pk} dict for those of 'keys' that are in storage. """
+
+    @abc.abstractmethod
+    def _insert_mappings(self, pks, keys, ignore_existing=False):
+        """
+        Add key -> pk mappings. Raise DuplicateKeyError if a key is already
+        mapped, unless 'ignore_existing' (then such keys are skipped).
+        """
+
+    @abc.abstractmethod
+    def _reserve_pk_block(self, size):
+        """ Reserve 'size' contiguous pks for this process, return (first, end). """
+
+    @abc.abstractmethod
+    def _iter_mapping_pages(self, chunk, max_chunk):
+        """
+        Generator of lists of (key, pk) pairs of all mappings,
+        of 'chunk' pairs growing up to 'max_chunk'.
+        """
+
+    def _prefetch(self, executor, keys, default, chunk_size):
+        """
+        Submit reading of the next chunk of 'keys' to executor.
+        Return future of (chunk_of_keys, values) or None if keys are exhausted.
+        """
+        chunk_of_keys = list(itertools.islice(keys, chunk_size))
+        if not chunk_of_keys:
+            return None
+        return executor.submit(lambda: (chunk_of_keys, self.get_many(chunk_of_keys, default)))
+
+    def _reserve_pks(self, n):
+        """
+        Return list of 'n' pks for new mappings.
+
+        pks come from a block of contiguous pks reserved by this process
+        (hi-lo allocation), so processes only lock the mapping counter
+        once per block, and write values to their own units.
+        """
+        with self._pk_lock:
+            if self._pk_owner != os.getpid():   # forked: block belongs to parent
+                self._pk_owner = os.getpid()
+                self._pk_next = self._pk_end = 0
+            pks = []
+            while len(pks) < n:
+                if self._pk_next == self._pk_end:
+                    size = max(self.pk_block_size, n - len(pks))
+                    self._pk_next, self._pk_end = self._reserve_pk_block(size)
+                taken = min(n - len(pks), self._pk_end - self._pk_next)
+                pks.extend(range(self._pk_next, self._pk_next + taken))
+                self._pk_next += taken
+            return pks
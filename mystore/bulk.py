@@ -0,0 +1,84 @@
+"""
+This module contains the bulk loading pipeline used by DB.bulk_load:
+    1. values are converted to DB format in batches (in parallel, see BaseConverter.dump_many);
+    2. each batch is sorted by unit path and, if there are more batches
+       to come, spilled to a temporary file (external sort);
+    3. sorted runs are merged, so each unit is opened once
+       and all its items are written in one call to 'BaseUnit.update'.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import heapq
+import pickle
+import tempfile
+import itertools
+from operator import itemgetter
+
+
+def bulk_load(db, items, mode="W", chunk_size=100000, processes=None, tmp_dir=None):
+    """
+    Write (k, v) pairs from 'items' iterable to 'db', return number of items written.
+    At most 'chunk_size' items are kept in memory, the rest is spilled
+    to temporary files (in 'tmp_dir').
+    If a key occurs more than once, the last value wins.
+    """
+    items = iter(items)
+    runs = []
+    count = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+            count += len(chunk)
+            run = _sorted_run(db, chunk, processes)
+            if len(chunk) < chunk_size and not runs:
+                runs.append(run)    # everything fits in memory
+                break
+            runs.append(_spill(run, tmp_dir))
+            lg.debug("spilled run of %s items", len(run))
+
+        merged = heapq.merge(*[iter(run) if isinstance(run, list) else _read_spilled(run)
+                               for run in runs], key=itemgetter(0))
+        for unit_path, records in itertools.groupby(merged, key=itemgetter(0)):
+            unit_items = [(k, raw) for _, k, raw in records]
+            with db.unit_cls(unit_path, mode=mode) as unit:
+                unit.update(unit_items)
+            if db.cache is not None:
+                for k, raw in unit_items:
+                    db.cache.discard(unit_path, k)
+    finally:
+        for run in runs:
+            if not isinstance(run, list):
+                run.close()
+    lg.info("bulk loaded %s items to %s", count, db.root)
+    return count
+
+
+# ******* implementation details *******
+def _sorted_run(db, chunk, processes):
+    """ Return list of (unit path, key, raw value) sorted by unit path (stable). """
+    raw_values = db.converter.dump_many((v for k, v in chunk), processes)
+    run = [(db.router.get_path(k), k, raw) for (k, v), raw in zip(chunk, raw_values)]
+    run.sort(key=itemgetter(0))
+    return run
+
+
+def _spill(run, tmp_dir):
+    f = tempfile.TemporaryFile(dir=tmp_dir)
+    pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+    for record in run:
+        pickler.dump(record)
+        pickler.clear_memo()
+    f.seek(0)
+    return f
+
+
+def _read_spilled(f):
+    unpickler = pickle.Unpickler(f)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
@@ -0,0 +1,441 @@
+"""
+This module contains caches of values used by Reader to avoid
+opening units and converting values on repeated reads:
+- ValueCache, an in-process cache of decoded values;
+- SharedValueCache, a cache shared between processes via a memory-mapped file;
+and MappingCache, used by mystore.storage.Storage to avoid SQLite queries
+on repeated lookups of the same keys.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .errors import MyStoreError
+
+
+MISSING = object()  # returned by caches when there is no (valid) value for a key
+
+
+def get_unit_stamp(unit_path):
+    """
+    Return (modification time, size) of unit at 'unit_path', or None if it doesn't exist.
+    Any write to a unit changes its stamp, so cached values of a unit
+    are only valid as long as its stamp is unchanged.
+    (For units stored as directories only adding/removing files changes the stamp.)
+    """
+    try:
+        stat = os.stat(unit_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class ValueCache:
+    """
+    LRU cache of decoded values, limited by approximate size in bytes.
+    Size of a value is estimated as the size of its raw (DB format) version.
+
+    Values are invalidated when the unit they were read from changes
+    (see 'get_unit_stamp'), so writes by other processes are seen.
+    Values are returned as they are: don't modify them in place.
+
+    Arguments
+    ---------
+    max_bytes: int
+        Maximum total (approximate) size of cached values.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._values = OrderedDict()    # (unit_path, key): (value, size)
+        self._units = {}                # unit_path: [stamp, set of keys]
+        self._lock = threading.Lock()
+
+    def get(self, unit_path, k, stamp):
+        """
+        Return cached value or MISSING.
+        'stamp' is the current stamp of the unit (see 'get_unit_stamp').
+        """
+        with self._lock:
+            unit = self._units.get(unit_path)
+            if unit is not None and unit[0] != stamp:
+                self._invalidate_unit(unit_path)
+                unit = None
+            entry = self._values.get((unit_path, str(k))) if unit is not None else None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self._values.move_to_end((unit_path, str(k)))
+            self.hits += 1
+            return entry[0]
+
+    def put(self, unit_path, k, value, raw, stamp):
+        """
+        Cache value read from unit at 'unit_path' ('raw' is used to estimate its size).
+        'stamp' must be taken before reading the value, so that a concurrent
+        write is never cached as valid.
+        """
+        size = len(raw)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            unit = self._units.get(unit_path)
+            if unit is None or unit[0] != stamp:
+                self._invalidate_unit(unit_path)
+                unit = self._units[unit_path] = [stamp, set()]
+            self._discard((unit_path, str(k)))
+            self._values[(unit_path, str(k))] = (value, size)
+            unit[1].add(str(k))
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                (evicted_path, evicted_k), (_, evicted_size) = self._values.popitem(last=False)
+                self.bytes -= evicted_size
+                self._units[evicted_path][1].discard(evicted_k)
+                self.evictions += 1
+
+    def discard(self, unit_path, k):
+        """ Remove cached value (e.g. when it is overwritten by this process). """
+        with self._lock:
+            self._discard((unit_path, str(k)))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._units.clear()
+            self.bytes = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """ Return dict with cache metrics. """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "values": len(self._values),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes
+        }
+
+    # ******* implementation details *******
+    def _discard(self, value_key):
+        entry = self._values.pop(value_key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+            self._units[value_key[0]][1].discard(value_key[1])
+
+    def _invalidate_unit(self, unit_path):
+        unit = self._units.pop(unit_path, None)
+        if unit is None:
+            return
+        for k in unit[1]:
+            self.bytes -= self._values.pop((unit_path, k))[1]
+        self.invalidations += 1
+
+
+class MappingCache:
+    """
+    In-process cache of user key -> pk mappings of a Storage.
+
+    Mappings are never changed once committed, so cached mappings
+    never need to be invalidated; keys not found are never cached
+    (they could be saved by another process at any time).
+
+    Arguments
+    ---------
+    max_keys: int or None
+        Maximum number of cached mappings, least recently used ones are evicted.
+        None means no limit: used for full snapshots of the mapping table
+        (see Storage.enable_mapping_cache).
+    """
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys
+        self.max_pk = 0             # biggest pk loaded by 'update_snapshot'
+        self.hits = self.misses = self.evictions = 0
+        self._pks = OrderedDict() if max_keys is not None else {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """ Return {key: pk} dict for keys found in cache. """
+        found = {}
+        with self._lock:
+            for k in keys:
+                pk = self._pks.get(k)
+                if pk is None:
+                    self.misses += 1
+                    continue
+                if self.max_keys is not None:
+                    self._pks.move_to_end(k)
+                found[k] = pk
+                self.hits += 1
+        return found
+
+    def put_many(self, pk_map):
+        """ Cache mappings from {key: pk} dict. """
+        with self._lock:
+            self._pks.update(pk_map)
+            if self.max_keys is None:
+                return
+            while len(self._pks) > self.max_keys:
+                self._pks.popitem(last=False)
+                self.evictions += 1
+
+    def update_snapshot(self, rows):
+        """
+        Add (key, pk) rows sorted by pk, remember the biggest pk seen,
+        so only rows with bigger pks need to be loaded next time.
+        """
+        with self._lock:
+            for k, pk in rows:
+                self._pks[k] = pk
+                self.max_pk = max(self.max_pk, pk)
+
+    def clear(self):
+        with self._lock:
+            self._pks.clear()
+            self.max_pk = 0
+
+    def __len__(self):
+        return len(self._pks)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """ Return dict with cache metrics. """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "keys": len(self._pks),
+            "max_keys": self.max_keys,
+            "max_pk": self.max_pk
+        }
+
+
+class SharedValueCache:
+    """
+    Cache of values shared by all processes using the same DB,
+    stored in a memory-mapped file (put it on tmpfs, e.g. /dev/shm, to keep it in RAM).
+
+    The file holds a fixed table of 'slots' slots of 'slot_size' bytes each;
+    values that don't fit in a slot are not cached. The table is 'ways'-way
+    set-associative: a key can be stored in one of 'ways' slots of its set,
+    and the least recently used slot of the set is evicted.
+
+    Values are stored either encoded (store="raw", decoded by 'converter'
+    on every hit, which still saves opening the unit) or decoded and
+    pickled (store="pickle"). Like ValueCache, each value is stored together
+    with the stamp of its unit, and is ignored once the unit changes.
+    Pickled values are loaded from the file as is, so the file is created
+    readable by its owner only: don't share it between users.
+
+    Writers lock a slot (with 'fcntl.lockf') while updating it and skip
+    caching when the slot is locked by someone else; readers never wait
+    and detect concurrent updates with a sequence number (seqlock).
+
+    Arguments
+    ---------
+    path: str
+        Path to cache file. Created if it doesn't exist, otherwise
+        table parameters are read from the existing file.
+    converter: BaseConverter
+        Converter used to decode values (store="raw" only).
+    slots, slot_size, ways: int
+        Table parameters, used when creating a new file.
+    store: str
+        "raw" or "pickle".
+    """
+    MAGIC = b"MYSTORE\x01"
+    HEADER = struct.Struct(">8sIII")                # magic, slots, slot_size, ways
+    HEADER_SIZE = 4096
+    SLOT_HEADER = struct.Struct(">IBxxx8sqqQHI")    # seq, used, key hash, stamp (2), access, key/value length
+    SEQ = struct.Struct(">I")
+    ACCESS = struct.Struct(">Q")
+    ACCESS_OFFSET = 32
+
+    def __init__(self, path, converter=None, slots=16384, slot_size=4096, ways=4, store="pickle"):
+        if store not in ("raw", "pickle"):
+            raise MyStoreError("Unsupported store mode: %s" % store)
+        if store == "raw" and converter is None:
+            raise MyStoreError("Converter is required to store raw values")
+        self.path = path
+        self.converter = converter
+        self.store = store
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._lock = threading.Lock()
+        self._fd, self._mmap = self._open(slots, slot_size, ways)
+        _, self.slots, self.slot_size, self.ways = self.HEADER.unpack_from(self._mmap, 0)
+        self.sets = self.slots // self.ways
+
+    def get(self, unit_path, k, stamp):
+        """ Return cached value or MISSING. """
+        key, key_hash = self._key(unit_path, k)
+        for slot in self._slots_of(key_hash):
+            found = self._read_slot(slot, key, key_hash)
+            if found is None:
+                continue
+            slot_stamp, data = found
+            if slot_stamp != self._pack_stamp(stamp):
+                self.invalidations += 1
+                break
+            self.ACCESS.pack_into(self._mmap, self._offset(slot) + self.ACCESS_OFFSET, self._now())
+            self.hits += 1
+            if self.store == "raw":
+                return self.converter.load(data)
+            return pickle.loads(data)
+        self.misses += 1
+        return MISSING
+
+    def put(self, unit_path, k, value, raw, stamp):
+        """ Cache value read from unit at 'unit_path' (see ValueCache.put). """
+        if stamp is None:
+            return
+        if self.store == "raw":
+            data = raw.encode("utf-8") if isinstance(raw, str) else bytes(raw)
+        else:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        key, key_hash = self._key(unit_path, k)
+        if self.SLOT_HEADER.size + len(key) + len(data) > self.slot_size:
+            return
+        slot = self._choose_slot(key, key_hash)
+        self._write_slot(slot, key, key_hash, self._pack_stamp(stamp), data)
+
+    def discard(self, unit_path, k):
+        """ Remove cached value (best effort: stamps make sure stale values aren't used). """
+        key, key_hash = self._key(unit_path, k)
+        for slot in self._slots_of(key_hash):
+            if self._read_slot(slot, key, key_hash) is not None:
+                self._write_slot(slot, None, None, None, None)
+
+    def clear(self):
+        for slot in range(self.slots):
+            self._write_slot(slot, None, None, None, None)
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """ Return dict with cache metrics (of this process only). """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "slots": self.slots,
+            "slot_size": self.slot_size
+        }
+
+    # ******* implementation details *******
+    def _open(self, slots, slot_size, ways):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)  # only one process initializes the file
+        try:
+            if os.fstat(fd).st_size == 0:
+                slots -= slots % ways
+                os.ftruncate(fd, self.HEADER_SIZE + slots * slot_size)   # sparse file
+                os.pwrite(fd, self.HEADER.pack(self.MAGIC, slots, slot_size, ways), 0)
+            m = mmap.mmap(fd, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        if self.HEADER.unpack_from(m, 0)[0] != self.MAGIC:
+            m.close()
+            os.close(fd)
+            raise MyStoreError("Not a shared cache file: %s" % self.path)
+        return fd, m
+
+    @staticmethod
+    def _key(unit_path, k):
+        key = ("%s\0%s" % (unit_path, k)).encode("utf-8")
+        return key, hashlib.md5(key).digest()[:8]
+
+    @staticmethod
+    def _pack_stamp(stamp):
+        return tuple(stamp) if stamp is not None else (-1, -1)
+
+    @staticmethod
+    def _now():
+        return int(time.monotonic() * 1000000)
+
+    def _offset(self, slot):
+        return self.HEADER_SIZE + slot * self.slot_size
+
+    def _slots_of(self, key_hash):
+        first = (int.from_bytes(key_hash, "big") % self.sets) * self.ways
+        return range(first, first + self.ways)
+
+    def _read_slot(self, slot, key, key_hash):
+        """ Return (stamp, data) if slot holds 'key', None otherwise. """
+        offset = self._offset(slot)
+        seq, used, slot_hash, mtime, size, _, key_len, data_len = \
+            self.SLOT_HEADER.unpack_from(self._mmap, offset)
+        if seq % 2 or not used or slot_hash != key_hash:
+            return None
+        start = offset + self.SLOT_HEADER.size
+        if key_len + data_len > self.slot_size - self.SLOT_HEADER.size:
+            return None     # torn read
+        slot_key = self._mmap[start:start + key_len]
+        data = self._mmap[start + key_len:start + key_len + data_len]
+        if self.SEQ.unpack_from(self._mmap, offset)[0] != seq or slot_key != key:
+            return None     # updated while reading or hash collision
+        return (mtime, size), data
+
+    def _choose_slot(self, key, key_hash):
+        """ Return slot holding 'key' already, free slot or least recently used one. """
+        candidates = []
+        for slot in self._slots_of(key_hash):
+            offset = self._offset(slot)
+            _, used, slot_hash, _, _, access, _, _ = self.SLOT_HEADER.unpack_from(self._mmap, offset)
+            if not used or (slot_hash == key_hash and self._read_slot(slot, key, key_hash)):
+                return slot
+            candidates.append((access, slot))
+        self.evictions += 1
+        return min(candidates)[1]
+
+    def _write_slot(self, slot, key, key_hash, stamp, data):
+        """ Write slot content (or mark it unused if key is None), skip if locked. """
+        offset = self._offset(slot)
+        with self._lock:    # fcntl locks don't exclude threads of the same process
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, self.slot_size, offset)
+            except OSError:
+                return
+            try:
+                seq, = self.SEQ.unpack_from(self._mmap, offset)
+                self.SEQ.pack_into(self._mmap, offset, seq + 1)         # odd: being updated
+                if key is None:
+                    self.SLOT_HEADER.pack_into(self._mmap, offset, seq + 1, 0, b"", 0, 0, 0, 0, 0)
+                else:
+                    start = offset + self.SLOT_HEADER.size
+                    self._mmap[start:start + len(key)] = key
+                    self._mmap[start + len(key):start + len(key) + len(data)] = data
+                    self.SLOT_HEADER.pack_into(self._mmap, offset, seq + 1, 1, key_hash,
+                        stamp[0], stamp[1], self._now(), len(key), len(data))
+                self.SEQ.pack_into(self._mmap, offset, (seq + 2) % 2**32)  # even: stable
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
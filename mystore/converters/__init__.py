@@ -9,6 +9,18 @@ from .base import BaseConverter
 from . import handlers
 from .classes import (
     FakeConverter,
+    JsonConverter,
     CompressedJsonConverter,
-    Base64CompressedJsonConverter
+    Base64CompressedJsonConverter,
+    OrjsonConverter,
+    CompressedOrjsonConverter,
+    MsgpackConverter,
+    CompressedMsgpackConverter
 )
+from .zdict import ZdictCompressedJsonConverter
+try:
+    import numpy
+except ImportError:
+    pass
+else:
+    from .arrays import NumpyConverter, CompressedNumpyConverter
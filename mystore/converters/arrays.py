@@ -0,0 +1,147 @@
+"""
+This module contains handlers and converters for NumPy arrays.
+Requires numpy as an extra dependency.
+
+Values are stored as a small header followed by raw array buffers
+(aligned to ALIGNMENT bytes), and loaded with 'numpy.frombuffer'
+directly on the bytes returned by the unit, i.e. without copying data.
+Loaded arrays are therefore read-only views; call '.copy()' to modify them.
+
+Supported values:
+    - a single array (kind b"a");
+    - dict of arrays with string keys (kind b"d");
+    - any other picklable object (kind b"p"): pickled with protocol 5,
+      array buffers are stored out-of-band and loaded without copying
+      (on Python < 3.8 arrays are pickled in-band).
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import sys
+import json
+import struct
+import pickle
+
+import numpy as np
+
+from .base import BaseConverter
+from . import handlers
+from mystore.errors import MyStoreError
+
+
+ALIGNMENT = 16
+HEADER_LENGTH = struct.Struct(">I")
+ARRAY, DICT, PICKLE = b"a", b"d", b"p"
+OUT_OF_BAND = sys.version_info >= (3, 8)
+
+
+def _padding(n):
+    return -n % ALIGNMENT
+
+
+def _pack(kind, header, buffers):
+    """ Join kind, JSON header and buffers (each aligned to ALIGNMENT). """
+    header = json.dumps(header).encode("utf-8")
+    prefix_length = 1 + HEADER_LENGTH.size + len(header)
+    parts = [kind, HEADER_LENGTH.pack(len(header)), header, b"\0" * _padding(prefix_length)]
+    for buf in buffers:
+        parts += [buf, b"\0" * _padding(memoryview(buf).nbytes)]
+    return b"".join(parts)
+
+
+def _unpack(v):
+    """ Return kind, JSON header and memoryview of data section. """
+    mv = memoryview(v)
+    kind = bytes(mv[:1])
+    header_length, = HEADER_LENGTH.unpack_from(mv, 1)
+    start = 1 + HEADER_LENGTH.size
+    header = json.loads(bytes(mv[start:start + header_length]).decode("utf-8"))
+    data_start = start + header_length
+    data_start += _padding(data_start)
+    return kind, header, mv[data_start:]
+
+
+def _buffer_layout(sizes):
+    """ Return offsets of consecutive aligned buffers of given sizes. """
+    offsets, offset = [], 0
+    for size in sizes:
+        offsets.append(offset)
+        offset += size + _padding(size)
+    return offsets
+
+
+def _is_plain_array(v):
+    """
+    Return True if array is fully described by 'dtype.str' and shape.
+    Structured/void dtypes ('dtype.str' drops field names and types),
+    object dtypes and ndarray subclasses (e.g. masked arrays) are pickled.
+    """
+    return type(v) is np.ndarray and not v.dtype.hasobject and v.dtype.kind != "V"
+
+
+def arrays_to_binary(v):
+    """ Convert array, dict of arrays or any picklable object to binary value. """
+    if _is_plain_array(v):
+        v = np.require(v, requirements="C")     # keeps 0-d arrays 0-d
+        header = {"dtype": v.dtype.str, "shape": list(v.shape)}
+        return _pack(ARRAY, header, [v.data])
+
+    if isinstance(v, dict) and v and all(isinstance(k, str) and _is_plain_array(a)
+                                         for k, a in v.items()):
+        names = list(v.keys())
+        arrays = [np.require(v[name], requirements="C") for name in names]
+        offsets = _buffer_layout(a.nbytes for a in arrays)
+        header = {"arrays": [[name, a.dtype.str, list(a.shape), offset]
+                             for name, a, offset in zip(names, arrays, offsets)]}
+        return _pack(DICT, header, [a.data for a in arrays])
+
+    buffers = []
+    if OUT_OF_BAND:
+        data = pickle.dumps(v, protocol=5, buffer_callback=buffers.append)
+        buffers = [b.raw() for b in buffers]
+    else:
+        data = pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)
+    sizes = [len(data)] + [b.nbytes for b in buffers]
+    header = {"offsets": _buffer_layout(sizes), "sizes": sizes}
+    return _pack(PICKLE, header, [data] + buffers)
+
+
+def arrays_from_binary(v):
+    """ Load array, dict of arrays or pickled object from binary value without copying. """
+    kind, header, data = _unpack(v)
+
+    if kind == ARRAY:
+        dtype = np.dtype(header["dtype"])
+        count = int(np.prod(header["shape"], dtype=np.int64))
+        return np.frombuffer(data, dtype, count).reshape(header["shape"])
+
+    if kind == DICT:
+        result = {}
+        for name, dtype, shape, offset in header["arrays"]:
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            result[name] = np.frombuffer(data, dtype, count, offset).reshape(shape)
+        return result
+
+    if kind == PICKLE:
+        views = [data[offset:offset + size]
+                 for offset, size in zip(header["offsets"], header["sizes"])]
+        if OUT_OF_BAND:
+            return pickle.loads(views[0], buffers=views[1:])
+        return pickle.loads(views[0])
+
+    raise MyStoreError("Unknown array value kind: %r" % kind)
+
+
+class NumpyConverter(BaseConverter):
+    """ Convert NumPy arrays (or dicts of them, or objects containing them)
+        to/from header + raw buffers, loaded without copying. """
+    DUMP_HANDLERS = [arrays_to_binary]
+    LOAD_HANDLERS = [arrays_from_binary]
+
+
+class CompressedNumpyConverter(BaseConverter):
+    """ Same as NumpyConverter, but values are compressed with zlib
+        (so loading makes one copy of data when decompressing). """
+    DUMP_HANDLERS = [arrays_to_binary, handlers.bytes_to_compressed_bytes]
+    LOAD_HANDLERS = [handlers.bytes_from_compressed_bytes, arrays_from_binary]
@@ -5,6 +5,40 @@ for converting values into and from the format used to store them on disk.
 import logging
 lg = logging.getLogger(__name__)
 
+import os
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+_executors = {}     # (owner pid, number of processes): process pool
+_executors_lock = threading.Lock()
+
+
+def get_executor(processes):
+    """
+    Return process pool with specified number of processes.
+    Pools are created on first use, reused (forked children create their own)
+    and shut down by 'shutdown_executors' (at the latest on interpreter exit).
+    """
+    key = (os.getpid(), processes)
+    with _executors_lock:
+        if key not in _executors:
+            _executors[key] = ProcessPoolExecutor(processes)
+        return _executors[key]
+
+
+def shutdown_executors():
+    """ Shut down process pools created by this process (they are recreated if needed). """
+    with _executors_lock:
+        own = [key for key in _executors if key[0] == os.getpid()]
+        executors = [_executors.pop(key) for key in own]
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+atexit.register(shutdown_executors)
+
 
 class BaseConverter:
     """
@@ -14,6 +48,10 @@ class BaseConverter:
     """
     DUMP_HANDLERS = []
     LOAD_HANDLERS = []
+    # batches of this size or bigger are converted by a process pool
+    # (if more than one process is requested by the caller),
+    # None disables parallel conversion (e.g. for cheap conversions):
+    PARALLEL_THRESHOLD = 2000
 
     def __init__(self, dump_handlers=None, load_handlers=None):
         """
@@ -25,6 +63,15 @@ class BaseConverter:
             self._dump_handlers = self.__class__.DUMP_HANDLERS
         if load_handlers is None:
             self._load_handlers = self.__class__.LOAD_HANDLERS
+        self.root = None
+
+    def attach(self, root):
+        """
+        Called by DB with its root directory right after the converter is created.
+        Most converters are stateless and ignore it; converters which keep
+        extra files in DB directory (e.g. compression dictionaries) load them here.
+        """
+        self.root = root
 
     def dump(self, v):
         """ Convert Python object to format ready to be written to DB. """
@@ -37,3 +84,30 @@ class BaseConverter:
         for handler in self._load_handlers:
             v = handler(v)
         return v
+
+    def dump_many(self, values, processes=None):
+        """
+        Convert list of Python objects to format ready to be written to DB.
+        Return list of converted values in the same order.
+        Big lists are converted by a pool of 'processes' processes
+        (if given, conversion is serial by default).
+        """
+        return self._map(self.dump, values, processes)
+
+    def load_many(self, values, processes=None):
+        """
+        Convert list of values from format stored in DB to Python objects.
+        Return list of loaded objects in the same order.
+        Big lists are converted by a pool of 'processes' processes
+        (if given, conversion is serial by default).
+        """
+        return self._map(self.load, values, processes)
+
+    # ******* implementation details *******
+    def _map(self, func, values, processes):
+        values = list(values)
+        threshold = self.PARALLEL_THRESHOLD
+        if threshold is None or len(values) < threshold or not processes or processes == 1:
+            return [func(v) for v in values]
+        chunksize = max(1, len(values) // (processes * 4))
+        return list(get_executor(processes).map(func, values, chunksize=chunksize))
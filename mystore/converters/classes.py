@@ -12,6 +12,14 @@ class FakeConverter(BaseConverter):
     """ No conversion done, values are raw bytes. """
     DUMP_HANDLERS = []
     LOAD_HANDLERS = []
+    PARALLEL_THRESHOLD = None
+
+
+class JsonConverter(BaseConverter):
+    """ Convert Python objects to/from uncompressed binary JSON objects
+        (for units compressing values themselves, e.g. BlockUnit). """
+    DUMP_HANDLERS = [handlers.object_to_json_binary]
+    LOAD_HANDLERS = [handlers.object_from_json_binary]
 
 
 class CompressedJsonConverter(BaseConverter):
@@ -25,3 +33,30 @@ class Base64CompressedJsonConverter(BaseConverter):
         text strings of compressed JSON objects. """
     DUMP_HANDLERS = [handlers.object_to_compressed_json_binary, handlers.bytes_to_base64_string]
     LOAD_HANDLERS = [handlers.bytes_from_base64_string, handlers.object_from_compressed_json_binary]
+
+
+class OrjsonConverter(BaseConverter):
+    """ Convert Python objects to/from binary JSON objects with orjson
+        (or stdlib json if orjson isn't installed). """
+    DUMP_HANDLERS = [handlers.object_to_orjson_binary]
+    LOAD_HANDLERS = [handlers.object_from_orjson_binary]
+
+
+class CompressedOrjsonConverter(BaseConverter):
+    """ Convert Python objects to/from compressed JSON objects with orjson.
+        Same format as CompressedJsonConverter, so stores can switch
+        between the two without reformatting. """
+    DUMP_HANDLERS = [handlers.object_to_compressed_orjson_binary]
+    LOAD_HANDLERS = [handlers.object_from_compressed_orjson_binary]
+
+
+class MsgpackConverter(BaseConverter):
+    """ Convert Python objects to/from MessagePack (requires msgpack). """
+    DUMP_HANDLERS = [handlers.object_to_msgpack_binary]
+    LOAD_HANDLERS = [handlers.object_from_msgpack_binary]
+
+
+class CompressedMsgpackConverter(BaseConverter):
+    """ Convert Python objects to/from compressed MessagePack (requires msgpack). """
+    DUMP_HANDLERS = [handlers.object_to_compressed_msgpack_binary]
+    LOAD_HANDLERS = [handlers.object_from_compressed_msgpack_binary]
@@ -1,6 +1,10 @@
 """
 This module contains available handler functions which
 can convert values to all kinds of formats used to store them on disk.
+
+Optional dependencies:
+- orjson (faster JSON, falls back to stdlib json when not installed);
+- msgpack (MyStoreError is raised on use when not installed).
 """
 import logging
 lg = logging.getLogger(__name__)
@@ -8,7 +12,19 @@ lg = logging.getLogger(__name__)
 import os
 import gzip
 import json
+import math
+import zlib
 import base64
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from mystore.errors import MyStoreError
 
 
 def object_to_compressed_json_binary(v):
@@ -34,3 +50,105 @@ def bytes_to_base64_string(v):
 def bytes_from_base64_string(v):
     """ Convert base64 encoded text string to bytes. """
     return base64.decodebytes(v.encode('ascii'))
+
+
+def bytes_to_compressed_bytes(v):
+    """ Compress binary value with zlib. """
+    return zlib.compress(v)
+
+
+def bytes_from_compressed_bytes(v):
+    """ Decompress binary value compressed with zlib. """
+    return zlib.decompress(v)
+
+
+def object_to_json_binary(v):
+    """ Convert JSONifiable object to (uncompressed) binary value. """
+    return json.dumps(v).encode("utf-8")
+
+
+def object_from_json_binary(v):
+    """ Load JSON object from (uncompressed) binary value. """
+    try:
+        v = json.loads(v.decode())
+    except UnicodeDecodeError:
+        lg.warning("UnicodeDecodeError while decoding value")
+        v = json.loads(v.decode(errors="replace"))
+    return v
+
+
+def object_to_orjson_binary(v):
+    """
+    Convert JSONifiable object to binary value with orjson.
+    If orjson is missing, stdlib json produces the same output: compact,
+    non-ASCII characters unescaped and non-finite floats (NaN, Infinity)
+    stored as null (so they are loaded back as None).
+    """
+    if orjson is None:
+        try:
+            s = json.dumps(v, separators=(",", ":"), ensure_ascii=False, allow_nan=False)
+        except ValueError:  # non-finite floats
+            s = json.dumps(_replace_non_finite(v), separators=(",", ":"), ensure_ascii=False)
+        return s.encode("utf-8")
+    return orjson.dumps(v, option=orjson.OPT_NON_STR_KEYS)
+
+
+def object_from_orjson_binary(v):
+    """ Load JSON object from binary value with orjson (or stdlib json). """
+    if orjson is None:
+        return object_from_json_binary(v)
+    return orjson.loads(v)
+
+
+def object_to_compressed_orjson_binary(v):
+    """
+    Convert JSONifiable object to compressed binary value with orjson.
+    Compatible with 'object_from_compressed_json_binary'.
+    """
+    return gzip.compress(object_to_orjson_binary(v))
+
+
+def object_from_compressed_orjson_binary(v):
+    """
+    Load JSON object from compressed binary value with orjson.
+    Compatible with 'object_to_compressed_json_binary'.
+    """
+    return object_from_orjson_binary(gzip.decompress(v))
+
+
+def _replace_non_finite(v):
+    """ Return copy of JSONifiable object with NaN and infinite floats replaced by None. """
+    if isinstance(v, float):
+        return v if math.isfinite(v) else None
+    if isinstance(v, dict):
+        return {k: _replace_non_finite(item) for k, item in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_replace_non_finite(item) for item in v]
+    return v
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise MyStoreError("msgpack is not installed: pip install msgpack")
+
+
+def object_to_msgpack_binary(v):
+    """ Convert object to MessagePack binary value. """
+    _require_msgpack()
+    return msgpack.packb(v, use_bin_type=True)
+
+
+def object_from_msgpack_binary(v):
+    """ Load object from MessagePack binary value. """
+    _require_msgpack()
+    return msgpack.unpackb(v, raw=False, strict_map_key=False)
+
+
+def object_to_compressed_msgpack_binary(v):
+    """ Convert object to compressed MessagePack binary value. """
+    return bytes_to_compressed_bytes(object_to_msgpack_binary(v))
+
+
+def object_from_compressed_msgpack_binary(v):
+    """ Load object from compressed MessagePack binary value. """
+    return object_from_msgpack_binary(bytes_from_compressed_bytes(v))
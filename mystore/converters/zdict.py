@@ -0,0 +1,164 @@
+"""
+This module contains ZdictCompressedJsonConverter, a converter
+compressing JSON values with a zlib preset dictionary ('zdict').
+
+Small JSON documents sharing the same field names compress poorly one by one:
+there is not enough data in a single value for deflate to find repetitions.
+A preset dictionary trained on sample values provides these repetitions upfront.
+
+Dictionaries are stored in DB directory (ZDICT_DIRNAME subfolder),
+each value starts with the id of the dictionary it was compressed with,
+so dictionaries can be retrained without rewriting existing values.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import re
+import zlib
+import struct
+import itertools
+from collections import Counter
+
+from .base import BaseConverter
+from . import handlers
+from mystore.errors import MyStoreError
+
+
+ZDICT_DIRNAME = "zdicts"
+ZDICT_EXTENSION = ".zdict"
+ZDICT_MAX_SIZE = 32 * 1024      # deflate window size, longer dictionaries are useless
+HEADER = struct.Struct(">H")    # dictionary id, 0 stands for 'no dictionary'
+
+# JSON object keys (with the following colon) and string values:
+TOKEN_RE = re.compile(rb'"(?:[^"\\]|\\.)*"(?:\s*:\s*)?')
+
+
+def train_zdict(samples, size=ZDICT_MAX_SIZE):
+    """
+    Build zlib preset dictionary from sample binary values.
+
+    Tokens (JSON keys and strings) found in most samples are kept,
+    the most valuable ones are put at the end of the dictionary
+    as deflate encodes closer matches with fewer bits.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(TOKEN_RE.findall(sample)))
+
+    # tokens seen once only are noise:
+    scored = [(n * len(token), token) for token, n in counts.items() if n > 1]
+    scored.sort(reverse=True)
+
+    chosen, total = [], 0
+    for score, token in scored:
+        if total + len(token) > size:
+            continue
+        chosen.append(token)
+        total += len(token)
+    return b"".join(reversed(chosen))
+
+
+class ZdictCompressedJsonConverter(BaseConverter):
+    """
+    Convert Python objects to/from JSON objects compressed
+    with a preset dictionary trained on sample values (see 'train' method).
+    Until a dictionary is trained, values are compressed without one.
+    """
+    DUMP_HANDLERS = [handlers.object_to_json_binary]
+    LOAD_HANDLERS = [handlers.object_from_json_binary]
+    LEVEL = 6
+
+    def __init__(self, dump_handlers=None, load_handlers=None):
+        super().__init__(dump_handlers, load_handlers)
+        self._zdicts = {0: None}    # id: dictionary bytes
+        self._zdict_id = 0          # dictionary used to compress new values
+
+    def attach(self, root):
+        super().attach(root)
+        self._load_zdicts()
+
+    @property
+    def zdict_dir(self):
+        if self.root is None:
+            raise MyStoreError("Converter is not attached to a DB")
+        return os.path.join(self.root, ZDICT_DIRNAME)
+
+    def dump(self, v):
+        v = super().dump(v)
+        zdict = self._zdicts[self._zdict_id]
+        if zdict is None:
+            compressor = zlib.compressobj(self.LEVEL, zlib.DEFLATED, -15)
+        else:
+            compressor = zlib.compressobj(self.LEVEL, zlib.DEFLATED, -15, zdict=zdict)
+        return HEADER.pack(self._zdict_id) + compressor.compress(v) + compressor.flush()
+
+    def load(self, v):
+        zdict_id, = HEADER.unpack_from(v)
+        zdict = self._get_zdict(zdict_id)
+        if zdict is None:
+            decompressor = zlib.decompressobj(-15)
+        else:
+            decompressor = zlib.decompressobj(-15, zdict=zdict)
+        v = decompressor.decompress(memoryview(v)[HEADER.size:])
+        if not decompressor.eof:
+            raise MyStoreError("Truncated compressed value (dictionary %s)" % zdict_id)
+        return super().load(v)
+
+    def train(self, values, max_samples=1000, size=ZDICT_MAX_SIZE):
+        """
+        Train a new dictionary on sample values (Python objects),
+        save it in DB directory and use it for all values dumped from now on.
+        Return id of the new dictionary.
+        """
+        samples = [super(ZdictCompressedJsonConverter, self).dump(v)
+                   for v in itertools.islice(values, max_samples)]
+        zdict = train_zdict(samples, size)
+        zdict_id = self._save_zdict(zdict)
+        self._zdicts[zdict_id] = zdict
+        self._zdict_id = zdict_id
+        lg.info("trained dictionary %s (%s bytes) on %s samples",
+                zdict_id, len(zdict), len(samples))
+        return zdict_id
+
+    # ******* implementation details *******
+    def _get_zdict(self, zdict_id):
+        if zdict_id not in self._zdicts:
+            # could have been trained by another process after we loaded ours:
+            self._load_zdicts()
+            if zdict_id not in self._zdicts:
+                raise MyStoreError("Unknown compression dictionary: %s" % zdict_id)
+        return self._zdicts[zdict_id]
+
+    def _load_zdicts(self):
+        if not os.path.isdir(self.zdict_dir):
+            return
+        for fn in os.listdir(self.zdict_dir):
+            name, ext = os.path.splitext(fn)
+            if ext != ZDICT_EXTENSION:
+                continue
+            with open(os.path.join(self.zdict_dir, fn), "rb") as f:
+                self._zdicts[int(name)] = f.read()
+        self._zdict_id = max(self._zdicts)
+
+    def _save_zdict(self, zdict):
+        try:
+            os.makedirs(self.zdict_dir)
+        except FileExistsError:
+            pass
+        tmp_path = os.path.join(self.zdict_dir, "tmp.%s" % os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(zdict)
+        zdict_id = max(self._zdicts) + 1
+        try:
+            while True:
+                path = os.path.join(self.zdict_dir, "%s%s" % (zdict_id, ZDICT_EXTENSION))
+                try:
+                    # link fails if the id is taken by another process training concurrently
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    zdict_id += 1
+                else:
+                    return zdict_id
+        finally:
+            os.remove(tmp_path)
@@ -5,7 +5,14 @@ responsible for reading/writing data to the DB.
 import logging
 lg = logging.getLogger(__name__)
 
+import os
+import queue
+import itertools
+import threading
+
 from .errors import BaseUnitDoesNotExist
+from .cache import MISSING, get_unit_stamp
+from .wal import claim_orphan_segments, remove_segments
 
 
 class DummyThreadLock:
@@ -15,11 +22,69 @@ class DummyThreadLock:
         return
 
 
+_NOT_LOADED = object()
+
+
+class LazyValue:
+    """
+    Proxy for a value read from DB, converted to Python object
+    on first access (to 'value' attribute or through the proxy itself).
+    Original value in DB format is available as 'raw'.
+    """
+    __slots__ = ("raw", "_converter", "_value")
+
+    def __init__(self, raw, converter):
+        self.raw = raw
+        self._converter = converter
+        self._value = _NOT_LOADED
+
+    @property
+    def value(self):
+        if self._value is _NOT_LOADED:
+            self._value = self._converter.load(self.raw)
+        return self._value
+
+    @property
+    def is_loaded(self):
+        return self._value is not _NOT_LOADED
+
+    def __getattr__(self, name):
+        return getattr(self.value, name)
+
+    def __getitem__(self, k):
+        return self.value[k]
+
+    def __contains__(self, k):
+        return k in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyValue):
+            other = other.value
+        return self.value == other
+
+    def __repr__(self):
+        if self.is_loaded:
+            return "<LazyValue %r>" % (self._value,)
+        return "<LazyValue (not loaded)>"
+
+
 class Cursor:
-    def __init__(self, db, mode, threadlock=None):
+    BATCH_SIZE = 10000  # max number of values converted at once by batch methods
+
+    def __init__(self, db, mode, threadlock=None, processes=None):
         self.db = db
         self.mode = mode
         self.threadlock = DummyThreadLock() if not threadlock else threadlock
+        self.processes = processes  # used to convert big batches of values
         self._unit = None   # currently opened file
 
     def __enter__(self):
@@ -32,7 +97,24 @@ class Cursor:
         self._close_opened_unit()
         delattr(self, "_unit")
 
+    def release_unit(self):
+        """
+        Close currently opened unit (so other processes can write to it),
+        the cursor reopens units on next access.
+        """
+        with self.threadlock:
+            self._close_opened_unit()
+
     # ******* implementation details *******
+    def _open_unit(self, unit_path):
+        """ Return unit at 'unit_path', reuse currently opened one if possible. """
+        if self._unit and (self._unit.path == unit_path):
+            lg.debug("file already open, skipping")
+        else:
+            self._close_opened_unit()
+            self._unit = self.db.unit_cls(unit_path, mode=self.mode)
+        return self._unit
+
     def _close_opened_unit(self):
         if self._unit is not None:
             lg.debug("closing old file handle")
@@ -41,34 +123,251 @@ class Cursor:
 
 
 class Writer(Cursor):
-    def __init__(self, db, mode="W", threadlock=None):
-        super().__init__(db, mode, threadlock)
+    """
+    Cursor writing to DB units.
+    If DB has a write-ahead log (see DB.enable_wal), writes are logged
+    and applied to units in batches of up to BATCH_SIZE records, on 'flush'
+    and on close. Until then they are not visible to readers.
+    """
+    def __init__(self, db, mode="W", threadlock=None, processes=None):
+        super().__init__(db, mode, threadlock, processes)
+        self.wal = db.wal
+        self._pending = []  # (sequence number, lsn, record) logged to WAL, but not applied yet
+        self._deleted = {}  # unit path: number of keys deleted (see DB.enable_auto_compact)
 
     def __setitem__(self, k, v):
-        filepath = self.db.router.get_path(k)
+        raw = self.db.converter.dump(v)
+        if self.wal is not None:
+            self._log([("s", k, raw)])
+        else:
+            self._set_raw(k, raw)
+
+    def __delitem__(self, k):
+        if self.wal is not None:
+            self._flush()   # so that only this delete is counted below
+            self._log([("d", k, None)])
+            deleted = self._flush()
+        else:
+            deleted = self._delete(k)
+        if not deleted:
+            raise KeyError(k)
+
+    def close(self):
+        if self.wal is not None:
+            self._flush()
+        super().close()
+        if self._deleted:
+            self.db._on_keys_deleted(self._deleted)
+            self._deleted = {}
+
+    def flush(self):
+        """ Apply writes logged to WAL to units (no-op without WAL). """
+        self._flush()
+
+    def apply(self, records):
+        """
+        Apply (op, key, raw value) records to units right away, bypassing WAL
+        (e.g. records logged elsewhere), and sync changed units.
+        "s" records set raw values (in DB format), "d" records delete keys.
+        Return number of keys deleted.
+        """
+        return self._apply_records(records)
+
+    def set_many(self, items):
+        """
+        Set many key:value pairs at once.
+        Values are converted in batches (by a process pool for big batches)
+        and written sorted by unit to minimize open/close calls.
+        """
+        items = iter(items)
+        while True:
+            batch = list(itertools.islice(items, self.BATCH_SIZE))
+            if not batch:
+                return
+            raw_values = self.db.converter.dump_many((v for k,v in batch), self.processes)
+            self.db.refresh()
+            paths_and_items = sorted(
+                ((self.db.router.get_path(k), k, raw) for (k, _), raw in zip(batch, raw_values)),
+                key=lambda x:x[0])
+            if self.wal is not None:
+                self._log([("s", k, raw) for path, k, raw in paths_and_items])
+                continue
+            for path, k, raw in paths_and_items:
+                self._set_raw(k, raw, path)
+
+    def delete_many(self, keys):
+        """
+        Delete many keys at once (sorted by unit), missing keys are ignored.
+        Return number of keys deleted.
+        Deleted values keep taking space in some unit types until 'DB.compact'.
+        """
+        if self.wal is not None:
+            self._log([("d", k, None) for k in keys])
+            return self._flush()
+        self.db.refresh()
+        paths_and_keys = sorted(((self.db.router.get_path(k), k) for k in keys),
+                                key=lambda x:x[0])
+        return sum(1 for path, k in paths_and_keys if self._delete(k))
+
+    # ******* implementation details *******
+    def _set_raw(self, k, raw, unit_path=None):
+        """
+        Write value already converted to DB format,
+        return path of the unit it was written to.
+        Routing is refreshed only when a unit is opened
+        (see '_open_routed_unit'), not on every write.
+        """
+        if unit_path is None:
+            unit_path = self.db.router.get_path(k)
         with self.threadlock:
-            if self._unit and (self._unit.path == filepath):
-                lg.debug("file already open, skipping")
+            while True:
+                unit = self._open_routed_unit(k, unit_path)
+                if unit is not None:
+                    unit[k] = raw
+                    break
+                unit_path = self.db.router.get_path(k)     # rerouted meanwhile
+        if self.db.cache is not None:
+            self.db.cache.discard(unit_path, k)
+        return unit_path
+
+    def _delete(self, k):
+        """
+        Delete key from its unit and from router fallback paths
+        (so an older value can't show up again).
+        Return list of paths it was deleted from (empty if it wasn't found).
+        """
+        deleted = []
+        done = set()
+        while True:
+            router = self.db.router
+            for path in [router.get_path(k)] + router.get_fallback_paths(k):
+                if path in done or not os.path.exists(path):
+                    continue    # don't create units in write mode
+                with self.threadlock:
+                    unit = self._open_routed_unit(k, path, fallbacks=True)
+                    if unit is None:
+                        break   # rerouted meanwhile (router is refreshed), start over
+                    try:
+                        del unit[k]
+                        deleted.append(path)
+                        self._deleted[path] = self._deleted.get(path, 0) + 1
+                    except KeyError:
+                        pass
+                done.add(path)
+                if self.db.cache is not None:
+                    self.db.cache.discard(path, k)
             else:
-                self._close_opened_unit()
-                self._unit = self.db.unit_cls(filepath, mode=self.mode)
-            self._unit[k] = self.db.converter.dump(v)
+                return deleted
+
+    def _open_routed_unit(self, k, unit_path, fallbacks=False):
+        """
+        Return unit at 'unit_path' for writing 'k' (currently opened one
+        if possible) or None if 'k' is not routed there anymore
+        (see SplittingRouter.rebalance and DB.relayout).
+
+        Routing is checked again once the unit is locked, as the unit
+        may be split or moved while we wait for its lock. Such units
+        are left empty or created again by opening them, so we remove
+        empty ones. Units that are not locked in "W" mode
+        (e.g. DirUnit) can't be checked this way.
+        """
+        if self._unit and self._unit.path == unit_path:
+            return self._unit
+        if unit_path not in self._get_routed_paths(k, fallbacks):
+            return None
+        unit = self._open_unit(unit_path)
+        if self.db.refresh() and unit_path not in self._get_routed_paths(k, fallbacks):
+            lg.debug("%s was rerouted while waiting for its lock", unit_path)
+            if not unit.keys():
+                self.db.unit_cls.destroy(unit_path)
+            self._close_opened_unit()
+            return None
+        return unit
+
+    def _get_routed_paths(self, k, fallbacks=False):
+        router = self.db.router
+        if fallbacks:
+            return [router.get_path(k)] + router.get_fallback_paths(k)
+        return [router.get_path(k)]
+
+    def _log(self, records):
+        """ Make records durable in WAL, apply them once there are enough. """
+        seq, lsn = self.wal.append(records)
+        self.wal.commit(lsn)
+        first_lsn = lsn - len(records) + 1
+        with self.threadlock:
+            self._pending.extend((seq, first_lsn + i, record) for i, record in enumerate(records))
+            full = len(self._pending) >= self.BATCH_SIZE
+        if full:
+            self._flush()
+
+    def _flush(self):
+        """
+        Apply pending records, return number of keys deleted.
+        Records left in WAL by crashed processes are applied with them
+        (in order of sequence numbers), so they are never applied
+        over newer writes later (see mystore.wal).
+        """
+        with self.threadlock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        orphans = claim_orphan_segments(self.wal.wal_dir)
+        entries = [(seq, True, record) for seq, lsn, record in pending]
+        entries += [(seq, False, record) for path, f, orphan_entries in orphans
+                    for seq, record in orphan_entries]
+        entries.sort(key=lambda e:e[0])
+        deleted = 0
+        for own, group in itertools.groupby(entries, key=lambda e:e[1]):
+            group_deleted = self._apply_records([record for seq, _, record in group])
+            if own:
+                deleted += group_deleted
+        remove_segments(orphans)
+        self.wal.applied([lsn for seq, lsn, record in pending])
+        return deleted
+
+    def _apply_records(self, records):
+        """
+        Apply (op, key, raw value) records (sorted by unit, the order of records
+        of the same key is kept) and sync changed units.
+        Return number of keys deleted.
+        """
+        self.db.refresh()
+        router = self.db.router
+        records = sorted(((router.get_path(k), op, k, raw) for op, k, raw in records),
+                         key=lambda x:x[0])
+        changed_paths = set()
+        deleted = 0
+        for path, op, k, raw in records:
+            if op == "s":
+                changed_paths.add(self._set_raw(k, raw, path))
+            else:
+                paths = self._delete(k)
+                deleted += bool(paths)
+                changed_paths.update(paths)
+        self.release_unit()    # some units only write their files on close
+        for path in sorted(changed_paths):
+            self.db.unit_cls.sync(path)
+        return deleted
 
 
 class Reader(Cursor):
-    def __init__(self, db, mode="W", threadlock=None):
-        super().__init__(db, mode, threadlock)
+    def __init__(self, db, mode="W", threadlock=None, processes=None):
+        super().__init__(db, mode, threadlock, processes)
 
     def __getitem__(self, k):
+        cache = self.db.cache
+        if cache is None:
+            return self.db.converter.load(self._get_raw(k))
+
         unit_path = self.db.router.get_path(k)
-        with self.threadlock:
-            if self._unit and (self._unit.path == unit_path):
-                lg.debug("file already open, skipping")
-            else:
-                self._close_opened_unit()
-                self._unit = self.db.unit_cls(unit_path, mode=self.mode)
-            v = self._unit[k]
-        return self.db.converter.load(v)
+        stamp = get_unit_stamp(unit_path)
+        v = cache.get(unit_path, k, stamp)
+        if v is MISSING:
+            raw = self._get_raw(k, unit_path)
+            v = self.db.converter.load(raw)
+            cache.put(unit_path, k, v, raw, stamp)
+        return v
 
     def get(self, k, default=None):
         """ """
@@ -77,23 +376,162 @@ class Reader(Cursor):
         except (BaseUnitDoesNotExist, KeyError):
             return default
 
-    def get_many(self, keys, default=None):
+    def get_many(self, keys, default=None, raw=False, lazy=False):
         """
         Get many values at once (to minimize open/close calls) and return as dict.
         Key order is not preserved.
+        If 'raw', values are returned in DB format (as stored in units);
+        if 'lazy', values are LazyValue proxies converted on first access.
         """
         keys_and_paths = sorted(((k, self.db.router.get_path(k)) for k in keys), key=lambda x:x[1])
-        return {k: self.get(k, default) for k, path in keys_and_paths}
+        result = {k: default for k, path in keys_and_paths}
+        cache = self.db.cache if not (raw or lazy) else None
+        stamps = {}     # unit_path: stamp (if cache is used)
+
+        found, raw_values = [], []
+        for k, path in keys_and_paths:
+            if cache is not None:
+                if path not in stamps:
+                    stamps[path] = get_unit_stamp(path)
+                v = cache.get(path, k, stamps[path])
+                if v is not MISSING:
+                    result[k] = v
+                    continue
+            try:
+                raw_values.append(self._get_raw(k, path))
+            except (BaseUnitDoesNotExist, KeyError):
+                continue
+            found.append((k, path))
 
-    def get_all(self):
+        loaded = self._load_batch(list(zip((k for k, path in found), raw_values)), raw, lazy)
+        if cache is None:
+            result.update(loaded)
+        else:
+            for (k, path), rv, (_, v) in zip(found, raw_values, loaded):
+                cache.put(path, k, v, rv, stamps[path])
+                result[k] = v
+        return result
+
+    def get_all(self, keys_only=False, raw=False, lazy=False):
         """
         [Generator]
         Return all values:
         go through all files in DB and return all key:value pairs from each file.
+        Values are converted in batches of up to BATCH_SIZE items (collected
+        from one or more files).
+
+        If 'keys_only', only keys are returned (values aren't even read if
+        the unit type allows it); if 'raw', values are returned in DB format;
+        if 'lazy', values are LazyValue proxies converted on first access.
+
+        If units are stored in several roots (see MultiRootRouter),
+        each root is read by its own thread.
         """
-        for unit_path in self.db.unit_cls.get_all_unit_paths(self.db.root):
-            with self.db.unit_cls(unit_path, mode=self.mode) as f:
-                contents = f.items()
-                for k,v in contents:
-                    yield (k, self.db.converter.load(v))
+        roots = self.db.router.roots
+        if len(roots) > 1:
+            units = self._read_roots_parallel(roots, keys_only)
+        else:
+            units = self._read_units(self.db.get_all_unit_paths(), keys_only)
+
+        batch = []
+        for unit_path, content in units:
+            if keys_only:
+                yield from content
+                continue
+            batch.extend(content)
             lg.debug("unit path read: %s" % unit_path)
+            if len(batch) >= self.BATCH_SIZE:
+                yield from self._load_batch(batch, raw, lazy)
+                batch = []
+        yield from self._load_batch(batch, raw, lazy)
+
+    # ******* implementation details *******
+    def _read_units(self, unit_paths, keys_only=False):
+        """ Generator of (unit path, list of keys or of (k, raw value) pairs). """
+        for unit_path in unit_paths:
+            with self.db.unit_cls(unit_path, mode=self.mode) as f:
+                yield unit_path, (f.keys() if keys_only else list(f.items()))
+
+    def _read_roots_parallel(self, roots, keys_only=False):
+        """
+        Same as '_read_units' for all units, but units of each root
+        are read by a separate thread (up to 2 units ahead per root).
+        """
+        results = queue.Queue(maxsize=2 * len(roots))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_root(root):
+            try:
+                unit_paths = self.db.unit_cls.get_all_unit_paths(root)
+                for unit in self._read_units(unit_paths, keys_only):
+                    if not put(unit):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(None)
+
+        threads = [threading.Thread(target=read_root, args=(root,), daemon=True)
+                   for root in roots]
+        for thread in threads:
+            thread.start()
+        try:
+            running = len(threads)
+            while running:
+                item = results.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            # consumer stopped early (or failed): let threads finish
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _get_raw(self, k, unit_path=None):
+        """
+        Return value in DB format (as it is stored in unit).
+        If not found, look at router fallback paths, and retry once
+        if routing changed (e.g. the unit was moved by another process).
+        """
+        router = self.db.router
+        if unit_path is None:
+            unit_path = router.get_path(k)
+        try:
+            return self._get_raw_from(k, [unit_path] + router.get_fallback_paths(k))
+        except (BaseUnitDoesNotExist, KeyError):
+            if not self.db.refresh():
+                raise
+        router = self.db.router
+        return self._get_raw_from(k, [router.get_path(k)] + router.get_fallback_paths(k))
+
+    def _get_raw_from(self, k, unit_paths):
+        """ Return value from the first of 'unit_paths' containing the key. """
+        for unit_path in unit_paths[:-1]:
+            try:
+                with self.threadlock:
+                    return self._open_unit(unit_path)[k]
+            except (BaseUnitDoesNotExist, KeyError):
+                pass
+        with self.threadlock:
+            return self._open_unit(unit_paths[-1])[k]
+
+    def _load_batch(self, items, raw=False, lazy=False):
+        if raw:
+            return items
+        if lazy:
+            return [(k, LazyValue(v, self.db.converter)) for k,v in items]
+        values = self.db.converter.load_many((v for k,v in items), self.processes)
+        return zip((k for k,v in items), values)
@@ -13,3 +13,9 @@ class BaseUnitDoesNotExist(MyStoreError):
     Raised when a reader tries to access a file that doesn't exist.
     """
     pass
+
+class DuplicateKeyError(MyStoreError):
+    """
+    Raised when saving a key which is already in storage index.
+    """
+    pass
@@ -0,0 +1,256 @@
+"""
+This module contains KeyIndex, an on-disk index mapping user keys
+(strings or integers) to integer keys (pks) of a DB, and NativeStorage,
+a Storage replacement using KeyIndex instead of SQLite mapping table.
+
+The index is stored in a directory tree of base units: keys are
+hash-partitioned into a fixed number of buckets (see HashRouter), one unit per bucket,
+so writers of different buckets never wait for each other.
+Keys are type-tagged in units ("i:" for integers, "s:" for strings),
+so 1 and "1" are different keys.
+
+Unlike Storage, using these classes requires no extra dependencies.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import json
+import fcntl
+import itertools
+from collections import defaultdict
+
+from .main import DB
+from .basestorage import BaseStorage
+from .units import DbmFileUnit
+from .routers import OriginalRouter, HashRouter
+from .converters import CompressedJsonConverter
+from .errors import MyStoreError, BaseUnitDoesNotExist, DuplicateKeyError
+
+
+INDEX_DIRNAME = "key_index"
+INDEX_CONFIG_FILENAME = "key_index_config"
+PK_COUNTER_FILENAME = "pk_counter"
+INDEX_EXTENSION = ".idx"    # not the unit class extension, so DB scans skip index units
+
+
+def tag_key(key):
+    """ Return string with type-tagged key as stored in index units. """
+    if isinstance(key, bool) or not isinstance(key, (int, str)):
+        raise MyStoreError("Only str and int keys are supported, got %r" % (key,))
+    if isinstance(key, int):
+        return "i:%d" % key
+    return "s:" + key
+
+
+def untag_key(tagged):
+    """ Inverse of 'tag_key'. """
+    if isinstance(tagged, bytes):
+        tagged = tagged.decode("utf-8")
+    if tagged.startswith("i:"):
+        return int(tagged[2:])
+    return tagged[2:]
+
+
+class KeyIndex:
+    """
+    On-disk index mapping user keys (str or int) to integer pks.
+
+    Arguments
+    ---------
+    root: str
+        Directory with index units and config (created if it doesn't exist).
+    params: dict
+        Used only when creating a new index (an existing one uses its saved config):
+        buckets: int
+            Number of units keys are hash-partitioned into (default: 256).
+        subfolder_size: int
+            Maximum number of units in one folder (default: 64).
+        first_pk: int
+            First pk to be reserved (default: 1).
+    unit_cls: BaseUnit subclass
+        Type of index units (only when creating a new index).
+    """
+    DEFAULT_PARAMS = {"buckets": 256, "subfolder_size": 64, "first_pk": 1}
+
+    def __init__(self, root, params=None, unit_cls=DbmFileUnit):
+        self.root = root
+        config_path = os.path.join(root, INDEX_CONFIG_FILENAME)
+        if os.path.exists(config_path):
+            with open(config_path, encoding="utf8") as f:
+                config = json.load(f)
+            self.params = config["params"]
+            self.unit_cls = DB.get_unit_classes()[config["unit_cls"]]
+        else:
+            self.params = dict(self.DEFAULT_PARAMS, **(params or {}))
+            self.unit_cls = unit_cls
+            self._dump_config(config_path)
+        self.buckets = self.params["buckets"]
+        self.router = HashRouter(root, {
+            "buckets": self.buckets,
+            "subfolder_size": self.params["subfolder_size"]
+        }, INDEX_EXTENSION)
+        self.counter_path = os.path.join(root, PK_COUNTER_FILENAME)
+
+    def get_path(self, key):
+        """ Return path to index unit storing 'key'. """
+        return self.router.get_path(tag_key(key))
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """
+        Return {key: pk} dict for those of 'keys' that are in index.
+        Each index unit is opened once.
+        """
+        pk_map = {}
+        for path, keys_of_unit in self._group_by_unit(keys):
+            try:
+                with self.unit_cls(path, "R") as unit:
+                    for k in keys_of_unit:
+                        try:
+                            pk_map[k] = int(unit[tag_key(k)])
+                        except KeyError:
+                            pass
+            except BaseUnitDoesNotExist:
+                pass
+        return pk_map
+
+    def insert_many(self, pairs, ignore_existing=False):
+        """
+        Add (key, pk) pairs to index and return {key: pk} dict of added pairs.
+
+        Units are updated one at a time, in the same order by all processes.
+        If a key is already in index, DuplicateKeyError is raised and pairs
+        added to units updated before are removed again (so nothing is added),
+        unless 'ignore_existing' (then such keys are skipped).
+        """
+        pairs = dict(pairs)
+        added = {}
+        try:
+            for path, keys_of_unit in self._group_by_unit(pairs):
+                with self.unit_cls(path, "W") as unit:
+                    existing = [k for k in keys_of_unit if self._contains(unit, tag_key(k))]
+                    if existing and not ignore_existing:
+                        raise DuplicateKeyError("%s keys already saved, e.g. %s"
+                                                % (len(existing), existing[:10]))
+                    existing = set(existing)
+                    for k in keys_of_unit:
+                        if k not in existing:
+                            unit[tag_key(k)] = str(pairs[k])
+                            added[k] = pairs[k]
+        except DuplicateKeyError:
+            self._remove(added)
+            raise
+        return added
+
+    def items(self):
+        """
+        Generator.
+        Return all (key, pk) pairs in index (unit by unit).
+        """
+        for bucket in range(self.buckets):
+            try:
+                with self.unit_cls(self.router.get_bucket_path(bucket), "R") as unit:
+                    items = list(unit.items())
+            except BaseUnitDoesNotExist:
+                continue
+            for tagged, pk in items:
+                yield (untag_key(tagged), int(pk))
+
+    def reserve_pk_block(self, size):
+        """
+        Reserve 'size' consecutive pks and return the first one.
+        The counter file is locked, so processes never get the same pks.
+        """
+        with open(self.counter_path, "a+") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.seek(0)
+            content = f.read().strip()
+            first = int(content) if content else self.params["first_pk"]
+            f.seek(0)
+            f.truncate()
+            f.write(str(first + size))
+            f.flush()
+            os.fsync(f.fileno())
+        return first
+
+    # ******* implementation details *******
+    def _group_by_unit(self, keys):
+        """ Return list of (unit path, list of keys) sorted by unit path. """
+        by_path = defaultdict(list)
+        for k in keys:
+            by_path[self.get_path(k)].append(k)
+        return sorted(by_path.items())
+
+    def _remove(self, pairs):
+        """ Remove (key, pk) pairs added by this process (if still mapped to the same pks). """
+        for path, keys_of_unit in self._group_by_unit(pairs):
+            with self.unit_cls(path, "W") as unit:
+                for k in keys_of_unit:
+                    try:
+                        if int(unit[tag_key(k)]) == pairs[k]:
+                            del unit[tag_key(k)]
+                    except KeyError:
+                        pass
+
+    @staticmethod
+    def _contains(unit, tagged):
+        try:
+            unit[tagged]
+        except KeyError:
+            return False
+        return True
+
+    def _dump_config(self, config_path):
+        os.makedirs(self.root, exist_ok=True)
+        config = {"unit_cls": self.unit_cls.__name__, "params": self.params}
+        with open(config_path, "w", encoding="utf8") as f:
+            f.write(json.dumps(config))
+
+
+class NativeStorage(BaseStorage):
+    """
+    Same as mystore.storage.Storage, but user keys (str or int)
+    are mapped to DB keys by KeyIndex (in INDEX_DIRNAME subfolder)
+    rather than by SQLite table, so no sqlalchemy is needed
+    and writers only contend for the index units of their keys.
+
+    Saving keys already in storage raises DuplicateKeyError.
+    """
+    def __init__(self, db_path, params=None, router_cls=OriginalRouter,
+                       unit_cls=DbmFileUnit, converter_cls=CompressedJsonConverter,
+                       index_params=None, pk_block_size=1000):
+        """
+        Initialize NativeStorage instance.
+        Initialize mystore.DB instance (create if not present yet)
+        and its key index (see KeyIndex for 'index_params').
+
+        pks are reserved by each process in blocks of at least 'pk_block_size'.
+        """
+        super().__init__(db_path, params, router_cls, unit_cls, converter_cls, pk_block_size)
+        index_params = dict({"first_pk": self.db.params.get("first_key", 1)},
+                            **(index_params or {}))
+        self.index = KeyIndex(os.path.join(db_path, INDEX_DIRNAME), index_params)
+
+    # ******* implementation details *******
+    def _iter_mapping_pages(self, chunk, max_chunk):
+        """ Mappings in order of index units. """
+        items = self.index.items()
+        while True:
+            rows = list(itertools.islice(items, chunk))
+            if not rows:
+                return
+            yield rows
+            chunk = min(chunk * 2, max_chunk)
+
+    def _get_pk_map(self, keys):
+        return self.index.get_many(keys)
+
+    def _insert_mappings(self, pks, keys, ignore_existing=False):
+        self.index.insert_many(zip(keys, pks), ignore_existing)
+
+    def _reserve_pk_block(self, size):
+        first = self.index.reserve_pk_block(size)
+        return first, first + size
@@ -8,16 +8,24 @@ lg = logging.getLogger(__name__)
 import os
 import sys
 import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 from .units import BaseUnit, DbmFileUnit
-from .routers import BaseRouter, OriginalRouter
+from .routers import BaseRouter, OriginalRouter, MigratingRouter
 from .converters import BaseConverter, CompressedJsonConverter as CJC
+from .converters.base import get_executor
 from .cursors import Reader, Writer
 from .errors import MyStoreError
+from .cache import ValueCache, SharedValueCache
+from .wal import WriteAheadLog, WAL_DIRNAME, SEGMENT_BYTES, replay as replay_wal
+from .service import RemoteWriter, SOCKET_FILENAME
+from . import bulk
 
 
 DBMDB_FILENAME = ".dbmdb.json"
 CONFIG_FILENAME = "mystore_config"
+SHARED_CACHE_FILENAME = "shared_cache"
 
 
 class DB:
@@ -31,6 +39,12 @@ class DB:
         self.unit_cls = unit_cls
         self.router = router_cls(root, params, unit_cls.EXTENSION)
         self.converter = converter_cls()
+        self.converter.attach(root)
+        self.cache = None   # see 'enable_cache'
+        self.wal = None     # see 'enable_wal'
+        self.auto_compact = None    # see 'enable_auto_compact'
+        self._compactor = None      # background compaction thread
+        self._config_stamp = self._get_config_stamp()
 
     def create(self):
         """
@@ -50,19 +64,141 @@ class DB:
         Get an instance representing an existing store.
         """
         config = cls.load_config(root)
-        return cls(
+        db = cls(
             root,
             config["params"],
             router_cls=cls.get_router_classes()[config["router_cls"]],
             unit_cls=cls.get_unit_classes()[config["unit_cls"]],
             converter_cls=cls.get_converter_classes()[config["converter_cls"]]
         )
+        db.recover()
+        return db
 
-    def reader(self, mode="R", threadlock=None):
-        return Reader(self, mode, threadlock)
+    def enable_cache(self, max_bytes=64 * 1024 * 1024):
+        """
+        Cache decoded values read by readers of this instance (in this process)
+        in an LRU cache limited by approximate size in bytes.
+        Cached values are invalidated when their unit changes.
+        See 'cache.stats()' for hit rate and other metrics.
+        """
+        self.cache = ValueCache(max_bytes)
+        return self
+
+    def enable_shared_cache(self, path=None, **kwargs):
+        """
+        Cache values read by readers of all processes using the same cache file
+        (by default SHARED_CACHE_FILENAME in DB root).
+        See SharedValueCache for other arguments.
+        """
+        if path is None:
+            path = os.path.join(self.root, SHARED_CACHE_FILENAME)
+        self.cache = SharedValueCache(path, self.converter, **kwargs)
+        return self
+
+    def disable_cache(self):
+        self.cache = None
+        return self
+
+    def enable_wal(self, commit_delay=0, segment_bytes=SEGMENT_BYTES):
+        """
+        Log writes of writers of this instance to a write-ahead log
+        (WAL_DIRNAME in DB root) before they are applied to units in batches.
+        A write is durable once it is logged, see mystore.wal.
+        """
+        if self.wal is None:
+            self.wal = WriteAheadLog(os.path.join(self.root, WAL_DIRNAME),
+                                     commit_delay, segment_bytes)
+        return self
+
+    def disable_wal(self):
+        """ Stop logging writes. Writers using the log must be closed first. """
+        if self.wal is not None:
+            self.wal.close()
+            self.wal = None
+        return self
+
+    def recover(self):
+        """
+        Apply writes logged by processes which crashed before
+        writing them to units. Return number of writes replayed.
+        Nothing is replayed while another process has WAL enabled,
+        its writers apply such writes on flush (see mystore.wal).
+        """
+        wal_dir = os.path.join(self.root, WAL_DIRNAME)
+        if not os.path.isdir(wal_dir):
+            return 0
+        return replay_wal(self, wal_dir)
+
+    def get_all_unit_paths(self):
+        """
+        Generator.
+        Get paths to all units of DB (in all roots of its router).
+        """
+        for root in self.router.roots:
+            yield from self.unit_cls.get_all_unit_paths(root)
+
+    def reader(self, mode="R", threadlock=None, processes=None):
+        self.refresh()  # pick up layout changes made by other processes
+        return Reader(self, mode, threadlock, processes)
+
+    def writer(self, mode="W", threadlock=None, processes=None):
+        self.refresh()
+        return Writer(self, mode, threadlock, processes)
+
+    def remote_writer(self, socket_path=None, processes=None):
+        """
+        Return a writer sending writes to a WriterService listening
+        on 'socket_path' (by default SOCKET_FILENAME in DB root),
+        so that writing processes never wait for unit locks.
+        See mystore.service.
+        """
+        if socket_path is None:
+            socket_path = os.path.join(self.root, SOCKET_FILENAME)
+        return RemoteWriter(self, socket_path, processes)
+
+    def bulk_load(self, items, mode="W", chunk_size=100000, processes=None, tmp_dir=None):
+        """
+        Write many (k, v) pairs much faster than a writer does:
+        values are converted in parallel ('processes'), sorted by unit
+        (spilling sorted runs of 'chunk_size' items to temporary files in 'tmp_dir')
+        and each unit is opened and written once.
+        Return number of items written. See mystore.bulk.
+        """
+        self.refresh()
+        return bulk.bulk_load(self, items, mode, chunk_size, processes, tmp_dir)
+
+    def compact(self, min_unit_bytes=0, processes=None):
+        """
+        Reclaim space left by deleted and overwritten values (see BaseUnit.compact)
+        in units of at least 'min_unit_bytes' bytes, using a pool of 'processes'
+        processes (one per CPU by default). Return number of bytes reclaimed.
+        See 'enable_auto_compact' to compact units as keys are deleted.
+        """
+        unit_paths = [path for path in self.get_all_unit_paths()
+                      if self.unit_cls.get_unit_size(path) >= min_unit_bytes]
+        return self._compact_units(unit_paths, processes or os.cpu_count() or 1)
+
+    def enable_auto_compact(self, min_unit_bytes=0, min_deletes=1000, background=True):
+        """
+        Compact units (see 'compact') when writers of this instance are closed:
+        a unit is compacted if at least 'min_deletes' keys were deleted from it
+        by the writer and it is at least 'min_unit_bytes' big.
+        If 'background', a background thread compacts units, so closing
+        a writer doesn't wait for it.
+        """
+        self.disable_auto_compact()
+        self.auto_compact = {"min_unit_bytes": min_unit_bytes, "min_deletes": min_deletes}
+        if background:
+            self._compactor = ThreadPoolExecutor(1)
+        return self
 
-    def writer(self, mode="W", threadlock=None):
-        return Writer(self, mode, threadlock)
+    def disable_auto_compact(self):
+        """ Stop compacting units automatically (waits for background compaction). """
+        self.auto_compact = None
+        if self._compactor is not None:
+            self._compactor.shutdown(wait=True)
+            self._compactor = None
+        return self
 
     def dump_config(self):
         config = {
@@ -73,8 +209,29 @@ class DB:
         }
         config_str = json.dumps(config)
         filepath = os.path.join(self.root, CONFIG_FILENAME)
-        with open(filepath, "w", encoding="utf8") as f:
+        # replaced atomically, as other processes may reload it (see 'refresh'):
+        tmp_filepath = "%s.%s.tmp" % (filepath, os.getpid())
+        with open(tmp_filepath, "w", encoding="utf8") as f:
             f.write(config_str)
+        os.replace(tmp_filepath, filepath)
+        self._config_stamp = self._get_config_stamp()
+
+    def refresh(self):
+        """
+        Reload router if config was changed by another process (e.g. by 'relayout')
+        and refresh router state. Return True if routing may have changed.
+        Readers call it when a key is not found, before giving up.
+        """
+        stamp = self._get_config_stamp()
+        changed = False
+        if stamp is not None and stamp != self._config_stamp:
+            self._config_stamp = stamp
+            config = self.load_config(self.root)
+            router_cls = self.get_router_classes()[config["router_cls"]]
+            self.router = router_cls(self.root, config["params"], self.unit_cls.EXTENSION)
+            self.params = config["params"]
+            changed = True
+        return self.router.refresh() or changed
 
     @classmethod
     def load_config(cls, root_dir):
@@ -108,9 +265,64 @@ class DB:
     def reformat(self, new_db):
         with new_db.writer("w") as writer:
             with self.reader("r") as reader:
-                for k,v in reader.get_all():
-                    writer[int(k)] = v
-    # TODO: Keys are always integer?
+                # keys come from units as strings, parsed as the new layout expects them:
+                writer.set_many((new_db.router.parse_key(k), v) for k,v in reader.get_all())
+
+    def relayout(self, router_cls, params):
+        """
+        Start moving units to a new layout (router class and params) in place.
+
+        New units are built in a subfolder, reads look there first and then
+        in the old layout, writes go to the new layout. Move data with
+        'migrate_step' (a few units at a time, while DB is in use),
+        then call 'finish_relayout'. Other processes pick the change up
+        on 'refresh', i.e. when they open a reader or writer next
+        (and readers on misses).
+        """
+        if isinstance(self.router, MigratingRouter):
+            raise MyStoreError("Relayout is already in progress")
+        self.router = MigratingRouter(self.root, {
+            "old_router_cls": self.router.__class__.__name__,
+            "old_params": self.router.params,
+            "new_router_cls": router_cls.__name__,
+            "new_params": params
+        }, self.unit_cls.EXTENSION)
+        self.params = self.router.params
+        self.dump_config()
+        return self
+
+    def migrate_step(self, max_units=1):
+        """
+        Move content of up to 'max_units' units of the old layout to the new one
+        (values already written to the new layout are kept) and remove them.
+        Return number of units migrated (0 when there are none left).
+        """
+        router = self._get_migrating_router()
+        old_paths = [path for path in self.get_all_unit_paths()
+                     if not router.is_new_unit(path)]
+        for unit_path in old_paths[:max_units]:
+            self._migrate_unit(router, unit_path)
+        return min(len(old_paths), max_units)
+
+    def finish_relayout(self):
+        """
+        Migrate remaining units, move new units to their final paths
+        (readers find them there meanwhile) and save the new layout in config.
+        Writers must not run meanwhile.
+        """
+        router = self._get_migrating_router()
+        while self.migrate_step(max_units=100):
+            pass
+        for dirpath, dirnames, filenames in os.walk(router.relayout_dir):
+            target_dir = os.path.join(self.root, os.path.relpath(dirpath, router.relayout_dir))
+            os.makedirs(target_dir, exist_ok=True)
+            for fn in filenames:
+                os.replace(os.path.join(dirpath, fn), os.path.join(target_dir, fn))
+        shutil.rmtree(router.relayout_dir, ignore_errors=True)
+        self.router = router.final_router
+        self.params = self.router.params
+        self.dump_config()
+        return self
 
     @staticmethod
     def get_unit_classes():
@@ -123,3 +335,69 @@ class DB:
     @staticmethod
     def get_converter_classes():
         return {cls.__name__: cls for cls in BaseConverter.__subclasses__()}
+
+    # ******* implementation details *******
+    def _get_config_stamp(self):
+        try:
+            stat = os.stat(os.path.join(self.root, CONFIG_FILENAME))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _compact_units(self, unit_paths, processes=1):
+        """ Compact units, return number of bytes reclaimed. """
+        size_before = sum(map(self.unit_cls.get_unit_size, unit_paths))
+        if processes == 1 or len(unit_paths) < 2:
+            for path in unit_paths:
+                self.unit_cls.compact(path)
+        else:
+            list(get_executor(processes).map(self.unit_cls.compact, unit_paths))
+        reclaimed = size_before - sum(map(self.unit_cls.get_unit_size, unit_paths))
+        lg.info("compacted %s units of %s, %s bytes reclaimed", len(unit_paths), self.root, reclaimed)
+        return reclaimed
+
+    def _on_keys_deleted(self, deleted):
+        """
+        Called by closed writers with {unit path: number of keys deleted},
+        compacts units as configured by 'enable_auto_compact'.
+        """
+        config = self.auto_compact
+        if config is None:
+            return
+        unit_paths = sorted(path for path, count in deleted.items()
+                            if count >= config["min_deletes"]
+                            and self.unit_cls.get_unit_size(path) >= config["min_unit_bytes"])
+        if not unit_paths:
+            return
+        if self._compactor is None:
+            self._compact_units(unit_paths)
+        else:
+            self._compactor.submit(self._compact_in_background, unit_paths)
+
+    def _compact_in_background(self, unit_paths):
+        try:
+            self._compact_units(unit_paths)
+        except Exception:
+            lg.exception("background compaction of %s failed", self.root)
+
+    def _get_migrating_router(self):
+        if not isinstance(self.router, MigratingRouter):
+            raise MyStoreError("No relayout in progress")
+        return self.router
+
+    def _migrate_unit(self, router, unit_path):
+        with self.unit_cls(unit_path, mode="W") as old_unit:  # old layout writers wait
+            by_path = {}
+            for k, v in list(old_unit.items()):
+                k = router.parse_key(k)
+                by_path.setdefault(router.get_path(k), []).append((k, v))
+            for new_path, items in sorted(by_path.items()):
+                with self.unit_cls(new_path, mode="W") as new_unit:
+                    existing = set(new_unit.keys())
+                    for k, v in items:
+                        if str(k) not in existing:
+                            new_unit[k] = v
+            # removed before writers waiting for it get the lock,
+            # they find it's not routed anymore and write to the new layout:
+            self.unit_cls.destroy(unit_path)
+        lg.debug("migrated unit %s", unit_path)
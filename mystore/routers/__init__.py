@@ -6,3 +6,7 @@ at which base units with data are stored.
 from .base import BaseRouter
 from .original import OriginalRouter
 from .stringformat import StringFormatRouter
+from .hash import HashRouter
+from .multiroot import MultiRootRouter
+from .splitting import SplittingRouter
+from .migrating import MigratingRouter
@@ -7,6 +7,7 @@ lg = logging.getLogger(__name__)
 
 import os
 import abc
+import zlib
 
 
 class BaseRouter(metaclass=abc.ABCMeta):
@@ -31,3 +32,38 @@ class BaseRouter(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def get_path(self, key):
         """ Return path to base unit with data. """
+
+    @property
+    def roots(self):
+        """ Return list of directories where base units are stored. """
+        return [self.root_dir]
+
+    def get_unit_index(self, key):
+        """
+        Return integer identifying base unit of the key.
+        This default implementation hashes unit path (relative to 'root_dir').
+        """
+        relpath = os.path.relpath(self.get_path(key), self.root_dir)
+        return zlib.crc32(relpath.encode("utf-8"))
+
+    def get_fallback_paths(self, key):
+        """
+        Return list of other paths to look for the key at if it is not found
+        at 'get_path(key)' (e.g. while units are being migrated).
+        """
+        return []
+
+    def refresh(self):
+        """
+        Reload routing state changed by other processes (if any),
+        return True if routing may have changed.
+        Readers call it when a key is not found, before giving up.
+        """
+        return False
+
+    def parse_key(self, key):
+        """
+        Return key as accepted by 'get_path' from its string version
+        (as keys are returned by units). Default routers use integer keys.
+        """
+        return int(key)
@@ -0,0 +1,86 @@
+"""
+This module contains HashRouter.
+This router class maps keys of any type (str, bytes or int)
+to a fixed number of buckets by a stable hash of the key.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import zlib
+
+from .base import BaseRouter
+from mystore.errors import MyStoreError
+
+
+class HashRouter(BaseRouter):
+    """
+    BaseRouter subclass mapping str, bytes or int keys to base unit paths
+    by CRC32 of the key, so units are evenly sized however keys are distributed.
+
+    Keys are hashed as their string versions, the way units store them
+    (str(key)), so keys read back from units (e.g. by DB.reformat) map
+    to the same unit: 12 and "12" map to the same unit, b"12" is hashed as "b'12'".
+
+    Arguments
+    ---------
+    root_dir: str
+        Base directory where tree of base units is stored.
+    params: dict
+        buckets: int
+            Number of base units.
+        subfolder_size: int
+            Maximum number of base units in one folder
+            (if 0 - no subfolders are created).
+
+    Example 1:
+    >>> router = HashRouter(root_dir="/tmp/", \
+            params={"buckets": 100, "subfolder_size": 10}, extension=".dbm")
+    >>> router.get_bucket("some key")
+    26
+    >>> router.get_path("some key")
+    '/tmp/2/6.dbm'
+
+    Example 2:
+    >>> router = HashRouter(root_dir="/tmp/", \
+            params={"buckets": 100, "subfolder_size": 0}, extension=".dbm")
+    >>> router.get_path(12) == router.get_path("12") == '/tmp/65.dbm'
+    True
+    """
+    def __init__(self, root_dir, params, extension):
+        super().__init__(root_dir, params, extension)
+        self.buckets = params["buckets"]
+        self.subfolder_size = params["subfolder_size"]
+
+    def get_bucket(self, key):
+        """ Return number of bucket (base unit) for key, stable across processes. """
+        if isinstance(key, str):
+            data = key.encode("utf-8")
+        elif isinstance(key, (bytes, int)) and not isinstance(key, bool):
+            data = str(key).encode("utf-8")
+        else:
+            raise MyStoreError("Unsupported key type: %r" % (key,))
+        return zlib.crc32(data) % self.buckets
+
+    def get_path(self, key):
+        return self.get_bucket_path(self.get_bucket(key))
+
+    get_unit_index = get_bucket
+
+    def get_bucket_path(self, bucket):
+        """ Return path to base unit of given bucket. """
+        if self.subfolder_size == 0:
+            filepath = os.path.join(self.root_dir, str(bucket))
+        else:
+            filepath = os.path.join(self.root_dir, str(bucket // self.subfolder_size),
+                                    str(bucket % self.subfolder_size))
+        return filepath + self.extension
+
+    def parse_key(self, key):
+        """ Keys are routed as their string versions, so return key as it is. """
+        return key
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,80 @@
+"""
+This module contains MigratingRouter.
+This router class is used while DB units are moved
+from one layout (router class and params) to another, see DB.relayout.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+
+from .base import BaseRouter
+
+
+RELAYOUT_DIRNAME = "relayout"
+
+
+class MigratingRouter(BaseRouter):
+    """
+    BaseRouter subclass routing keys to units of the new layout,
+    built in RELAYOUT_DIRNAME subfolder (so its paths never clash
+    with units of the old layout still in 'root_dir').
+
+    Keys not found there are looked up (see 'get_fallback_paths'):
+        - at their final path (once new units are moved to 'root_dir'),
+        - in the old layout (not migrated yet).
+
+    Arguments
+    ---------
+    root_dir: str
+        Base directory where tree of base units is stored.
+    params: dict
+        old_router_cls, new_router_cls: str
+            Names of router classes of the old and the new layout.
+        old_params, new_params: dict
+            Their parameters.
+    """
+    def __init__(self, root_dir, params, extension):
+        super().__init__(root_dir, params, extension)
+        router_classes = {cls.__name__: cls for cls in BaseRouter.__subclasses__()}
+        self.old_router = router_classes[params["old_router_cls"]](
+            root_dir, params["old_params"], extension)
+        self.new_router = router_classes[params["new_router_cls"]](
+            os.path.join(root_dir, RELAYOUT_DIRNAME), params["new_params"], extension)
+        self.final_router = router_classes[params["new_router_cls"]](
+            root_dir, params["new_params"], extension)
+        self.relayout_dir = self.new_router.root_dir
+
+    def get_path(self, key):
+        return self.new_router.get_path(key)
+
+    def get_fallback_paths(self, key):
+        return [self.final_router.get_path(key), self.old_router.get_path(key)]
+
+    @property
+    def roots(self):
+        """ Roots of both layouts (without those nested in other ones). """
+        roots = []
+        for root in self.old_router.roots + self.new_router.roots:
+            if root not in roots:
+                roots.append(root)
+        return [root for root in roots
+                if not any(_is_within(other, root) for other in roots if other != root)]
+
+    def is_new_unit(self, unit_path):
+        """ Return True if unit at 'unit_path' belongs to the new layout. """
+        return any(_is_within(root, unit_path) for root in self.new_router.roots
+                   if root not in self.old_router.roots)
+
+    def refresh(self):
+        old_changed = self.old_router.refresh()
+        new_changed = self.new_router.refresh()
+        return old_changed or new_changed
+
+    def parse_key(self, key):
+        return self.new_router.parse_key(key)
+
+
+# ******* implementation details *******
+def _is_within(root, path):
+    return os.path.commonpath([root, path]) == root
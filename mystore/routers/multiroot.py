@@ -0,0 +1,74 @@
+"""
+This module contains MultiRootRouter.
+This router class spreads base units of another router
+across several root directories (e.g. mount points of different disks).
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+
+from .base import BaseRouter
+from mystore.errors import MyStoreError
+
+
+class MultiRootRouter(BaseRouter):
+    """
+    BaseRouter subclass placing base units of an inner router
+    in one of several root directories, by unit index (see 'get_unit_index'),
+    so consecutive units go to different roots.
+
+    Roots are saved in DB config with other params, so DB.load finds all units.
+    Roots must not be nested in one another.
+
+    Arguments
+    ---------
+    root_dir: str
+        Base directory of DB (config is stored here).
+    params: dict
+        roots: list of str
+            Directories base units are spread across.
+        router_cls: str
+            Name of the inner router class, e.g. "OriginalRouter".
+        router_params: dict
+            Parameters of the inner router.
+
+    Example:
+    >>> router = MultiRootRouter(root_dir="/tmp/db", params={ \
+            "roots": ["/mnt/a", "/mnt/b"], "router_cls": "OriginalRouter", \
+            "router_params": {"unit_size": 10, "subfolder_size": 0, "first_key": 0}}, \
+            extension=".dbm")
+    >>> router.get_path(5), router.get_path(15), router.get_path(25)
+    ('/mnt/a/0.dbm', '/mnt/b/1.dbm', '/mnt/a/2.dbm')
+    """
+    def __init__(self, root_dir, params, extension):
+        super().__init__(root_dir, params, extension)
+        self._roots = [os.path.abspath(os.path.expanduser(r)) for r in params["roots"]]
+        if not self._roots:
+            raise MyStoreError("No roots given")
+        router_classes = {cls.__name__: cls for cls in BaseRouter.__subclasses__()}
+        self.router = router_classes[params["router_cls"]](
+            root_dir, params["router_params"], extension)
+
+    @property
+    def roots(self):
+        return self._roots
+
+    def get_path(self, key):
+        relpath = os.path.relpath(self.router.get_path(key), self.router.root_dir)
+        root = self._roots[self.router.get_unit_index(key) % len(self._roots)]
+        return os.path.join(root, relpath)
+
+    def get_unit_index(self, key):
+        return self.router.get_unit_index(key)
+
+    def refresh(self):
+        return self.router.refresh()
+
+    def parse_key(self, key):
+        return self.router.parse_key(key)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -51,9 +51,12 @@ class OriginalRouter(BaseRouter):
         self.subfolder_size = params["subfolder_size"]
         self.first_key = params["first_key"]
 
+    def get_unit_index(self, key):
+        return (key - self.first_key) // self.unit_size
+
     def get_path(self, key):
         # 1. derive index of dbm file from key value
-        file_index = (key - self.first_key) // self.unit_size
+        file_index = self.get_unit_index(key)
 
         # 2. derive subfolder name and dbm file name from dbm file index
         #   a. don't use subfolders
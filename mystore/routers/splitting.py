@@ -0,0 +1,243 @@
+"""
+This module contains SplittingRouter.
+This router class maps integer keys to base units like OriginalRouter,
+but units grown too big are split into several units covering
+smaller key ranges (and small neighbouring ones are merged back),
+see 'rebalance'.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import json
+import math
+import fcntl
+import bisect
+
+from .base import BaseRouter
+from .original import OriginalRouter
+
+
+SPLIT_TABLE_FILENAME = "split_table"
+
+
+class SplittingRouter(BaseRouter):
+    """
+    BaseRouter subclass mapping integer keys to base unit paths,
+    by default exactly as OriginalRouter does. Key ranges listed
+    in the split table override default units:
+
+        [start, end) -> <default unit path>_<start>_<end><extension>
+
+    The split table is a small JSON file in 'root_dir', replaced atomically
+    by 'rebalance'. Routers of other processes reload it on 'refresh',
+    which readers call when a key is not found where expected.
+
+    Arguments
+    ---------
+    root_dir: str
+        Base directory where tree of base units is stored.
+    params: dict
+        Same as of OriginalRouter (unit_size, subfolder_size, first_key).
+
+    Example:
+    >>> router = SplittingRouter(root_dir="/tmp/nonexistent/", \
+            params={"unit_size": 10, "subfolder_size": 0, "first_key": 0}, extension=".dbm")
+    >>> router.ranges = [(10, 15), (15, 20)]
+    >>> router.get_path(9), router.get_path(12), router.get_path(17)
+    ('/tmp/nonexistent/0.dbm', '/tmp/nonexistent/1_10_15.dbm', '/tmp/nonexistent/1_15_20.dbm')
+    """
+    def __init__(self, root_dir, params, extension):
+        super().__init__(root_dir, params, extension)
+        self.default_router = OriginalRouter(root_dir, params, extension)
+        self.unit_size = params["unit_size"]
+        self.first_key = params["first_key"]
+        self.table_path = os.path.join(self.root_dir, SPLIT_TABLE_FILENAME)
+        self._table_stamp = None
+        self.ranges = []
+        self.refresh()
+
+    @property
+    def ranges(self):
+        """ Sorted list of (start, end) key ranges overriding default units. """
+        return list(zip(self._starts, self._ends))
+
+    @ranges.setter
+    def ranges(self, ranges):
+        ranges = sorted(ranges)
+        self._starts = [start for start, end in ranges]
+        self._ends = [end for start, end in ranges]
+
+    def get_path(self, key):
+        key_range = self.get_range(key)
+        if key_range == self.get_default_range(key):
+            return self.default_router.get_path(key)
+        return self._get_range_path(key, key_range)
+
+    def get_range(self, key):
+        """ Return (start, end) range of keys stored in the unit of 'key'. """
+        i = bisect.bisect_right(self._starts, key) - 1
+        if i >= 0 and key < self._ends[i]:
+            return (self._starts[i], self._ends[i])
+        return self.get_default_range(key)
+
+    def get_default_range(self, key):
+        start = key - (key - self.first_key) % self.unit_size
+        return (start, start + self.unit_size)
+
+    def refresh(self):
+        """
+        Reload split table if it was changed (by 'rebalance' in any process).
+        Return True if it was.
+        """
+        try:
+            stat = os.stat(self.table_path)
+        except FileNotFoundError:
+            stamp = None
+        else:
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp == self._table_stamp:
+            return False
+        self._table_stamp = stamp
+        if stamp is None:
+            self.ranges = []
+        else:
+            with open(self.table_path, encoding="utf8") as f:
+                self.ranges = [tuple(r) for r in json.load(f)["ranges"]]
+        return True
+
+    def rebalance(self, db, max_unit_bytes=None, max_unit_keys=None, min_unit_bytes=0):
+        """
+        Split units of 'db' bigger than 'max_unit_bytes' or with more than
+        'max_unit_keys' keys into units of about these limits, and merge
+        neighbouring split units (of the same default unit) while they
+        stay under 'min_unit_bytes' together. Return (splits, merges) counts.
+
+        Data is copied to the new units before the split table is updated
+        and the old units are removed, so readers can read all the time
+        (after the table is updated they find the keys on refresh).
+        Old units stay locked until they are removed: writers waiting
+        for them reroute their writes (see Writer._open_routed_unit).
+        """
+        with open(self.table_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)   # one rebalance at a time
+            self.refresh()
+            splits = merges = 0
+            for unit_path in list(db.get_all_unit_paths()):
+                if self._split_unit(db, unit_path, max_unit_bytes, max_unit_keys):
+                    splits += 1
+            if min_unit_bytes:
+                merges = self._merge_units(db, min_unit_bytes)
+        lg.info("rebalanced %s: %s units split, %s merged", db.root, splits, merges)
+        return splits, merges
+
+    # ******* implementation details *******
+    def _get_range_path(self, key, key_range):
+        default_path = self.default_router.get_path(key)
+        base = default_path[:len(default_path) - len(self.extension)]
+        return "%s_%s_%s%s" % (base, key_range[0], key_range[1], self.extension)
+
+    def _split_unit(self, db, unit_path, max_unit_bytes, max_unit_keys):
+        size = db.unit_cls.get_unit_size(unit_path)
+        if max_unit_keys is None and (max_unit_bytes is None or size <= max_unit_bytes):
+            return False
+        with db.unit_cls(unit_path, "W") as unit:   # writers wait meanwhile
+            items = sorted((int(k), v) for k, v in unit.items())
+            if not items or self.get_path(items[0][0]) != unit_path:
+                return False    # left over by an interrupted rebalance
+            parts = 1
+            if max_unit_bytes:
+                parts = max(parts, math.ceil(size / max_unit_bytes))
+            if max_unit_keys:
+                parts = max(parts, math.ceil(len(items) / max_unit_keys))
+            parts = min(parts, len(items))
+            if parts < 2:
+                return False
+
+            start, end = self.get_range(items[0][0])
+            # children boundaries at key quantiles:
+            bounds = [start] + [items[i * len(items) // parts][0] for i in range(1, parts)] + [end]
+            children = list(zip(bounds, bounds[1:]))
+            for child_start, child_end in children:
+                child_path = self._get_range_path(child_start, (child_start, child_end))
+                with db.unit_cls(child_path, "w") as child:
+                    for k, v in items:
+                        if child_start <= k < child_end:
+                            child[k] = v
+            self._save_ranges([r for r in self.ranges if r != (start, end)] + children)
+            # removed before writers waiting for it get the lock,
+            # they find it's not routed anymore and write to children:
+            db.unit_cls.destroy(unit_path)
+        lg.debug("split %s into %s units", unit_path, len(children))
+        return True
+
+    def _merge_units(self, db, min_unit_bytes):
+        merges = 0
+        ranges = self.ranges
+        merged_ranges = []
+        i = 0
+        while i < len(ranges):
+            start, end = ranges[i]
+            group = [ranges[i]]
+            size = db.unit_cls.get_unit_size(self._get_range_path(start, ranges[i]))
+            default_range = self.get_default_range(start)
+            # extend with following adjacent ranges of the same default unit:
+            while i + 1 < len(ranges) and ranges[i + 1][0] == end \
+                    and self.get_default_range(ranges[i + 1][0]) == default_range:
+                next_size = db.unit_cls.get_unit_size(
+                    self._get_range_path(ranges[i + 1][0], ranges[i + 1]))
+                if size + next_size > min_unit_bytes:
+                    break
+                i += 1
+                group.append(ranges[i])
+                size += next_size
+                end = ranges[i][1]
+            i += 1
+            merged_ranges.append((group, (start, end)))
+
+        for group, merged in merged_ranges:
+            if len(group) > 1:
+                self._merge_group(db, group, merged)
+                merges += 1
+        return merges
+
+    def _merge_group(self, db, group, merged):
+        """
+        Copy units of 'group' ranges to the unit of 'merged' range, publish
+        the split table and remove old units, all while holding locks
+        of old units (so writers of old units wait and then reroute).
+        """
+        old_paths = [self._get_range_path(r[0], r) for r in group]
+        path = self._get_range_path(merged[0], merged)
+        new_ranges = [r for r in self.ranges if r not in group]
+        if merged == self.get_default_range(merged[0]):
+            path = self.default_router.get_path(merged[0])
+        else:
+            new_ranges.append(merged)
+        old_units = []
+        try:
+            for old_path in old_paths:
+                old_units.append(db.unit_cls(old_path, "W"))
+            with db.unit_cls(path, "W") as unit:
+                for old_unit in old_units:
+                    for k, v in list(old_unit.items()):
+                        unit[k] = v
+            self._save_ranges(new_ranges)
+            for old_path in old_paths:
+                db.unit_cls.destroy(old_path)
+        finally:
+            for old_unit in old_units:
+                old_unit.close()
+
+    def _save_ranges(self, ranges):
+        """ Replace split table atomically. """
+        tmp_path = "%s.%s.tmp" % (self.table_path, os.getpid())
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.write(json.dumps({"ranges": sorted(ranges)}))
+        os.replace(tmp_path, self.table_path)
+        self.refresh()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,306 @@
+"""
+This module contains WriterService and RemoteWriter.
+
+When many processes write to the same units, they spend most of their
+time waiting for unit locks (see DbmFileUnit._loop_open). Instead,
+a single WriterService process can own all writes:
+    - producers use RemoteWriter (see DB.remote_writer), which converts
+      values and sends them to the service in batches over a Unix socket;
+    - the service coalesces batches of all clients waiting at the moment,
+      writes them sorted by unit (so each unit is opened once per round)
+      and acknowledges each batch once its units are synced.
+
+Messages are length-prefixed (4 bytes, big-endian) pickles.
+Requests are lists of (op, key, raw value) records, as in mystore.wal;
+replies are ("ok", number of keys deleted) or ("error", message).
+The socket is only accessible to its owner, as pickles are trusted.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import queue
+import pickle
+import socket
+import struct
+import itertools
+import threading
+import socketserver
+
+from .errors import MyStoreError
+
+
+SOCKET_FILENAME = "writer.sock"
+MESSAGE_HEADER = struct.Struct(">I")
+
+
+class WriterService:
+    """
+    Process-local service applying writes sent by RemoteWriters.
+
+    Arguments
+    ---------
+    db: DB
+        Database to write to.
+    socket_path: str
+        Path of Unix socket to listen on.
+    max_batch: int
+        Max number of records (of all clients) applied at once.
+    """
+    def __init__(self, db, socket_path, max_batch=100000):
+        self.db = db
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.rounds = 0     # number of coalesced batches applied
+        self._requests = queue.Queue()
+        self._server = None
+        self._threads = []
+
+    def serve_forever(self):
+        """ Listen and apply writes until 'shutdown' is called (from another thread). """
+        self._listen()
+        applier = threading.Thread(target=self._apply_loop, daemon=True)
+        applier.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._requests.put(None)
+            applier.join()
+            self._server.server_close()
+            self._remove_socket()
+
+    def start(self):
+        """ Serve in a background thread, return self. """
+        self._listen()
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def shutdown(self):
+        """ Stop serving (pending writes are applied first). """
+        self._server.shutdown()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, records):
+        """ Apply records (with records of other clients), return number of keys deleted. """
+        request = _Request(records)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.deleted
+
+    # ******* implementation details *******
+    def _listen(self):
+        if self._server is not None:
+            return
+        self._remove_socket()
+        # socket is only accessible to its owner from the moment it is created:
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.service = self
+        lg.info("writer service of %s listening on %s", self.db.root, self.socket_path)
+
+    def _remove_socket(self):
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    def _apply_loop(self):
+        with self.db.writer() as writer:
+            stop = False
+            while not stop:
+                request = self._requests.get()
+                if request is None:
+                    return
+                requests = [request]
+                count = len(request.records)
+                while count < self.max_batch:
+                    try:
+                        request = self._requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        stop = True
+                        break
+                    requests.append(request)
+                    count += len(request.records)
+                self.db.refresh()
+                self._apply(writer, requests)
+
+    def _apply(self, writer, requests):
+        """
+        Apply requests in order: consecutive requests without deletes
+        are coalesced, requests with deletes are applied on their own
+        (to report number of keys they deleted).
+        """
+        has_deletes = lambda request: any(op == "d" for op, k, raw in request.records)
+        for deletes, group in itertools.groupby(requests, key=has_deletes):
+            group = list(group)
+            batches = [[request] for request in group] if deletes else [group]
+            for batch in batches:
+                try:
+                    # units are synced before writes are acknowledged, no need for WAL:
+                    deleted = writer.apply(
+                        [record for request in batch for record in request.records])
+                except Exception as e:
+                    lg.exception("failed to apply writes")
+                    writer.release_unit()
+                    for request in batch:
+                        request.error = MyStoreError("Writer service failed: %r" % e)
+                else:
+                    for request in batch:
+                        request.deleted = deleted
+                self.rounds += 1
+                for request in batch:
+                    request.done.set()
+
+
+class RemoteWriter:
+    """
+    Writer sending writes to a WriterService, in batches of up to BATCH_SIZE
+    records (on 'flush' and on close). Writes are acknowledged by the service
+    once applied, until then they are not visible to readers.
+    """
+    BATCH_SIZE = 10000
+
+    def __init__(self, db, socket_path, processes=None):
+        self.db = db
+        self.socket_path = socket_path
+        self.processes = processes  # used to convert big batches of values
+        self._pending = []
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(socket_path)
+        except OSError as e:
+            self._socket.close()
+            raise MyStoreError("Can't connect to writer service at %s: %s" % (socket_path, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __setitem__(self, k, v):
+        self._add([("s", k, self.db.converter.dump(v))])
+
+    def __delitem__(self, k):
+        if not self.delete_many([k]):
+            raise KeyError(k)
+
+    def set_many(self, items):
+        """ Set many key:value pairs at once (values are converted in batches). """
+        items = iter(items)
+        while True:
+            batch = list(itertools.islice(items, self.BATCH_SIZE))
+            if not batch:
+                return
+            raw_values = self.db.converter.dump_many((v for k, v in batch), self.processes)
+            self._add([("s", k, raw) for (k, _), raw in zip(batch, raw_values)])
+
+    def delete_many(self, keys):
+        """ Delete many keys at once, return number of keys deleted. """
+        self._pending.extend(("d", k, None) for k in keys)
+        return self.flush()
+
+    def flush(self):
+        """ Send pending writes and wait until they are applied. Return number of keys deleted. """
+        records, self._pending = self._pending, []
+        if not records:
+            return 0
+        _send_message(self._socket, records)
+        reply = _recv_message(self._socket)
+        if reply is None:
+            raise MyStoreError("Writer service closed connection")
+        status, result = reply
+        if status != "ok":
+            raise MyStoreError(result)
+        return result
+
+    def close(self):
+        if self._socket is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._socket.close()
+            self._socket = None
+
+    # ******* implementation details *******
+    def _add(self, records):
+        self._pending.extend(records)
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.flush()
+
+
+# ******* implementation details *******
+class _Request:
+    __slots__ = ("records", "done", "deleted", "error")
+
+    def __init__(self, records):
+        self.records = records
+        self.done = threading.Event()
+        self.deleted = 0
+        self.error = None
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """ Serve one client: submit its requests one by one and reply. """
+    def handle(self):
+        while True:
+            try:
+                records = _recv_message(self.request)
+            except (MyStoreError, ConnectionError) as e:
+                lg.warning("writer service client disconnected: %s", e)
+                return
+            if records is None:
+                return
+            try:
+                reply = ("ok", self.server.service.submit(records))
+            except Exception as e:
+                reply = ("error", str(e))
+            try:
+                _send_message(self.request, reply)
+            except ConnectionError:
+                return  # client is gone, its writes are applied anyway
+
+
+def _send_message(sock, obj):
+    payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(MESSAGE_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_message(sock):
+    """ Return next message, None if connection was closed. """
+    header = _recv_exactly(sock, MESSAGE_HEADER.size)
+    if header is None:
+        return None
+    length, = MESSAGE_HEADER.unpack(header)
+    payload = _recv_exactly(sock, length)
+    if payload is None:
+        raise MyStoreError("Connection closed in the middle of a message")
+    return pickle.loads(payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            if chunks:
+                raise MyStoreError("Connection closed in the middle of a message")
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
@@ -14,11 +14,14 @@ from .routers import (
 from .units import (
     DbmFileUnit,
     JsonFileUnit,
-    DirUnit
+    DirUnit,
+    BlockUnit
 )
 from .converters import (
+    JsonConverter,
     CompressedJsonConverter,
     Base64CompressedJsonConverter,
+    ZdictCompressedJsonConverter,
     handlers
 )
 
@@ -93,3 +96,28 @@ def filedb_to_dbmdb(old_path, new_path, new_router_params):
     new_db.converter._dump_handlers = [] # write bytes
     old_db.reformat(new_db)
     return new_db
+
+
+def dbmdb_to_blockdb(old_path, new_path):
+    """ Reformat existing dbmdb to db with values compressed in blocks. """
+    old_db = get_db(old_path)
+    new_db = DB(new_path, old_db.router.params,
+        OriginalRouter, BlockUnit, JsonConverter)
+    new_db.create()
+    old_db.reformat(new_db)
+    return new_db
+
+
+def dbmdb_to_zdictdb(old_path, new_path, sample_size=1000):
+    """
+    Reformat existing dbmdb to dbmdb with values compressed
+    using a dictionary trained on first 'sample_size' values of the old one.
+    """
+    old_db = get_db(old_path)
+    new_db = DB(new_path, old_db.router.params,
+        OriginalRouter, DbmFileUnit, ZdictCompressedJsonConverter)
+    new_db.create()
+    with old_db.reader("r") as reader:
+        new_db.converter.train((v for k,v in reader.get_all()), sample_size)
+    old_db.reformat(new_db)
+    return new_db
@@ -10,22 +10,35 @@ import logging
 lg = logging.getLogger(__name__)
 
 import os
+import sqlite3
 from contextlib import contextmanager
+from urllib.request import pathname2url
 
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine.url import URL
 from sqlalchemy.ext.declarative import declarative_base
 
-from .main import DB
-from .shortcuts import get_db
-from .errors import MyStoreError
+from .basestorage import BaseStorage
+from .errors import MyStoreError, DuplicateKeyError
+from .cache import MappingCache
 from .units import DbmFileUnit
 from .routers import OriginalRouter
 from .converters import CompressedJsonConverter
 
 
 SQLITE_FILENAME = "mapping.sqlite3"
+LOOKUP_TABLENAME = "lookup_keys"    # temporary table for big lookups
+# PRAGMA statements run on each new SQLite connection (see Storage 'sqlite_pragmas'):
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",      # readers don't block writers and vice versa
+    "synchronous": "normal",    # safe with WAL, fsync at checkpoints only
+    "cache_size": -64000,       # in KiB if negative
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 60000,      # ms to wait for a lock before failing
+}
+# pragmas that can't be set on read-only connections:
+SQLITE_WRITE_PRAGMAS = ("journal_mode", "synchronous")
 Base = declarative_base()
 
 
@@ -54,37 +67,65 @@ class MapRow(Base):
         return "<MapRow(key=%s at pk=%s)>" % (self.key, self.pk)
 
 
-class Storage:
+class PkCounter(Base):
+    """
+    Next pk to be reserved for each mapping table (see Storage._reserve_pks).
+    """
+    __tablename__ = "pk_counters"
+
+    table = sa.Column(sa.String, primary_key=True)
+    next_pk = sa.Column(sa.Integer, nullable=False)
+
+
+class DuplicateKeyIntegrityError(DuplicateKeyError, sa.exc.IntegrityError):
+    """
+    DuplicateKeyError raised by Storage. It is also an IntegrityError,
+    which Storage used to raise on duplicate keys.
+    """
+    def __init__(self, message, statement="save_many", params=None, orig=None):
+        sa.exc.IntegrityError.__init__(
+            self, statement, params, orig if orig is not None else MyStoreError(message))
+
+
+class Storage(BaseStorage):
+    """
+    BaseStorage with key -> pk mappings stored in SQLite table ('mapping_cls')
+    next to DB units.
+    Duplicate keys raise DuplicateKeyIntegrityError
+    (both DuplicateKeyError and sqlalchemy IntegrityError).
+    """
+    IN_QUERY_LIMIT = 500    # bigger key lists are looked up via temporary table
+    _duplicate_key_error = DuplicateKeyIntegrityError
+
     def __init__(self, db_path, params=None, router_cls=OriginalRouter,
                        unit_cls=DbmFileUnit, converter_cls=CompressedJsonConverter,
-                       mapping_cls=MapRow):
+                       mapping_cls=MapRow, pk_block_size=1000, sqlite_pragmas=None):
         """
         Initialize Storage instance.
         Initialize mystore.DB instance (create if not present yet).
         Configure SQLite access (create file if not present yet).
-        """
-        try:
-            self.db = get_db(db_path)
-        except MyStoreError:
-            if params is None:
-                params={
-                    "unit_size": 1000,
-                    "subfolder_size": 100,
-                    "first_key": 1
-                }
-            self.db = DB(db_path, params, router_cls, unit_cls, converter_cls).create()
 
+        pks are reserved by each process in blocks of at least 'pk_block_size'.
+        'sqlite_pragmas' override SQLITE_PRAGMAS (None values disable a pragma).
+        """
+        super().__init__(db_path, params, router_cls, unit_cls, converter_cls, pk_block_size)
         self.mapping_cls = mapping_cls
+        self.sqlite_pragmas = dict(SQLITE_PRAGMAS, **(sqlite_pragmas or {}))
         self.sqlite_filepath = os.path.join(db_path, SQLITE_FILENAME)
         self.session_factory = self.set_up_sqlite(self.sqlite_filepath)
+        self.read_session_factory = self.set_up_sqlite_reader(self.sqlite_filepath)
+        self.mapping_cache = None   # see 'enable_mapping_cache'
 
     def set_up_sqlite(self, filepath):
         """
         Get session factory.
         Create a new SQLite DB or use an existing one (if it already exists).
+        Connections are pooled and reused (see '_configure_engine').
         """
         db_engine_string = URL(drivername = 'sqlite', database = filepath)
-        engine = sa.create_engine(db_engine_string, echo=False)
+        engine = sa.create_engine(db_engine_string, echo=False,
+            poolclass=sa.pool.QueuePool, connect_args={"check_same_thread": False})
+        self._configure_engine(engine, self.sqlite_pragmas)
         # create a session factory:
         # (this factory, when called, will create a new Session object
         #  using the configurational arguments we’ve given the factory)
@@ -94,133 +135,177 @@ class Storage:
         # create DB if it doesn't exist yet / or does nothing
         # Base.metadata.create_all(engine)
         self.mapping_cls.__table__.create(engine, checkfirst=True)
+        PkCounter.__table__.create(engine, checkfirst=True)
         # return the factory (passing new arguments when calling
         # session_factory will override existing configuration):
         return session_factory
 
-    def save_one(self, k, v):
+    def set_up_sqlite_reader(self, filepath):
         """
-        Save one key value pair.
-        Doesn't overwrite existing keys.
+        Get session factory for lookups, using read-only connections
+        (must be called after 'set_up_sqlite', which creates the file).
         """
-        mr = self.mapping_cls(key=k)    # mr stands for 'MapRow' object
-        with session_scope(self.session_factory()) as session:
-            session.add(mr)
-            session.flush()
-            with self.db.writer() as writer:
-                writer[mr.pk] = v
+        uri = "file:%s?mode=ro" % pathname2url(os.path.abspath(filepath))
+        engine = sa.create_engine("sqlite://", echo=False, poolclass=sa.pool.QueuePool,
+            creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False))
+        pragmas = {k: v for k,v in self.sqlite_pragmas.items() if k not in SQLITE_WRITE_PRAGMAS}
+        self._configure_engine(engine, pragmas)
+        return sessionmaker(bind=engine)
 
-    def save_many(self, items):
-        """
-        Save many key-value pairs at once.
-        Raise an exception and write nothing on duplicate keys.
+    def enable_mapping_cache(self, max_keys=None):
         """
-        mrs = [self.mapping_cls(key=k) for k,v in items]
-        with session_scope(self.session_factory()) as session:
-            session.add_all(mrs)    # bulk_save_objects?
-            session.flush()
-            with self.db.writer() as writer:
-                for mr, (k,v) in zip(mrs, items):
-                    writer[mr.pk] = v
+        Cache key -> pk mappings in memory, so lookups of cached keys
+        don't query SQLite at all (keys not found are still looked up in SQLite).
 
-    def save_many_if_missing(self, items):
-        """
-        Same as the save_many, but won't raise an error if a key is already there.
-        Only saves those that aren't in DB yet.
+        With 'max_keys' mappings of up to 'max_keys' recently used keys are cached.
+        Without it the whole mapping table is loaded at once (suitable for
+        read-mostly deployments), use 'refresh_mapping_cache' to load new rows.
+        See 'mapping_cache.stats()' for hit rate and other metrics.
         """
-        mrs = [self.mapping_cls(key=k) for k,v in items]
-        keys = [k for k,v in items]
+        self.mapping_cache = MappingCache(max_keys)
+        if max_keys is None:
+            self.refresh_mapping_cache()
 
-        with session_scope(self.session_factory()) as session:
-            q = session.query(self.mapping_cls).filter(self.mapping_cls.key.in_(keys))
-            keys_in_db = set(mr.key for mr in q)
-            missing = [(mr, v) for (k,v), mr in zip(items, mrs) if k not in keys_in_db]
+    def refresh_mapping_cache(self, chunk=100000):
+        """
+        Load mappings with pks bigger than any loaded before into snapshot cache.
 
-            session.add_all([mr for mr, v in missing])
-            session.flush()
+        Processes commit their reserved pk blocks in any order, so a row
+        with a smaller pk can be committed after a bigger one was loaded.
+        Such rows are not loaded here, but are still found (and cached)
+        when looked up.
+        """
+        cache = self.mapping_cache
+        if cache is None or cache.max_keys is not None:
+            return
+        cls = self.mapping_cls
+        while True:
+            with session_scope(self.read_session_factory()) as session:
+                q = session.query(cls.key, cls.pk).filter(cls.pk > cache.max_pk)
+                rows = q.order_by(cls.pk).limit(chunk).all()
+            cache.update_snapshot(rows)
+            if len(rows) < chunk:
+                return
 
-            with self.db.writer() as writer:
-                for mr, v in missing:
-                    writer[mr.pk] = v
+    def disable_mapping_cache(self):
+        self.mapping_cache = None
 
-    def get_one(self, k, default=None):
+    # ******* implementation details *******
+    def _iter_mapping_pages(self, chunk, max_chunk):
         """
-        Get one value from storage for specified key.
+        Mapping rows ordered by pk (i.e. by unit), paged by pk
+        (WHERE pk > last pk of previous page), so every page costs
+        the same regardless of its position.
         """
-        with session_scope(self.session_factory()) as session:
-            q = session.query(self.mapping_cls).filter(self.mapping_cls.key == k)
-            mr = q.one_or_none() # error if multiple results, None if no results
-            if mr is None:
-                return default
-            else:
-                with self.db.reader() as reader:
-                    v = reader[mr.pk]
-                return v
+        cls = self.mapping_cls
+        last_pk = None
+        while True:
+            with session_scope(self.read_session_factory()) as session:
+                q = session.query(cls.key, cls.pk)
+                if last_pk is not None:
+                    q = q.filter(cls.pk > last_pk)
+                rows = q.order_by(cls.pk).limit(chunk).all()
+            if rows:
+                yield rows
+            if len(rows) < chunk:
+                return
+            last_pk = rows[-1][1]
+            chunk = min(chunk * 2, max_chunk)
 
-    def get_many(self, keys, default=None):
+    def _get_pk_map(self, keys):
         """
-        Get list of values for given list of keys.
+        Return {key: pk} dict for those of 'keys' that are in storage.
+        Only keys missing in mapping cache (if enabled) are looked up in SQLite.
         """
-        with session_scope(self.session_factory()) as session:
-            q = session.query(self.mapping_cls).filter(self.mapping_cls.key.in_(keys))
-            mrs = q.all()
-            pk_map = {mr.key: mr.pk for mr in mrs}
-            if mrs:
-                with self.db.reader() as reader:
-                    pkv_dict = reader.get_many([mr.pk for mr in mrs])
-            else:
-                pkv_dict = {}
-
-        values = []
-        for key in keys:
-            pk = pk_map.get(key)
-            if pk is not None:
-                values += [pkv_dict.get(pk, default)]
-            else:
-                values += [default]
-
-        return values
-
-    def yield_many(self, keys, default=None, chunk_size = 1000):
-        """
-        Generator to avoid reading all items at once.
-        Returns tuples (key, value).
+        keys = list(keys)
+        if not keys:
+            return {}
+        cache = self.mapping_cache
+        if cache is None:
+            return self._query_pk_map(keys)
+        pk_map = cache.get_many(keys)
+        if len(pk_map) < len(keys):
+            found = self._query_pk_map([k for k in keys if k not in pk_map])
+            cache.put_many(found)
+            pk_map.update(found)
+        return pk_map
+
+    def _query_pk_map(self, keys):
         """
-        while True:
-            chunk_of_keys, keys = keys[:chunk_size], keys[chunk_size:]
-            if not chunk_of_keys:
-                return
-            values = self.get_many(chunk_of_keys, default)
-            for key, value in zip(chunk_of_keys, values):
-                yield (key, value)
+        Look up {key: pk} dict in SQLite.
+
+        Up to IN_QUERY_LIMIT keys are looked up with 'key IN (...)' query.
+        Longer lists would hit SQLite limit on number of bound parameters,
+        so keys are bulk inserted into a temporary table and joined instead.
+        """
+        cls = self.mapping_cls
+        with session_scope(self.read_session_factory()) as session:
+            if len(keys) <= self.IN_QUERY_LIMIT:
+                q = session.query(cls.key, cls.pk).filter(cls.key.in_(keys))
+                return dict(q)
+
+            # temporary tables live in a separate database, writable
+            # even on read-only connections, and are private to the connection:
+            lookup = sa.Table(LOOKUP_TABLENAME, sa.MetaData(),
+                sa.Column("key", cls.__table__.c.key.type, primary_key=True),
+                prefixes=["TEMPORARY"])
+            session.execute(sa.text("DROP TABLE IF EXISTS temp.%s" % LOOKUP_TABLENAME))
+            session.execute(sa.schema.CreateTable(lookup))
+            session.execute(lookup.insert().prefix_with("OR IGNORE"), [{"key": k} for k in keys])
+            q = session.query(cls.key, cls.pk).join(lookup, lookup.c.key == cls.key)
+            pk_map = dict(q)
+            session.execute(sa.text("DROP TABLE temp.%s" % LOOKUP_TABLENAME))
+            return pk_map
 
-    def get_missing_keys(self, keys):
+    @staticmethod
+    def _configure_engine(engine, pragmas):
         """
-        Get list of keys that are not in storage for given list of keys.
+        Run PRAGMA statements on each new connection
+        and don't reuse pooled connections in forked processes.
         """
+        @sa.event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            connection_record.info["pid"] = os.getpid()
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                if value is not None:
+                    cursor.execute("PRAGMA %s=%s" % (name, value))
+            cursor.close()
+
+        @sa.event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            if connection_record.info["pid"] != os.getpid():
+                connection_record.connection = connection_proxy.connection = None
+                raise sa.exc.DisconnectionError(
+                    "Connection belongs to pid %s, attempting to check out in pid %s" %
+                    (connection_record.info["pid"], os.getpid()))
+
+    def _reserve_pk_block(self, size):
+        """ Reserve 'size' contiguous pks in a short transaction, return (first, end). """
+        table = self.mapping_cls.__tablename__
         with session_scope(self.session_factory()) as session:
-            q = session.query(self.mapping_cls).filter(self.mapping_cls.key.in_(keys))
-            keys_in_db = set(mr.key for mr in q)
-        return [k for k in keys if k not in keys_in_db]
+            # take write lock right away, so the counter is read and updated atomically:
+            session.execute(sa.text("BEGIN IMMEDIATE"))
+            counter = session.query(PkCounter).get(table)
+            if counter is None:
+                max_pk = session.query(sa.func.max(self.mapping_cls.pk)).scalar()
+                counter = PkCounter(table=table, next_pk=(max_pk or 0) + 1)
+                session.add(counter)
+            first = counter.next_pk
+            counter.next_pk = first + size
+        lg.debug("reserved pks %s-%s", first, first + size - 1)
+        return first, first + size
 
-    def get_all(self, chunk=100):
+    def _insert_mappings(self, pks, keys, ignore_existing=False):
         """
-        Generator.
-        Get all (k,v) pairs stored in storage.
+        Insert mapping rows with a single executemany statement (bypassing the ORM).
         """
-        offset = 0
-        while True:
+        insert = self.mapping_cls.__table__.insert()
+        if ignore_existing:
+            insert = insert.prefix_with("OR IGNORE")
+        try:
             with session_scope(self.session_factory()) as session:
-                q = session.query(self.mapping_cls).order_by(self.mapping_cls.pk)
-                mrs = q[offset:(offset+chunk)]
-                pk_map = {mr.pk: mr.key for mr in mrs}
-                if mrs:
-                    with self.db.reader() as reader:
-                        pkv_dict = reader.get_many([mr.pk for mr in mrs])
-
-            for pk, v in pkv_dict.items():
-                yield (pk_map[pk], v)
-
-            offset += len(mrs)
-            if len(mrs) < chunk:
-                break
+                session.execute(insert, [{"pk": pk, "key": k} for pk, k in zip(pks, keys)])
+        except sa.exc.IntegrityError as e:    # saved by another process meanwhile
+            raise DuplicateKeyIntegrityError("Keys already saved: %s" % e.orig,
+                                             e.statement, e.params, e.orig) from e
@@ -6,6 +6,7 @@ from .base import BaseUnit
 from .dbmfile import DbmFileUnit
 from .jsonfile import JsonFileUnit
 from .dir import DirUnit
+from .block import BlockUnit
 try:
     import plyvel
 except ImportError:
@@ -7,6 +7,7 @@ lg = logging.getLogger(__name__)
 
 import os
 import abc
+import shutil
 
 from mystore.errors import MyStoreError
 
@@ -58,6 +59,18 @@ class BaseUnit(metaclass=abc.ABCMeta):
     def __setitem__(self, k, v):
         """ Set value to be stored in unit for specified key. """
 
+    def __delitem__(self, k):
+        """ Remove key from unit (KeyError if it is not there). """
+        self._raise_unsupported()
+
+    def update(self, items):
+        """
+        Set many (k, v) pairs at once.
+        Units override it if they have a faster way to write in batches.
+        """
+        for k, v in items:
+            self[k] = v
+
     @abc.abstractmethod
     def keys(self):
         """ Load and return list of all keys contained in the unit. """
@@ -105,3 +118,55 @@ class BaseUnit(metaclass=abc.ABCMeta):
                 _, file_extension = os.path.splitext(filepath)
                 if file_extension == cls.EXTENSION:
                     yield filepath
+
+    @classmethod
+    def get_unit_size(cls, path):
+        """ Return size of unit at 'path' in bytes (0 if it doesn't exist). """
+        if os.path.isdir(path):
+            return sum(os.path.getsize(os.path.join(dirpath, fn))
+                       for dirpath, dirnames, filenames in os.walk(path) for fn in filenames)
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    @classmethod
+    def compact(cls, path):
+        """
+        Reclaim space left by deleted or overwritten values in unit at 'path'.
+        This default implementation does nothing (units rewritten as a whole
+        on every write never keep such space).
+        """
+
+    @classmethod
+    def sync(cls, path):
+        """
+        Flush content of (closed) unit at 'path' and its directory entry to disk,
+        so it survives a crash (see mystore.wal).
+        """
+        paths = [path]
+        if os.path.isdir(path):
+            paths = [os.path.join(dirpath, fn)
+                     for dirpath, dirnames, filenames in os.walk(path) for fn in filenames]
+            paths.append(path)
+        paths.append(os.path.dirname(path))
+        for p in paths:
+            try:
+                fd = os.open(p, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    @classmethod
+    def destroy(cls, path):
+        """ Remove unit at 'path' (if it exists). """
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,237 @@
+"""
+This module contains BlockUnit, BaseUnit implementation storing values
+in compressed blocks of several values each.
+
+Compressing values one by one throws away redundancy between values,
+so values are concatenated into blocks of about BLOCK_SIZE bytes
+which are compressed as a whole. File layout:
+    - MAGIC;
+    - length of index (8 bytes, big-endian);
+    - uncompressed JSON index:
+        {"blocks": [[offset, length], ...], "keys": {key: [block, offset, length]}};
+    - compressed blocks.
+
+Decompressed blocks are kept in a process-wide LRU cache (see 'block_cache'),
+so reading neighbouring values decompresses each block only once.
+
+Writing rewrites the whole file on close if anything changed (like JsonFileUnit does),
+so this unit works best for data written in bulk and read often.
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import json
+import zlib
+import fcntl
+import struct
+import threading
+from collections import OrderedDict
+
+from .base import BaseUnit
+from mystore.errors import MyStoreError, BaseUnitDoesNotExist
+
+
+MAGIC = b"MYSTOREBLK1\n"
+INDEX_LENGTH = struct.Struct(">Q")
+
+
+class BlockCache:
+    """
+    LRU cache of decompressed blocks limited by total size of blocks in bytes.
+    Blocks are identified by unit path and file modification time/size,
+    so a rewritten unit never returns stale blocks.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, block_id):
+        with self._lock:
+            block = self._blocks.get(block_id)
+            if block is not None:
+                self._blocks.move_to_end(block_id)
+            return block
+
+    def put(self, block_id, block):
+        with self._lock:
+            if block_id in self._blocks:
+                return
+            self._blocks[block_id] = block
+            self.bytes += len(block)
+            while self.bytes > self.max_bytes and self._blocks:
+                _, evicted = self._blocks.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.bytes = 0
+
+
+block_cache = BlockCache()
+
+
+class BlockUnit(BaseUnit):
+    EXTENSION = ".blk"
+    BLOCK_SIZE = 64 * 1024      # uncompressed size of a block
+    LEVEL = 6                   # zlib compression level
+
+    def __init__(self, path, mode, *, wait_time=0.1):
+        self._file = None       # opened file (read modes)
+        self._items = None      # all unit items (write modes)
+        self._changed = False   # items are only written on close if changed
+        self._lock_file = None  # held in "W" mode
+        super().__init__(path, mode, wait_time=wait_time)
+
+    def __getitem__(self, k):
+        if self._items is not None:
+            return self._items[str(k)]
+        block_no, offset, length = self._index["keys"][str(k)]
+        block = self._get_block(block_no)
+        return block[offset:offset + length]
+
+    def __setitem__(self, k, v):
+        if self._items is None:
+            self._raise_unsupported()
+        if isinstance(v, str):
+            v = v.encode("utf-8")
+        self._items[str(k)] = v
+        self._changed = True
+
+    def __delitem__(self, k):
+        if self._items is None:
+            self._raise_unsupported()
+        del self._items[str(k)]
+        self._changed = True
+
+    def update(self, items):
+        if self._items is None:
+            self._raise_unsupported()
+        self._items.update((str(k), v.encode("utf-8") if isinstance(v, str) else v)
+                           for k, v in items)
+        self._changed = True
+
+    def keys(self):
+        if self._items is not None:
+            return list(self._items.keys())
+        return list(self._index["keys"].keys())
+
+    def items(self):
+        if self._items is not None:
+            return self._items.items()
+        return self._iter_items()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._items is not None:
+            if self._changed:
+                self._write(self._items)
+            self._items = None
+        if self._lock_file is not None:
+            self._lock_file.close()     # releases the lock
+            self._lock_file = None
+
+    @classmethod
+    def destroy(cls, path):
+        super().destroy(path)
+        super().destroy(path + ".lock")
+
+    # ******* implementation details *******
+    def _iter_items(self):
+        for k, (block_no, offset, length) in self._index["keys"].items():
+            block = self._get_block(block_no)
+            yield (k, block[offset:offset + length])
+
+    def _get_block(self, block_no):
+        block_id = (self.path, self._stamp, block_no)
+        block = block_cache.get(block_id)
+        if block is None:
+            offset, length = self._index["blocks"][block_no]
+            self._file.seek(self._data_offset + offset)
+            block = zlib.decompress(self._file.read(length))
+            block_cache.put(block_id, block)
+        return block
+
+    def _open_for_read(self):
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            raise BaseUnitDoesNotExist
+        stat = os.fstat(self._file.fileno())
+        self._stamp = (stat.st_mtime_ns, stat.st_size)
+        self._index, self._data_offset = self._read_index(self._file)
+
+    # files are replaced atomically on write, so readers never need to wait:
+    _open_for_read_loop = _open_for_read
+
+    def _open_for_write(self):
+        try:
+            with open(self.path, "rb") as f:
+                index, data_offset = self._read_index(f)
+                blocks = []
+                for offset, length in index["blocks"]:
+                    f.seek(data_offset + offset)
+                    blocks.append(zlib.decompress(f.read(length)))
+        except FileNotFoundError:
+            if not os.path.exists(self.dirname):
+                self._create_directory()
+            self._items = OrderedDict()
+        else:
+            self._items = OrderedDict(
+                (k, blocks[block_no][offset:offset + length])
+                for k, (block_no, offset, length) in index["keys"].items())
+
+    def _open_for_write_loop(self):
+        """
+        Same as "w" mode, but wait for other writers to finish first.
+        A separate lock file is used as the unit file itself gets replaced on close.
+        """
+        if not os.path.exists(self.dirname):
+            self._create_directory()
+        self._lock_file = open(self.path + ".lock", "wb")
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        self._open_for_write()
+
+    @staticmethod
+    def _read_index(f):
+        if f.read(len(MAGIC)) != MAGIC:
+            raise MyStoreError("Not a block unit: %s" % f.name)
+        index_length, = INDEX_LENGTH.unpack(f.read(INDEX_LENGTH.size))
+        index = json.loads(f.read(index_length).decode("utf-8"))
+        return index, len(MAGIC) + INDEX_LENGTH.size + index_length
+
+    def _write(self, items):
+        keys_index, blocks_index, blocks = OrderedDict(), [], []
+        chunk, chunk_size, data_size = [], 0, 0
+
+        def flush_block():
+            nonlocal chunk, chunk_size, data_size
+            compressed = zlib.compress(b"".join(chunk), self.LEVEL)
+            blocks_index.append([data_size, len(compressed)])
+            blocks.append(compressed)
+            data_size += len(compressed)
+            chunk, chunk_size = [], 0
+
+        for k, v in items.items():
+            keys_index[k] = [len(blocks), chunk_size, len(v)]
+            chunk.append(v)
+            chunk_size += len(v)
+            if chunk_size >= self.BLOCK_SIZE:
+                flush_block()
+        if chunk:
+            flush_block()
+
+        index = json.dumps({"blocks": blocks_index, "keys": keys_index}).encode("utf-8")
+        tmp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(INDEX_LENGTH.pack(len(index)))
+            f.write(index)
+            for block in blocks:
+                f.write(block)
+        os.replace(tmp_path, self.path)
@@ -23,6 +23,9 @@ class DbmFileUnit(BaseUnit):
     def __setitem__(self, k, v):
         self._handle[str(k)] = v
 
+    def __delitem__(self, k):
+        del self._handle[str(k)]
+
     def close(self):
         lg.debug("closing old dbm handle")
         self._handle.close()
@@ -33,6 +36,12 @@ class DbmFileUnit(BaseUnit):
     def items(self):
         return {k: self[k] for k in self.keys()}.items()
 
+    @classmethod
+    def compact(cls, path):
+        """ gdbm files never shrink by themselves, reorganize rewrites them. """
+        with cls(path, "W") as unit:
+            unit._handle.reorganize()
+
     # ******* implementation details *******
     def _open_for_read(self):
         try:
@@ -29,6 +29,12 @@ class DirUnit(BaseUnit):
         with open(os.path.join(self.dirname, str(k)), "wb") as f:
             f.write(v)
 
+    def __delitem__(self, k):
+        try:
+            os.remove(os.path.join(self.dirname, str(k)))
+        except FileNotFoundError:
+            raise KeyError(k)
+
     def keys(self):
         return os.listdir(self.dirname)
 
@@ -21,6 +21,12 @@ class JsonFileUnit(BaseUnit):
     def __setitem__(self, k, v):
         self._handle[str(k)] = v
 
+    def __delitem__(self, k):
+        del self._handle[str(k)]
+
+    def update(self, items):
+        self._handle.update((str(k), v) for k, v in items)
+
     def keys(self):
         return list(self._handle.keys())
 
@@ -39,6 +39,15 @@ class LeveldbUnit(BaseUnit):
     def __setitem__(self, k, v):
         self._handle.put(str(k).encode("ascii"), v)
 
+    def __delitem__(self, k):
+        self[k]     # KeyError if missing
+        self._handle.delete(str(k).encode("ascii"))
+
+    def update(self, items):
+        with self._handle.write_batch() as batch:
+            for k, v in items:
+                batch.put(str(k).encode("ascii"), v)
+
     def close(self):
         self._handle.close()
 
@@ -51,6 +60,11 @@ class LeveldbUnit(BaseUnit):
             for k, v in it:
                 yield (k.decode('ascii'), v)
 
+    @classmethod
+    def compact(cls, path):
+        with cls(path, "w") as unit:
+            unit._handle.compact_range()
+
     def _open_for_read(self):
         try:
             handle = plyvel.DB(self.path, create_if_missing=False)
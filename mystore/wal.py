@@ -0,0 +1,282 @@
+"""
+This module contains WriteAheadLog, an optional log of writes
+making them durable before they reach units (see DB.enable_wal).
+
+Writers append records to the log and fsync it, which is much faster
+than syncing units on every write: fsyncs of writes committed
+at the same time by several threads are shared (group commit).
+Units are updated later in batches (see Writer.flush), synced,
+and then the records are dropped from the log.
+
+Each process appends to its own segment files in WAL_DIRNAME,
+locked (flock) while the process is alive. Segments nobody holds
+a lock on were left by crashed processes. Records carry a sequence
+number (time of append), so records of a crashed process can be
+applied in order with records of other processes:
+    - writers using a log take over such segments on flush and apply
+      their records together with their own (see 'claim_orphan_segments'),
+      so they are never applied over newer writes;
+    - 'replay' (done by DB.load) applies them once no process
+      has a log open (they hold LOCK_FILENAME shared meanwhile).
+Writers not using the log are not ordered with logged writes.
+
+Record layout: length of payload and its crc32 (4 bytes each, big-endian),
+payload - pickled (sequence number, op, key, raw value) tuple, where op is
+"s" (set) or "d" (delete, raw value is None).
+A torn or corrupt record ends the segment (it was never committed).
+"""
+import logging
+lg = logging.getLogger(__name__)
+
+import os
+import time
+import zlib
+import fcntl
+import pickle
+import bisect
+import struct
+import tempfile
+import threading
+
+
+WAL_DIRNAME = "wal"
+SEGMENT_EXTENSION = ".log"
+LOCK_FILENAME = "lock"
+SEGMENT_BYTES = 16 * 1024 * 1024
+RECORD_HEADER = struct.Struct(">II")
+
+
+class WriteAheadLog:
+    """
+    Write-ahead log of this process.
+
+    Records are appended to the current segment, a new one is started
+    once it is 'segment_bytes' long. Old segments are removed once all
+    their records are applied (by any writer), the current one is emptied.
+
+    Arguments
+    ---------
+    wal_dir: str
+        Directory of segment files.
+    commit_delay: float
+        Seconds to wait before each fsync, so that more concurrent
+        commits share it (adds latency, saves fsyncs).
+    segment_bytes: int
+        Size of segment to start a new one at.
+    """
+    def __init__(self, wal_dir, commit_delay=0, segment_bytes=SEGMENT_BYTES):
+        self.wal_dir = wal_dir
+        self.commit_delay = commit_delay
+        self.segment_bytes = segment_bytes
+        self.fsyncs = 0
+        self._lock = threading.Lock()       # appends
+        self._sync_lock = threading.Lock()  # one fsync at a time
+        self._written = 0                   # number of records appended (log sequence number)
+        self._synced = 0                    # records known to be on disk
+        self._seq = 0                       # sequence number of the last append
+        os.makedirs(wal_dir, exist_ok=True)
+        # shared by processes with a log open, 'replay' waits for none to be:
+        self._lock_file = open(os.path.join(wal_dir, LOCK_FILENAME), "ab")
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_SH)
+        self._segments = [_Segment(*self._open_segment(), 1)]   # oldest first
+
+    @property
+    def path(self):
+        """ Path of the current segment. """
+        return self._segments[-1].path
+
+    def append(self, records):
+        """
+        Append (op, key, raw value) records, return their sequence number
+        and log sequence number of the last one (to be passed to 'commit'
+        and, with log sequence numbers of the others, to 'applied').
+        """
+        records = list(records)
+        with self._lock:
+            self._seq = seq = max(self._seq + 1, time.time_ns())
+            data = []
+            for record in records:
+                payload = pickle.dumps((seq,) + tuple(record), protocol=pickle.HIGHEST_PROTOCOL)
+                data.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+                data.append(payload)
+            segment = self._segments[-1]
+            segment.file.write(b"".join(data))
+            self._written += len(records)
+            segment.unapplied += len(records)
+            if segment.file.tell() >= self.segment_bytes:
+                self._rotate()
+            return seq, self._written
+
+    def commit(self, lsn):
+        """
+        Return once records up to 'lsn' are on disk.
+        A thread syncing the log syncs records of all threads appended so far,
+        other threads wait for it and return without syncing if it covered them.
+        """
+        if self._synced >= lsn:
+            return
+        with self._sync_lock:
+            if self._synced >= lsn:
+                return      # synced by another thread meanwhile
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+            with self._lock:
+                f = self._segments[-1].file   # older segments were synced on rotation
+                f.flush()
+                written = self._written
+            os.fsync(f.fileno())
+            self.fsyncs += 1
+            self._synced = max(self._synced, written)
+
+    def applied(self, lsns):
+        """
+        Mark records of log sequence numbers 'lsns' as written to units
+        (and units synced). Old segments with all records applied are removed,
+        the current one is emptied.
+        """
+        with self._lock:
+            first_lsns = [segment.first_lsn for segment in self._segments]
+            for lsn in lsns:
+                self._segments[bisect.bisect_right(first_lsns, lsn) - 1].unapplied -= 1
+            done = [segment for segment in self._segments[:-1] if segment.unapplied == 0]
+            for segment in done:
+                self._segments.remove(segment)
+                os.remove(segment.path)
+            current = self._segments[-1]
+            if current.unapplied == 0:
+                current.file.truncate(0)
+        if done:
+            with self._sync_lock:   # not closed while being synced
+                for segment in done:
+                    segment.file.close()
+
+    def close(self):
+        """ Close segments, remove those with all records applied. """
+        with self._sync_lock, self._lock:
+            if not self._segments:
+                return
+            for segment in self._segments:
+                if segment.unapplied == 0:
+                    os.remove(segment.path)
+                else:
+                    lg.warning("closing WAL segment with %s unapplied records: %s",
+                               segment.unapplied, segment.path)
+                segment.file.close()     # releases the lock
+            self._segments = []
+            self._lock_file.close()
+
+    # ******* implementation details *******
+    def _rotate(self):
+        """ Sync the current segment and start a new one (holding '_lock'). """
+        segment = self._segments[-1]
+        segment.file.flush()
+        os.fsync(segment.file.fileno())
+        self.fsyncs += 1
+        self._synced = max(self._synced, self._written)
+        self._segments.append(_Segment(*self._open_segment(), self._written + 1))
+
+    def _open_segment(self):
+        while True:
+            fd, path = tempfile.mkstemp(suffix=SEGMENT_EXTENSION,
+                                        prefix="%s_" % os.getpid(), dir=self.wal_dir)
+            f = os.fdopen(fd, "ab")
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return path, f
+            except FileNotFoundError:
+                pass
+            # removed (claimed by another process) before we locked it:
+            f.close()
+
+
+class _Segment:
+    __slots__ = ("path", "file", "first_lsn", "unapplied")
+
+    def __init__(self, path, file, first_lsn):
+        self.path = path
+        self.file = file
+        self.first_lsn = first_lsn  # log sequence number of the first record appended to it
+        self.unapplied = 0          # records not written to units yet
+
+
+def replay(db, wal_dir):
+    """
+    Apply segments in 'wal_dir' left by crashed processes to units of 'db'
+    (in order of sequence numbers) and remove them.
+    Nothing is done while any process has a log open: its writers
+    take the segments over, ordered with their own records.
+    Return number of records replayed.
+    """
+    with open(os.path.join(wal_dir, LOCK_FILENAME), "ab") as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lg.info("WAL of %s is in use, segments are left to its writers", db.root)
+            return 0
+        segments = claim_orphan_segments(wal_dir)
+        records = [record for seq, record in
+                   sorted((e for path, f, entries in segments for e in entries),
+                          key=lambda e:e[0])]
+        if records:
+            with db.writer() as writer:
+                writer.apply(records)
+        for path, f, entries in segments:
+            lg.info("replayed %s WAL records from %s", len(entries), path)
+        remove_segments(segments)
+        return len(records)
+
+
+def claim_orphan_segments(wal_dir):
+    """
+    Lock segments in 'wal_dir' left by crashed processes and read them.
+    Return list of (path, file, entries), where entries are
+    (sequence number, (op, key, raw value) record) pairs.
+    Segments stay locked until 'remove_segments' is called
+    (once their records are applied).
+    """
+    segments = []
+    for fn in sorted(os.listdir(wal_dir)):
+        if not fn.endswith(SEGMENT_EXTENSION):
+            continue
+        path = os.path.join(wal_dir, fn)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            continue    # claimed by another process
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()   # segment of a running process
+            continue
+        if os.path.exists(path):
+            segments.append((path, f, [(r[0], r[1:]) for r in read_records(f)]))
+        else:
+            f.close()
+    return segments
+
+
+def remove_segments(segments):
+    """ Remove segments returned by 'claim_orphan_segments'. """
+    for path, f, entries in segments:
+        os.remove(path)
+        f.close()
+
+
+def read_records(f):
+    """
+    Generator of (sequence number, op, key, raw value) records of segment
+    file 'f', stops at the first torn or corrupt one.
+    """
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) < RECORD_HEADER.size:
+            break
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        yield pickle.loads(payload)
+    lg.warning("WAL segment %s ends with a torn record, ignored", f.name)
@@ -28,10 +28,13 @@ setup(
     install_requires=[],
     extras_require={
         "storage": ["sqlalchemy"],
-        "leveldb": ["plyvel"]
+        "leveldb": ["plyvel"],
+        "msgpack": ["msgpack>=1.0"],
+        "orjson": ["orjson"],
+        "numpy": ["numpy"]
     },
     cmdclass={
         'clean': CleanCommand,
     }
 )
-# optional dependencies: plyvel, sqlalchemy 
+# optional dependencies: plyvel, sqlalchemy, msgpack, orjson, numpy 
@@ -15,9 +15,17 @@ python -m unittest -h (help + run examples)
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
 
-from .test_routers import OriginalRouterTest
-from .test_units import DbmFileUnitTest
+from .test_routers import (
+    OriginalRouterTest, HashRouterTest, MultiRootRouterTest, SplittingRouterTest)
+from .test_units import DbmFileUnitTest, BlockUnitTest
 from .test_db_create import DBCreateTest
-from .test_db_io import DBReaderTest
+from .test_db_io import DBReaderTest, DBWriterTest
 from .test_concurrency import DBConcurrencyTest
-from .test_db_reformat import DBReformatTest
+from .test_db_reformat import DBReformatTest, DBRelayoutTest
+from .test_converters import ZdictConverterTest, BatchConversionTest, FastConvertersTest
+from .test_arrays import NumpyConverterTest
+from .test_cache import ValueCacheTest, SharedValueCacheTest
+from .test_index import KeyIndexTest, NativeStorageTest
+from .test_cli import CLITest
+from .test_wal import WriteAheadLogTest
+from .test_service import WriterServiceTest
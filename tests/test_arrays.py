@@ -0,0 +1,94 @@
+import unittest
+import shutil
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from mystore import DB
+
+from tests.helpers import get_db_path
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class NumpyConverterTest(unittest.TestCase):
+    """
+    Test NumpyConverter and CompressedNumpyConverter.
+    """
+    def setUp(self):
+        from mystore.converters import NumpyConverter, CompressedNumpyConverter
+        self.converters = [NumpyConverter(), CompressedNumpyConverter()]
+        self.array = np.arange(30, dtype=np.float32).reshape(5, 6)
+
+    def test_array(self):
+        for converter in self.converters:
+            dumped = converter.dump(self.array)
+            loaded = converter.load(dumped)
+            self.assertEqual(loaded.dtype, self.array.dtype)
+            np.testing.assert_array_equal(loaded, self.array)
+        # fortran-ordered and empty arrays:
+        for array in (np.asfortranarray(self.array), np.zeros((0, 3), dtype=np.int64)):
+            np.testing.assert_array_equal(self.converters[0].load(self.converters[0].dump(array)), array)
+
+    def test_zero_dimensional(self):
+        scalar = np.array(5, dtype=np.int16)
+        for converter in self.converters:
+            for loaded in (converter.load(converter.dump(scalar)),
+                           converter.load(converter.dump({"s": scalar}))["s"]):
+                self.assertEqual(loaded.shape, ())
+                self.assertEqual(loaded.dtype, scalar.dtype)
+                self.assertEqual(loaded, scalar)
+
+    def test_zero_copy(self):
+        dumped = self.converters[0].dump(self.array)
+        loaded = self.converters[0].load(dumped)
+        self.assertFalse(loaded.flags.owndata)
+        self.assertFalse(loaded.flags.writeable)
+        self.assertTrue(loaded.flags.aligned)
+
+    def test_dict_of_arrays(self):
+        value = {"a": self.array, "b": np.array([1, 2, 3], dtype=np.int8), "c": np.float64(2.5) * np.ones(7)}
+        for converter in self.converters:
+            loaded = converter.load(converter.dump(value))
+            self.assertEqual(sorted(loaded), sorted(value))
+            for k in value:
+                np.testing.assert_array_equal(loaded[k], value[k])
+                self.assertEqual(loaded[k].dtype, value[k].dtype)
+
+    def test_mixed_object(self):
+        value = {"name": "vector", "data": [self.array, np.arange(3)], "n": 2}
+        for converter in self.converters:
+            loaded = converter.load(converter.dump(value))
+            self.assertEqual(loaded["name"], "vector")
+            self.assertEqual(loaded["n"], 2)
+            np.testing.assert_array_equal(loaded["data"][0], self.array)
+            np.testing.assert_array_equal(loaded["data"][1], np.arange(3))
+
+    def test_structured_and_masked_arrays(self):
+        structured = np.array([(1, 2.5), (2, 3.5)], dtype=[("id", "<i4"), ("score", "<f4")])
+        masked = np.ma.masked_array([1, 2, 3], mask=[False, True, False])
+        for converter in self.converters:
+            for value in (structured, {"s": structured}):
+                loaded = converter.load(converter.dump(value))
+                loaded = loaded["s"] if isinstance(value, dict) else loaded
+                self.assertEqual(loaded.dtype, structured.dtype)
+                np.testing.assert_array_equal(loaded["score"], structured["score"])
+            loaded = converter.load(converter.dump(masked))
+            self.assertIsInstance(loaded, np.ma.MaskedArray)
+            np.testing.assert_array_equal(loaded.mask, masked.mask)
+
+    def test_db(self):
+        from mystore.converters import NumpyConverter
+        root = get_db_path()
+        try:
+            db = DB(root, {"unit_size": 3, "subfolder_size": 1, "first_key": 0},
+                    converter_cls=NumpyConverter).create()
+            with db.writer() as writer:
+                for k in range(10):
+                    writer[k] = self.array * k
+            with DB.load(root).reader() as reader:
+                for k in range(10):
+                    np.testing.assert_array_equal(reader[k], self.array * k)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,126 @@
+import unittest
+import time
+import os
+
+from mystore import DB
+from mystore.cache import ValueCache, SharedValueCache, MISSING
+
+from tests.helpers import DBTestsSetup
+
+
+class ValueCacheTest(DBTestsSetup, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.enable_cache()
+
+    def test_hits(self):
+        """ """
+        with self.db.reader() as reader:
+            first = [reader[k] for k, v in self.data]
+            second = [reader[k] for k, v in self.data]
+        self.assertListEqual(first, [v for k, v in self.data])
+        self.assertListEqual(second, first)
+        self.assertEqual(self.db.cache.hits, len(self.data))
+        self.assertEqual(self.db.cache.misses, len(self.data))
+        self.assertEqual(self.db.cache.hit_rate, 0.5)
+
+    def test_get_many(self):
+        """ """
+        keys = [k for k, v in self.data] + [11]
+        with self.db.reader() as reader:
+            reader.get_many(keys)
+            retrieved = reader.get_many(keys)
+        self.assertEqual(retrieved, dict(self.data + [(11, None)]))
+        self.assertEqual(self.db.cache.hits, len(self.data))
+
+    def test_invalidation_by_other_writer(self):
+        """ """
+        with self.db.reader() as reader:
+            self.assertEqual(reader[1], self.data[1][1])
+        time.sleep(0.01)    # make sure modification time changes
+        # DB instance without cache, as if in another process:
+        with DB.load(self.root_dir).writer() as writer:
+            writer[1] = "new value"
+        with self.db.reader() as reader:
+            self.assertEqual(reader[1], "new value")
+        self.assertEqual(self.db.cache.invalidations, 1)
+
+    def test_discard_on_write(self):
+        """ """
+        with self.db.reader() as reader:
+            reader[1]
+        with self.db.writer() as writer:
+            writer[1] = "new value"
+        with self.db.reader() as reader:
+            self.assertEqual(reader[1], "new value")
+
+    def test_size_limit(self):
+        """ """
+        cache = ValueCache(max_bytes=10)
+        cache.put("unit", 1, "one", b"12345", None)
+        cache.put("unit", 2, "two", b"12345", None)
+        cache.get("unit", 1, None)     # 1 is now most recently used
+        cache.put("unit", 3, "three", b"12345", None)
+        self.assertEqual(cache.get("unit", 1, None), "one")
+        self.assertIs(cache.get("unit", 2, None), MISSING)
+        self.assertEqual(cache.get("unit", 3, None), "three")
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.bytes, 10)
+        # values bigger than cache aren't cached
+        cache.put("unit", 4, "four", b"12345678901", None)
+        self.assertIs(cache.get("unit", 4, None), MISSING)
+
+
+class SharedValueCacheTest(DBTestsSetup, unittest.TestCase):
+    def test_shared_between_instances(self):
+        """ """
+        self.db.enable_shared_cache()
+        with self.db.reader() as reader:
+            [reader[k] for k, v in self.data]
+
+        # another instance, as if in another process:
+        db = DB.load(self.root_dir).enable_shared_cache()
+        with db.reader() as reader:
+            retrieved = [(k, reader[k]) for k, v in self.data]
+        self.assertListEqual(retrieved, self.data)
+        self.assertEqual(db.cache.hits, len(self.data))
+        self.assertEqual(db.cache.misses, 0)
+
+    def test_raw_store(self):
+        """ """
+        self.db.enable_shared_cache(store="raw")
+        with self.db.reader() as reader:
+            first = reader.get_many([k for k, v in self.data])
+            second = reader.get_many([k for k, v in self.data])
+        self.assertDictEqual(first, dict(self.data))
+        self.assertDictEqual(second, first)
+        self.assertEqual(self.db.cache.hits, len(self.data))
+
+    def test_invalidation(self):
+        """ """
+        self.db.enable_shared_cache()
+        with self.db.reader() as reader:
+            reader[1]
+        time.sleep(0.01)
+        with DB.load(self.root_dir).writer() as writer:
+            writer[1] = "new value"
+        with self.db.reader() as reader:
+            self.assertEqual(reader[1], "new value")
+            self.assertEqual(reader[1], "new value")
+        self.assertEqual(self.db.cache.hits, 1)
+
+    def test_eviction(self):
+        """ """
+        cache = SharedValueCache(os.path.join(self.root_dir, "small_cache"),
+                                 slots=2, slot_size=256, ways=2)
+        for k in range(3):
+            cache.put("unit", k, "value %s" % k, b"", (0, 0))
+        self.assertIs(cache.get("unit", 0, (0, 0)), MISSING)
+        self.assertEqual(cache.get("unit", 2, (0, 0)), "value 2")
+        self.assertEqual(cache.evictions, 1)
+        # too big for a slot:
+        cache.put("unit", 3, "x" * 1000, b"", (0, 0))
+        self.assertIs(cache.get("unit", 3, (0, 0)), MISSING)
+        cache.discard("unit", 2)
+        self.assertIs(cache.get("unit", 2, (0, 0)), MISSING)
+        cache.close()
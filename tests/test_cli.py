@@ -0,0 +1,74 @@
+import unittest
+import shutil
+import os
+import sys
+import io
+import json
+import gzip
+import tempfile
+from unittest import mock
+from contextlib import redirect_stdout
+
+from mystore import DB
+from mystore.__main__ import main
+
+from tests.helpers import DBTestsSetup, get_db_path
+
+
+class CLITest(DBTestsSetup, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.new_root = get_db_path()
+        self.stderr = mock.patch("sys.stderr", io.StringIO())
+        self.stderr.start()
+
+    def tearDown(self):
+        self.stderr.stop()
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        shutil.rmtree(self.new_root, ignore_errors=True)
+
+    def read_all(self, root):
+        with DB.load(root).reader() as reader:
+            return sorted((int(k), v) for k, v in reader.get_all())
+
+    def test_export_import(self):
+        for filename in ("data.jsonl", "data.jsonl.gz"):
+            path = os.path.join(self.tmp_dir, filename)
+            main(["export", self.root_dir, "-o", path])
+            with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as f:
+                records = [json.loads(line) for line in f]
+            self.assertListEqual(self.data, sorted((r["key"], r["value"]) for r in records))
+
+            new_root = os.path.join(self.tmp_dir, filename + ".db")
+            main(["import", new_root, "-i", path, "--chunk-size", "3",
+                  "--params", json.dumps(self.params), "--unit", "BlockUnit"])
+            self.assertEqual("BlockUnit", DB.load_config(new_root)["unit_cls"])
+            self.assertListEqual(self.data, self.read_all(new_root))
+
+    def test_stats(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            main(["stats", self.root_dir])
+        stats = json.loads(out.getvalue())
+        self.assertEqual(len(self.data), stats["records"])
+        self.assertEqual(4, stats["units"])
+        self.assertIn("records/s", self.stderr.new.getvalue())
+
+    def test_reformat(self):
+        main(["reformat", self.root_dir, self.new_root, "--unit", "BlockUnit",
+              "--converter", "JsonConverter"])
+        config = DB.load_config(self.new_root)
+        self.assertEqual("BlockUnit", config["unit_cls"])
+        self.assertDictEqual(self.params, config["params"])
+        self.assertListEqual(self.data, self.read_all(self.new_root))
+
+    def test_missing_db(self):
+        missing_root = os.path.join(self.tmp_dir, "missing")
+        for argv in (["export", missing_root], ["stats", missing_root],
+                     ["reformat", missing_root, self.new_root]):
+            with self.assertRaises(SystemExit) as cm:
+                main(argv)
+            self.assertEqual(1, cm.exception.code)
+        self.assertIn("error:", sys.stderr.getvalue())
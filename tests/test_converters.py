@@ -0,0 +1,194 @@
+import unittest
+import shutil
+from unittest import mock
+
+from mystore import (
+    DB,
+    CompressedJsonConverter,
+    ZdictCompressedJsonConverter,
+    OrjsonConverter,
+    CompressedOrjsonConverter,
+    MsgpackConverter,
+    CompressedMsgpackConverter,
+    handlers,
+    shortcuts,
+    MyStoreError
+)
+from mystore.converters import base
+
+from tests.helpers import get_db_path
+
+
+class ZdictConverterTest(unittest.TestCase):
+    """
+    Test ZdictCompressedJsonConverter.
+    """
+    def setUp(self):
+        self.data = [(i, {"entry_key": i, "description": "some value %s" % i,
+                          "category": "category %s" % (i % 3)}) for i in range(0, 50)]
+        self.root_dir = get_db_path()
+        self.params = {
+            "unit_size": 10,
+            "subfolder_size": 1,
+            "first_key": 0
+        }
+        self.db = DB(self.root_dir, self.params,
+                     converter_cls=ZdictCompressedJsonConverter).create()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+        self.db = None
+
+    def test_untrained(self):
+        v = self.data[0][1]
+        self.assertEqual(v, self.db.converter.load(self.db.converter.dump(v)))
+
+    def test_train(self):
+        converter = self.db.converter
+        untrained = [converter.dump(v) for k, v in self.data]
+        zdict_id = converter.train(v for k, v in self.data)
+        trained = [converter.dump(v) for k, v in self.data]
+
+        self.assertEqual(1, zdict_id)
+        self.assertLess(sum(map(len, trained)), sum(map(len, untrained)))
+        self.assertLess(sum(map(len, trained)),
+                        sum(len(CompressedJsonConverter().dump(v)) for k, v in self.data))
+        # values compressed with or without dictionary are both readable:
+        self.assertListEqual([v for k, v in self.data], [converter.load(v) for v in trained])
+        self.assertListEqual([v for k, v in self.data], [converter.load(v) for v in untrained])
+
+    def test_dictionary_reloaded(self):
+        self.db.converter.train(v for k, v in self.data)
+        with self.db.writer() as writer:
+            for k, v in self.data:
+                writer[k] = v
+
+        db = DB.load(self.root_dir)
+        with db.reader() as reader:
+            retrieved = sorted((int(k), v) for k, v in reader.get_all())
+        self.assertListEqual(retrieved, self.data)
+
+    def test_unknown_dictionary(self):
+        self.db.converter.train(v for k, v in self.data)
+        value = self.db.converter.dump(self.data[0][1])
+        other_db = DB(get_db_path(), self.params, converter_cls=ZdictCompressedJsonConverter)
+        with self.assertRaises(MyStoreError):
+            other_db.converter.load(value)
+
+    def test_truncated_value(self):
+        value = self.db.converter.dump(self.data[0][1])
+        with self.assertRaises(MyStoreError):
+            self.db.converter.load(value[:-4])
+
+    def test_reformat_to_zdictdb(self):
+        old_root, new_root = get_db_path(), get_db_path()
+        try:
+            old_db = shortcuts.create_dbmdb(old_root, 10, 1, 0)
+            with old_db.writer() as writer:
+                for k, v in self.data:
+                    writer[k] = v
+            new_db = shortcuts.dbmdb_to_zdictdb(old_root, new_root, sample_size=20)
+            with new_db.reader() as reader:
+                retrieved = sorted((int(k), v) for k, v in reader.get_all())
+            self.assertListEqual(retrieved, self.data)
+        finally:
+            shutil.rmtree(old_root, ignore_errors=True)
+            shutil.rmtree(new_root, ignore_errors=True)
+
+
+class BatchConversionTest(unittest.TestCase):
+    """
+    Test dump_many/load_many methods of converters.
+    """
+    def setUp(self):
+        self.values = [{"entry_key": i, "value": "some value %s" % i} for i in range(100)]
+
+    def test_in_process(self):
+        converter = CompressedJsonConverter()
+        dumped = converter.dump_many(self.values)
+        self.assertListEqual([converter.load(v) for v in dumped], self.values)
+        self.assertListEqual(converter.load_many(dumped), self.values)
+
+    def test_process_pool(self):
+        converter = CompressedJsonConverter()
+        converter.PARALLEL_THRESHOLD = 10
+        dumped = converter.dump_many(self.values, processes=2)
+        self.assertListEqual(converter.load_many(dumped, processes=2), self.values)
+        self.assertListEqual(converter.load_many(iter(dumped), processes=2), self.values)
+        base.shutdown_executors()
+        self.assertListEqual(converter.load_many(dumped, processes=2), self.values)
+
+    def test_serial_by_default(self):
+        converter = CompressedJsonConverter()
+        converter.PARALLEL_THRESHOLD = 10
+        with mock.patch.object(base, "get_executor") as get_executor:
+            self.assertListEqual(converter.load_many(converter.dump_many(self.values)), self.values)
+        get_executor.assert_not_called()
+
+
+class FastConvertersTest(unittest.TestCase):
+    """
+    Test converters based on optional serialisation libraries.
+    """
+    def setUp(self):
+        self.values = [{"entry_key": i, "value": "some value %s" % i, "list": [1, 2.5, None]}
+                       for i in range(10)]
+
+    def check_round_trip(self, converter):
+        dumped = [converter.dump(v) for v in self.values]
+        self.assertListEqual([converter.load(v) for v in dumped], self.values)
+
+    def test_orjson(self):
+        self.check_round_trip(OrjsonConverter())
+        self.check_round_trip(CompressedOrjsonConverter())
+
+    def test_orjson_fallback(self):
+        with mock.patch.object(handlers, "orjson", None):
+            self.check_round_trip(OrjsonConverter())
+            dumped = [OrjsonConverter().dump(v) for v in self.values]
+        self.assertListEqual([OrjsonConverter().load(v) for v in dumped], self.values)
+
+    @unittest.skipIf(handlers.orjson is None, "orjson is not installed")
+    def test_orjson_fallback_same_output(self):
+        value = {"name": "Zürich ✓", 1: [float("nan"), float("inf"), 2.5], "t": (1, "ü")}
+        dumped = handlers.object_to_orjson_binary(value)
+        with mock.patch.object(handlers, "orjson", None):
+            self.assertEqual(handlers.object_to_orjson_binary(value), dumped)
+            self.assertEqual(OrjsonConverter().load(dumped),
+                             {"name": "Zürich ✓", "1": [None, None, 2.5], "t": [1, "ü"]})
+
+    def test_compatible_with_compressed_json(self):
+        dumped = [CompressedJsonConverter().dump(v) for v in self.values]
+        self.assertListEqual([CompressedOrjsonConverter().load(v) for v in dumped], self.values)
+        dumped = [CompressedOrjsonConverter().dump(v) for v in self.values]
+        self.assertListEqual([CompressedJsonConverter().load(v) for v in dumped], self.values)
+
+    @unittest.skipIf(handlers.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        self.check_round_trip(MsgpackConverter())
+        self.check_round_trip(CompressedMsgpackConverter())
+
+    def test_msgpack_missing(self):
+        with mock.patch.object(handlers, "msgpack", None):
+            with self.assertRaises(MyStoreError):
+                MsgpackConverter().dump(self.values[0])
+
+    @unittest.skipIf(handlers.msgpack is None, "msgpack is not installed")
+    def test_reformat_to_msgpack(self):
+        old_root, new_root = get_db_path(), get_db_path()
+        params = {"unit_size": 3, "subfolder_size": 1, "first_key": 0}
+        try:
+            old_db = DB(old_root, params).create()
+            with old_db.writer() as writer:
+                writer.set_many(enumerate(self.values))
+            new_db = DB(new_root, params, converter_cls=CompressedMsgpackConverter).create()
+            old_db.reformat(new_db)
+
+            new_db = DB.load(new_root)
+            self.assertIsInstance(new_db.converter, CompressedMsgpackConverter)
+            with new_db.reader() as reader:
+                retrieved = [v for k, v in sorted((int(k), v) for k, v in reader.get_all())]
+            self.assertListEqual(retrieved, self.values)
+        finally:
+            shutil.rmtree(old_root, ignore_errors=True)
+            shutil.rmtree(new_root, ignore_errors=True)
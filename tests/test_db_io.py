@@ -1,6 +1,9 @@
 import unittest
+import os
 import threading
+from unittest import mock
 
+from mystore import LazyValue
 from mystore.errors import BaseUnitDoesNotExist
 
 from tests.helpers import DBTestsSetup
@@ -88,3 +91,135 @@ class DBReaderTest(DBTestsSetup, unittest.TestCase):
             retrieved = sorted((int(k), v) for k,v in reader.get_all())
         expected = sorted(self.data)
         self.assertListEqual(retrieved, expected)
+
+    def test_get_all_keys_only(self):
+        """ """
+        with self.db.reader() as reader:
+            retrieved = sorted(int(k) for k in reader.get_all(keys_only=True))
+        self.assertListEqual(retrieved, [k for k,v in self.data])
+
+    def test_get_all_raw(self):
+        """ """
+        with self.db.reader() as reader:
+            retrieved = sorted((int(k), self.db.converter.load(v))
+                               for k,v in reader.get_all(raw=True))
+        self.assertListEqual(retrieved, sorted(self.data))
+
+    def test_get_all_lazy(self):
+        """ """
+        with self.db.reader() as reader:
+            retrieved = sorted((int(k), v) for k,v in reader.get_all(lazy=True))
+        self.assertTrue(all(isinstance(v, LazyValue) for k,v in retrieved))
+        self.assertFalse(any(v.is_loaded for k,v in retrieved))
+        self.assertEqual(retrieved[3][1]["entry_key"], 3)
+        self.assertTrue(retrieved[3][1].is_loaded)
+        self.assertFalse(retrieved[4][1].is_loaded)
+        self.assertListEqual([(k, v.value) for k,v in retrieved], sorted(self.data))
+        self.assertEqual(retrieved[5][1], self.data[5][1])
+        self.assertEqual(sorted(retrieved[5][1].keys()), ["entry_key", "value"])
+
+    def test_lazy_truthiness(self):
+        with self.db.writer() as writer:
+            writer[20] = {}
+            writer[21] = 0
+        with self.db.reader() as reader:
+            values = reader.get_many([5, 20, 21], lazy=True)
+        self.assertTrue(values[5])
+        self.assertFalse(values[20])
+        self.assertFalse(values[21])
+
+    def test_get_many_raw_and_lazy(self):
+        """ """
+        keys = [k for k, v in self.data] + [11]
+        with self.db.reader() as reader:
+            raw = reader.get_many(keys, raw=True)
+            lazy = reader.get_many(keys, lazy=True)
+        self.assertIsNone(raw[11])
+        self.assertIsNone(lazy[11])
+        for k, v in self.data:
+            self.assertEqual(self.db.converter.load(raw[k]), v)
+            self.assertEqual(lazy[k].value, v)
+
+
+class DBWriterTest(DBTestsSetup, unittest.TestCase):
+    def test_set_many(self):
+        """ """
+        new_data = [(k, {"entry_key": k, "value": "new value %s" % k}) for k in range(5, 20)]
+        with self.db.writer(processes=2) as writer:
+            writer.BATCH_SIZE = 4
+            writer.set_many(iter(new_data))
+        expected = sorted(dict(self.data + new_data).items())
+        with self.db.reader() as reader:
+            retrieved = sorted((int(k), v) for k,v in reader.get_all())
+        self.assertListEqual(retrieved, expected)
+
+    def test_bulk_load(self):
+        new_data = [(k, {"entry_key": k, "value": "new value %s" % k}) for k in range(5, 20)]
+        new_data += [(7, {"entry_key": 7, "value": "last value"})]
+        opened = []
+        unit_cls = self.db.unit_cls
+        with mock.patch.object(self.db, "unit_cls",
+                               side_effect=lambda *a, **kw: opened.append(a[0]) or unit_cls(*a, **kw)):
+            self.assertEqual(len(new_data), self.db.bulk_load(reversed(new_data), chunk_size=4))
+        self.assertEqual(len(opened), len(set(opened)))     # each unit written once
+
+        expected = sorted(dict(self.data + new_data).items())
+        expected[7] = (7, {"entry_key": 7, "value": "new value 7"})  # last in reversed order
+        with self.db.reader() as reader:
+            retrieved = sorted((int(k), v) for k,v in reader.get_all())
+        self.assertListEqual(retrieved, expected)
+
+    def test_routing_refreshed_on_unit_open_only(self):
+        with self.db.writer() as writer:
+            writer[0] = {"entry_key": 0}
+            with mock.patch.object(self.db, "refresh", wraps=self.db.refresh) as refresh:
+                for k in range(1, 3):
+                    writer[k] = {"entry_key": k}
+                    del writer[k]
+                refresh.assert_not_called()     # same unit stays open
+                writer[3] = {"entry_key": "next unit"}
+                refresh.assert_called_once()
+
+    def test_delete(self):
+        with self.db.writer() as writer:
+            del writer[4]
+            with self.assertRaises(KeyError):
+                del writer[4]
+            self.assertEqual(2, writer.delete_many([1, 2, 100]))
+        with self.db.reader() as reader:
+            self.assertListEqual(sorted(int(k) for k in reader.get_all(keys_only=True)),
+                                 [0, 3, 5, 6, 7, 8, 9])
+            with self.assertRaises(KeyError):
+                reader[4]
+        self.assertListEqual(sorted(self.db.get_all_unit_paths()),
+                             sorted(set(map(self.db.router.get_path, range(10)))))
+
+    def test_compact(self):
+        unit_path = self.db.router.get_path(0)
+        with self.db.writer() as writer:
+            for k in (1, 2):    # same unit as key 0
+                writer[k] = {"entry_key": k, "value": os.urandom(200000).hex()}
+        full_size = self.db.unit_cls.get_unit_size(unit_path)
+        with self.db.writer() as writer:
+            writer.delete_many([1, 2, 4, 5])
+
+        with mock.patch.object(self.db.unit_cls, "compact") as compact:
+            self.db.compact(processes=1)
+        self.assertEqual(compact.call_count, len(list(self.db.get_all_unit_paths())))
+        self.assertGreaterEqual(self.db.compact(processes=2), 0)
+        self.assertLess(self.db.unit_cls.get_unit_size(unit_path), full_size / 10)
+        with self.db.reader() as reader:
+            self.assertListEqual(sorted(int(k) for k in reader.get_all(keys_only=True)),
+                                 [0, 3, 6, 7, 8, 9])
+
+    def test_auto_compact(self):
+        for background in (False, True):
+            self.db.enable_auto_compact(min_deletes=2, background=background)
+            with mock.patch.object(self.db.unit_cls, "compact") as compact:
+                with self.db.writer() as writer:
+                    writer.delete_many([3, 4])  # same unit
+                    del writer[6]
+                self.db.disable_auto_compact()
+            compact.assert_called_once_with(self.db.router.get_path(3))
+            with self.db.writer() as writer:
+                writer.set_many(self.data)
@@ -1,11 +1,15 @@
 import unittest
 import shutil
+import os
 
 from mystore import (
     shortcuts,
     DB,
     OriginalRouter,
-    CompressedJsonConverter
+    HashRouter,
+    MultiRootRouter,
+    CompressedJsonConverter,
+    MyStoreError
 )
 
 from tests.helpers import get_db_path
@@ -98,3 +102,102 @@ class DBReformatTest(unittest.TestCase):
             keys = [k for k,v in self.data]
             retrieved = sorted([(int(k), v) for k,v in reader.get_many(keys).items()])
         self.assertListEqual(retrieved, expected)
+
+    def test_reformat_as_blockdb(self):
+        new_db = shortcuts.dbmdb_to_blockdb(self.root1, self.root2)
+
+        expected = sorted(self.data)
+        with new_db.reader("r") as reader:
+            retrieved = sorted([(int(k), v) for k,v in reader.get_all()])
+        self.assertListEqual(retrieved, expected)
+
+        with new_db.reader() as reader:
+            self.assertEqual(reader[3], self.data[3][1])
+
+    def test_reformat_across_routers(self):
+        hash_db = DB(self.root2, {"buckets": 4, "subfolder_size": 2}, router_cls=HashRouter).create()
+        self.db.reformat(hash_db)
+        with hash_db.reader() as reader:
+            self.assertEqual(reader["3"], self.data[3][1])  # str keys in HashRouter layout
+
+        original_db = DB(self.root3, self.params, router_cls=OriginalRouter).create()
+        hash_db.reformat(original_db)
+        with original_db.reader() as reader:
+            retrieved = sorted((int(k), v) for k, v in reader.get_all())
+            self.assertEqual(reader[3], self.data[3][1])
+        self.assertListEqual(retrieved, sorted(self.data))
+
+
+class DBRelayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.data = [(i, {"entry_key": i}) for i in range(0, 20)]
+        self.root = get_db_path()
+        self.params = {"unit_size": 7, "subfolder_size": 1, "first_key": 0}
+        self.new_params = {"unit_size": 3, "subfolder_size": 2, "first_key": 0}
+        self.db = shortcuts.create_dbmdb(self.root, 7, 1, 0)
+        with self.db.writer() as writer:
+            writer.set_many(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def read_all(self, db):
+        with db.reader() as reader:
+            return sorted(reader.get_many(k for k, v in self.data).items())
+
+    def test_relayout(self):
+        other_db = DB.load(self.root)
+        self.db.relayout(OriginalRouter, self.new_params)
+        with self.db.writer() as writer:
+            writer[1] = {"entry_key": 1, "updated": True}
+        expected = sorted(self.data[:1] + [(1, {"entry_key": 1, "updated": True})] + self.data[2:])
+
+        self.assertEqual(1, self.db.migrate_step())
+        self.assertListEqual(expected, self.read_all(self.db))
+        self.assertListEqual(expected, self.read_all(other_db))   # reloads config on miss
+
+        self.db.finish_relayout()
+        self.assertFalse(os.path.exists(os.path.join(self.root, "relayout")))
+        self.assertListEqual(expected, self.read_all(self.db))
+        self.assertListEqual(expected, self.read_all(other_db))
+        new_db = DB.load(self.root)
+        self.assertIsInstance(new_db.router, OriginalRouter)
+        self.assertDictEqual(self.new_params, new_db.params)
+        self.assertEqual(7, len(list(new_db.get_all_unit_paths())))
+        self.assertListEqual(expected, self.read_all(new_db))
+
+    def test_writer_created_before_relayout(self):
+        writer = DB.load(self.root).writer()
+        self.db.relayout(OriginalRouter, self.new_params)
+        while self.db.migrate_step():
+            pass
+        writer[1] = {"entry_key": 1, "updated": True}
+        writer.close()
+        expected = sorted(self.data[:1] + [(1, {"entry_key": 1, "updated": True})] + self.data[2:])
+        self.assertEqual(0, self.db.migrate_step())   # no old unit created again
+        self.db.finish_relayout()
+        self.assertListEqual(expected, self.read_all(DB.load(self.root)))
+
+    def test_relayout_multiroot(self):
+        roots = [get_db_path(), get_db_path()]
+        self.addCleanup(lambda: [shutil.rmtree(r, ignore_errors=True) for r in roots])
+        self.db.relayout(MultiRootRouter, {
+            "roots": roots, "router_cls": "OriginalRouter", "router_params": self.params})
+        self.db.finish_relayout()
+        for root in roots:
+            self.assertTrue(list(self.db.unit_cls.get_all_unit_paths(root)))
+        self.assertListEqual(self.data, self.read_all(self.db))
+
+        self.db.relayout(OriginalRouter, self.new_params)
+        self.db.finish_relayout()
+        for root in roots:
+            self.assertListEqual([], list(self.db.unit_cls.get_all_unit_paths(root)))
+        self.assertEqual(7, len(list(self.db.get_all_unit_paths())))
+        self.assertListEqual(self.data, self.read_all(DB.load(self.root)))
+
+    def test_no_relayout(self):
+        with self.assertRaises(MyStoreError):
+            self.db.migrate_step()
+        self.db.relayout(OriginalRouter, self.new_params)
+        with self.assertRaises(MyStoreError):
+            self.db.relayout(OriginalRouter, self.params)
@@ -0,0 +1,120 @@
+import unittest
+import shutil
+import multiprocessing
+
+from mystore import KeyIndex, NativeStorage, DuplicateKeyError, MyStoreError
+
+from tests.helpers import get_db_path
+
+
+class KeyIndexTest(unittest.TestCase):
+    """
+    Test KeyIndex class.
+    """
+    def setUp(self):
+        self.root_dir = get_db_path()
+        self.index = KeyIndex(self.root_dir, {"buckets": 4, "subfolder_size": 2})
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def test_insert_and_get(self):
+        pairs = {"a": 1, "b": 2, 3: 3, "3": 4}
+        self.assertDictEqual(pairs, self.index.insert_many(pairs.items()))
+        self.assertDictEqual(pairs, self.index.get_many(["a", "b", 3, "3", "missing", 4]))
+        self.assertEqual(4, self.index.get("3"))
+        self.assertEqual(None, self.index.get(4))
+        self.assertDictEqual(pairs, dict(self.index.items()))
+
+    def test_duplicates(self):
+        self.index.insert_many([("a", 1)])
+        with self.assertRaises(DuplicateKeyError):
+            self.index.insert_many([("b", 2), ("a", 3)])
+        self.assertDictEqual({"a": 1}, dict(self.index.items()))
+        self.assertDictEqual({"b": 2}, self.index.insert_many([("b", 2), ("a", 3)],
+                                                              ignore_existing=True))
+        self.assertEqual(1, self.index.get("a"))
+
+    def test_duplicates_in_many_units(self):
+        keys = ["key %s" % i for i in range(40)]
+        duplicate = max(keys, key=self.index.get_path)     # in the last unit updated
+        self.index.insert_many([(duplicate, 0)])
+        with self.assertRaises(DuplicateKeyError):
+            self.index.insert_many((k, i + 1) for i, k in enumerate(keys))
+        self.assertDictEqual({duplicate: 0}, dict(self.index.items()))
+
+    def test_one_unit_open_at_a_time(self):
+        unit_cls, opened, max_opened = self.index.unit_cls, [], []
+
+        class CountingUnit(unit_cls):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                opened.append(self)
+                max_opened.append(len(opened))
+
+            def close(self):
+                opened.remove(self)
+                super().close()
+
+        self.index.unit_cls = CountingUnit
+        self.index.insert_many(("key %s" % i, i) for i in range(40))
+        self.assertEqual(1, max(max_opened))
+        self.assertEqual(40, len(dict(self.index.items())))
+
+    def test_unsupported_key(self):
+        with self.assertRaises(MyStoreError):
+            self.index.insert_many([((1, 2), 1)])
+
+    def test_config_reused(self):
+        index = KeyIndex(self.root_dir, {"buckets": 100})
+        self.assertEqual(4, index.buckets)
+
+    def test_reserve_pk_blocks(self):
+        with multiprocessing.Pool(4) as pool:
+            firsts = pool.map(KeyIndex(self.root_dir).reserve_pk_block, [10] * 20)
+        self.assertListEqual(list(range(1, 201, 10)), sorted(firsts))
+
+
+class NativeStorageTest(unittest.TestCase):
+    """
+    Test NativeStorage class.
+    """
+    def setUp(self):
+        self.data = {"key %s" % k: {"id": k} for k in range(1, 10)}
+        self.db_path = get_db_path()
+        self.params = {
+            "unit_size": 3,
+            "subfolder_size": 1,
+            "first_key": 1
+        }
+        self.s = NativeStorage(self.db_path, params=self.params, index_params={"buckets": 4})
+
+    def tearDown(self):
+        shutil.rmtree(self.db_path, ignore_errors=True)
+
+    def test_save_and_get(self):
+        self.s.save_one("key 1", self.data["key 1"])
+        self.assertEqual(self.data["key 1"], self.s.get_one("key 1"))
+        self.assertEqual(None, self.s.get_one("key 2"))
+        with self.assertRaises(DuplicateKeyError):
+            self.s.save_many(self.data.items())
+
+        self.s.save_many_if_missing(self.data.items())
+        keys = list(self.data) + ["other"]
+        self.assertEqual(list(self.data.values()) + [None], self.s.get_many(keys))
+        self.assertEqual(["other"], self.s.get_missing_keys(keys))
+        self.assertEqual(list(zip(keys, self.s.get_many(keys))),
+                         list(self.s.yield_many(keys, chunk_size=2)))
+        self.assertDictEqual(self.data, dict(self.s.get_all(chunk=2)))
+
+        # values are stored in DB under consecutive pks:
+        with self.s.db.reader() as reader:
+            self.assertEqual(len(self.data), len(list(reader.get_all(keys_only=True))))
+
+    def test_reuse_storage(self):
+        self.s.save_many(self.data.items())
+        s2 = NativeStorage(self.db_path, index_params={"buckets": 100})
+        self.assertDictEqual(self.params, s2.db.params)
+        s2.save_one(10, {"id": 10})
+        self.assertEqual({"id": 10}, self.s.get_one(10))
+        self.assertEqual(None, self.s.get_one("10"))
@@ -1,8 +1,20 @@
 import unittest
 import os
+import time
 import shutil
+import threading
+from unittest import mock
+from collections import Counter
 
-from mystore import OriginalRouter
+from mystore import (
+    DB,
+    OriginalRouter,
+    HashRouter,
+    MultiRootRouter,
+    SplittingRouter,
+    BlockUnit,
+    MyStoreError
+)
 
 from tests.helpers import get_db_path
 
@@ -83,3 +95,196 @@ class OriginalRouterTest(unittest.TestCase):
         expected_values = [os.path.join(self.root_dir, row[4]) for row in self.data]
         returned_values = [router.get_path(row[2]) for router, row in zip(routers, self.data)]
         self.assertListEqual(returned_values, expected_values)
+
+
+class HashRouterTest(unittest.TestCase):
+    """
+    Test whether the HashRouter maps keys of any type evenly to buckets.
+    """
+    def setUp(self):
+        self.root_dir = get_db_path()
+        self.params = {"buckets": 10, "subfolder_size": 4}
+        self.router = HashRouter(self.root_dir, self.params, ".dbm")
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def test_key_types(self):
+        self.assertEqual(self.router.get_path(12), self.router.get_path("12"))
+        self.assertEqual(self.router.get_path(b"12"), self.router.get_path("b'12'"))
+        with self.assertRaises(MyStoreError):
+            self.router.get_path(1.5)
+
+    def test_layout(self):
+        paths = {self.router.get_bucket_path(b) for b in range(10)}
+        self.assertEqual(paths, {self.router.get_path("key %s" % i) for i in range(1000)})
+        self.assertEqual(os.path.join(self.router.root_dir, "2", "1.dbm"),
+                         self.router.get_bucket_path(9))
+        flat = HashRouter(self.root_dir, {"buckets": 10, "subfolder_size": 0}, ".dbm")
+        self.assertEqual(os.path.join(flat.root_dir, "9.dbm"), flat.get_bucket_path(9))
+
+    def test_even_buckets(self):
+        # skewed integer keys:
+        counts = Counter(self.router.get_bucket(k * 1000) for k in range(10000))
+        self.assertEqual(10, len(counts))
+        self.assertLess(max(counts.values()), 1.2 * min(counts.values()))
+
+    def test_string_keys_db(self):
+        data = [("key %s" % i, {"value": i}) for i in range(50)]
+        db = DB(self.root_dir, self.params, router_cls=HashRouter).create()
+        with db.writer() as writer:
+            writer.set_many(data)
+        new_root = get_db_path()
+        try:
+            new_db = DB(new_root, {"buckets": 3, "subfolder_size": 0},
+                        router_cls=HashRouter, unit_cls=BlockUnit).create()
+            DB.load(self.root_dir).reformat(new_db)
+            with new_db.reader() as reader:
+                self.assertDictEqual(dict(data), reader.get_many(k for k, v in data))
+        finally:
+            shutil.rmtree(new_root, ignore_errors=True)
+
+    def test_bytes_keys_reformat(self):
+        data = [(("key %s" % i).encode("utf-8"), {"value": i}) for i in range(50)]
+        db = DB(self.root_dir, self.params, router_cls=HashRouter).create()
+        with db.writer() as writer:
+            writer.set_many(data)
+        new_root = get_db_path()
+        try:
+            new_db = DB(new_root, {"buckets": 3, "subfolder_size": 0},
+                        router_cls=HashRouter).create()
+            DB.load(self.root_dir).reformat(new_db)
+            with new_db.reader() as reader:
+                self.assertDictEqual(dict(data), reader.get_many(k for k, v in data))
+                self.assertEqual({"value": 3}, reader.get(b"key 3"))
+        finally:
+            shutil.rmtree(new_root, ignore_errors=True)
+
+
+class MultiRootRouterTest(unittest.TestCase):
+    """
+    Test whether the MultiRootRouter spreads units across roots.
+    """
+    def setUp(self):
+        self.root_dir = get_db_path()
+        self.roots = [get_db_path() + "_%s" % i for i in range(3)]
+        self.params = {
+            "roots": self.roots,
+            "router_cls": "OriginalRouter",
+            "router_params": {"unit_size": 2, "subfolder_size": 2, "first_key": 0}
+        }
+        self.data = [(i, {"entry_key": i}) for i in range(20)]
+
+    def tearDown(self):
+        for path in [self.root_dir] + self.roots:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def test_path_retrieval(self):
+        router = MultiRootRouter(self.root_dir, self.params, ".dbm")
+        inner = OriginalRouter(self.root_dir, self.params["router_params"], ".dbm")
+        for k in range(20):
+            root = os.path.abspath(self.roots[(k // 2) % 3])
+            relpath = os.path.relpath(inner.get_path(k), inner.root_dir)
+            self.assertEqual(os.path.join(root, relpath), router.get_path(k))
+
+    def test_db(self):
+        db = DB(self.root_dir, self.params, router_cls=MultiRootRouter).create()
+        with db.writer() as writer:
+            writer.set_many(self.data)
+        self.assertTrue(all(os.listdir(root) for root in self.roots))
+
+        db = DB.load(self.root_dir)
+        self.assertEqual(10, len(list(db.get_all_unit_paths())))
+        with db.reader() as reader:
+            self.assertListEqual(self.data, sorted((int(k), v) for k, v in reader.get_all()))
+            self.assertListEqual(list(range(20)),
+                                 sorted(int(k) for k in reader.get_all(keys_only=True)))
+            # stopping early:
+            all_items = reader.get_all()
+            next(all_items)
+            all_items.close()
+
+
+class SplittingRouterTest(unittest.TestCase):
+    """
+    Test splitting and merging units by SplittingRouter.
+    """
+    def setUp(self):
+        self.root_dir = get_db_path()
+        self.params = {"unit_size": 100, "subfolder_size": 0, "first_key": 0}
+        self.data = [(i, {"entry_key": i, "value": "x" * 100}) for i in range(0, 200, 2)]
+        self.db = DB(self.root_dir, self.params, router_cls=SplittingRouter).create()
+        with self.db.writer() as writer:
+            writer.set_many(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def read_all(self, db):
+        with db.reader() as reader:
+            return sorted((int(k), v) for k, v in reader.get_all())
+
+    def test_split_and_merge(self):
+        other_db = DB.load(self.root_dir)
+        with other_db.reader() as reader:
+            self.assertEqual(self.data[0][1], reader[0])  # unit opened before split
+
+        self.assertEqual((2, 0), self.db.router.rebalance(self.db, max_unit_keys=10))
+        self.assertEqual(10, len(self.db.router.ranges))
+        self.assertEqual(10, len(list(self.db.get_all_unit_paths())))
+        self.assertListEqual(self.data, self.read_all(self.db))
+
+        # other process finds keys in new units:
+        with other_db.reader() as reader:
+            self.assertEqual(self.data[1][1], reader[2])
+            self.assertEqual(self.data, sorted(reader.get_many(k for k, v in self.data).items()))
+
+        # merge back (per default unit):
+        size = DB.get_unit_classes()["DbmFileUnit"].get_unit_size
+        total = sum(size(path) for path in self.db.get_all_unit_paths())
+        splits, merges = self.db.router.rebalance(self.db, min_unit_bytes=total)
+        self.assertEqual((0, 2), (splits, merges))
+        self.assertEqual([], self.db.router.ranges)
+        self.assertEqual(2, len(list(self.db.get_all_unit_paths())))
+        self.assertListEqual(self.data, self.read_all(DB.load(self.root_dir)))
+
+    def test_split_by_size(self):
+        size = DB.get_unit_classes()["DbmFileUnit"].get_unit_size
+        unit_size = max(size(path) for path in self.db.get_all_unit_paths())
+        self.db.router.rebalance(self.db, max_unit_bytes=unit_size // 3)
+        self.assertLessEqual(6, len(self.db.router.ranges))
+        with self.db.writer() as writer:
+            writer[1] = {"entry_key": 1}
+        self.assertListEqual(sorted(self.data + [(1, {"entry_key": 1})]), self.read_all(self.db))
+
+    def test_writer_waiting_for_split_unit(self):
+        writer = DB.load(self.root_dir).writer()
+        writer[0] = {"entry_key": 0, "value": "before split"}
+        writer.release_unit()
+        parent_path = self.db.router.get_path(0)
+        save_ranges = SplittingRouter._save_ranges
+        threads = []
+
+        def write_during_split(router, ranges):
+            if threads or not any(start == 0 for start, end in ranges):
+                return save_ranges(router, ranges)  # not the split of key 4 unit
+            # writer (with the old split table) waits for the parent's lock:
+            thread = threading.Thread(target=writer.__setitem__,
+                                      args=(4, {"entry_key": 4, "value": "after split"}))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.3)
+            save_ranges(router, ranges)
+
+        with mock.patch.object(SplittingRouter, "_save_ranges", autospec=True,
+                               side_effect=write_during_split):
+            self.db.router.rebalance(self.db, max_unit_keys=10)
+        threads[0].join()
+        writer.close()
+
+        self.assertFalse(os.path.exists(parent_path))
+        self.assertNotEqual(parent_path, self.db.router.get_path(4))
+        expected = dict(self.data)
+        expected[0] = {"entry_key": 0, "value": "before split"}
+        expected[4] = {"entry_key": 4, "value": "after split"}
+        self.assertListEqual(sorted(expected.items()), self.read_all(DB.load(self.root_dir)))
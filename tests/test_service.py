@@ -0,0 +1,100 @@
+import unittest
+import os
+import time
+import socket
+import threading
+from unittest import mock
+
+from mystore import WriterService
+from mystore.errors import MyStoreError
+from mystore import service
+from mystore.service import _Request, MESSAGE_HEADER
+
+from tests.helpers import DBTestsSetup
+
+
+class WriterServiceTest(DBTestsSetup, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.socket_path = os.path.join(self.root_dir, "test.sock")
+        self.service = WriterService(self.db, self.socket_path)
+
+    def tearDown(self):
+        if self.service._server is not None:
+            self.service.shutdown()
+        super().tearDown()
+
+    def read_all(self):
+        with self.db.reader() as reader:
+            return sorted((int(k), v) for k, v in reader.get_all())
+
+    def test_remote_writes(self):
+        self.service.start()
+        with self.db.remote_writer(self.socket_path) as writer:
+            writer.BATCH_SIZE = 4
+            writer[3] = {"value": "remote"}
+            writer.flush()
+            with self.db.reader() as reader:
+                self.assertEqual(reader[3], {"value": "remote"})
+            writer.set_many((k, {"value": k}) for k in range(20, 30))
+            del writer[0]
+            with self.assertRaises(KeyError):
+                del writer[0]
+            self.assertEqual(1, writer.delete_many([1, 1000]))
+        expected = dict(self.data[2:])
+        expected.update((k, {"value": k}) for k in range(20, 30))
+        expected[3] = {"value": "remote"}
+        self.assertListEqual(self.read_all(), sorted(expected.items()))
+
+    def test_many_clients(self):
+        self.service.start()
+
+        def produce(i):
+            with self.db.remote_writer(self.socket_path) as writer:
+                writer.BATCH_SIZE = 10
+                writer.set_many((k, {"client": i}) for k in range(100 * i, 100 * i + 50))
+
+        threads = [threading.Thread(target=produce, args=(i,)) for i in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.read_all()), len(self.data) + 200)
+
+    def test_coalescing(self):
+        requests = [_Request([("s", k, self.db.converter.dump({"value": k}))])
+                    for k in range(20, 30)]
+        for request in requests:
+            self.service._requests.put(request)
+        self.service.start()
+        for request in requests:
+            request.done.wait()
+        self.assertEqual(self.service.rounds, 1)
+        self.assertEqual(len(self.read_all()), len(self.data) + 10)
+
+    def test_socket_owner_only(self):
+        self.service.start()
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+
+    def test_client_disconnects_mid_message(self):
+        self.service.start()
+        with mock.patch.object(self.service._server, "handle_error") as handle_error, \
+                mock.patch.object(service.lg, "warning") as warning:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            sock.sendall(MESSAGE_HEADER.pack(100) + b"abc")
+            sock.close()
+            with self.db.remote_writer(self.socket_path) as writer:
+                writer[3] = {"value": "remote"}
+            for _ in range(100):
+                if warning.called:
+                    break
+                time.sleep(0.01)
+        warning.assert_called_once()
+        handle_error.assert_not_called()
+        with self.db.reader() as reader:
+            self.assertEqual(reader[3], {"value": "remote"})
+
+    def test_not_running(self):
+        with self.assertRaises(MyStoreError):
+            self.db.remote_writer(self.socket_path)
@@ -1,8 +1,10 @@
 import tempfile
 import unittest
+from unittest import mock
 import shutil
 import sqlalchemy as sa
-from mystore.storage import Storage
+from mystore.storage import Storage, session_scope
+from mystore.errors import DuplicateKeyError
 
 from tests.helpers import get_db_path
 
@@ -82,6 +84,16 @@ class StorageTest(unittest.TestCase):
         self.assertEqual(1, len(pairs))  # correct number of items
         self.assertEqual(1, pairs[0][0]) # key
 
+    def test_duplicate_key_error(self):
+        self.s.save_one(1, self.data[1])
+        with self.assertRaises(DuplicateKeyError):
+            self.s.save_one(1, self.data[1])
+        with self.assertRaises(DuplicateKeyError):
+            self.s.save_many([(2, self.data[2]), (2, self.data[2])])
+        with mock.patch.object(self.s, "get_existing_keys", return_value=set()):
+            with self.assertRaises(sa.exc.IntegrityError):  # saved meanwhile
+                self.s.save_one(1, self.data[1])
+
     def test_save_many_if_missing(self):
         # save a couple values first
         self.s.save_one(2, self.data[2])
@@ -127,3 +139,82 @@ class StorageTest(unittest.TestCase):
         keys = [0,1,9,100]
         missing_keys = self.s.get_missing_keys(keys)
         self.assertEqual([0,100], sorted(missing_keys))
+
+    def test_yield_many(self):
+        self.s.save_many(list(self.data.items()))
+        keys = [0] + list(self.data) + [100]
+        pairs = list(self.s.yield_many(iter(keys), chunk_size=2))
+        self.assertEqual(keys, [k for k, v in pairs])
+        self.assertEqual([None] + list(self.data.values()) + [None], [v for k, v in pairs])
+        # stopping early:
+        gen = self.s.yield_many(keys, chunk_size=2)
+        self.assertEqual((0, None), next(gen))
+        gen.close()
+        self.assertEqual([], list(self.s.yield_many([])))
+
+    def test_get_all_pages(self):
+        self.s.save_many(list(self.data.items()))
+        pairs = list(self.s.get_all(chunk=2, max_chunk=3))
+        self.assertEqual([k for k, v in pairs], sorted(self.data))
+        self.assertDictEqual(dict(pairs), self.data)
+
+    def test_get_all_empty(self):
+        self.assertEqual([], list(self.s.get_all()))
+
+    def test_pk_blocks(self):
+        s1 = Storage(self.db_path, pk_block_size=5)
+        s2 = Storage(self.db_path, pk_block_size=5)
+        s1.save_many([(1, self.data[1]), (2, self.data[2])])
+        s2.save_many([(3, self.data[3])])
+        s1.save_one(4, self.data[4])
+        s2.save_many([(k, self.data[k]) for k in range(5, 10)])
+        # s1 reserved pks 1-5, s2 reserved pks 6-10 and then 11-15:
+        with s1.db.reader() as reader:
+            pks = {v["id"]: int(pk) for pk, v in reader.get_all()}
+        self.assertDictEqual(pks, {1: 1, 2: 2, 4: 3, 3: 6, 5: 7, 6: 8, 7: 9, 8: 10, 9: 11})
+        self.assertDictEqual(dict(self.s.get_all()), self.data)
+
+    def test_sqlite_configuration(self):
+        self.s.save_one(1, self.data[1])
+        with session_scope(self.s.session_factory()) as session:
+            self.assertEqual("wal", session.execute("PRAGMA journal_mode").scalar())
+        with session_scope(self.s.read_session_factory()) as session:
+            with self.assertRaises(sa.exc.OperationalError):
+                session.execute("DELETE FROM keys")
+        s2 = Storage(self.db_path, sqlite_pragmas={"cache_size": -1000})
+        with session_scope(s2.read_session_factory()) as session:
+            self.assertEqual(-1000, session.execute("PRAGMA cache_size").scalar())
+        self.assertEqual(1, s2.get_one(1)["id"])
+
+    def test_many_keys_lookup(self):
+        n = 5000
+        self.s.save_many((k, k) for k in range(n))
+        keys = list(range(-n, 2 * n, 2))
+        self.assertEqual(self.s.get_missing_keys(keys), [k for k in keys if k < 0 or k >= n])
+        self.assertEqual(self.s.get_many(keys), [k if 0 <= k < n else None for k in keys])
+        self.s.save_many_if_missing((k, -k) for k in range(2 * n))
+        self.assertEqual(self.s.get_many([n - 1, n, 2 * n - 1]), [n - 1, -n, -2 * n + 1])
+        # duplicates and repeated lookups on the same connection:
+        self.assertEqual(self.s.get_existing_keys(list(range(1000)) * 2), set(range(1000)))
+        self.assertEqual(self.s.get_existing_keys(list(range(600))), set(range(600)))
+
+    def test_mapping_cache(self):
+        self.s.save_many(list(self.data.items())[:5])
+        self.s.enable_mapping_cache()
+        self.assertEqual(5, len(self.s.mapping_cache))
+        with mock.patch.object(self.s, "read_session_factory") as factory:
+            self.assertEqual(self.data[1], self.s.get_one(1))
+            self.assertEqual([self.data[2], self.data[3]], self.s.get_many([2, 3]))
+        factory.assert_not_called()
+
+        # saved after snapshot: found in SQLite, or loaded by refresh:
+        self.s.save_many(list(self.data.items())[5:])
+        self.assertEqual(self.data[6], self.s.get_one(6))
+        self.assertEqual(None, self.s.get_one(100))
+        self.s.refresh_mapping_cache()
+        self.assertEqual(len(self.data), len(self.s.mapping_cache))
+
+        self.s.enable_mapping_cache(max_keys=2)
+        self.assertEqual([self.data[k] for k in (1, 2, 3)], self.s.get_many([1, 2, 3]))
+        self.assertEqual(2, len(self.s.mapping_cache))
+        self.assertEqual(1, self.s.mapping_cache.stats()["evictions"])
@@ -4,9 +4,11 @@ import tempfile
 
 from mystore import (
     DbmFileUnit,
+    BlockUnit,
     CompressedJsonConverter,
     MyStoreError
 )
+from mystore.errors import BaseUnitDoesNotExist
 
 
 class DbmFileUnitTest(unittest.TestCase):
@@ -74,3 +76,59 @@ class DbmFileUnitTest(unittest.TestCase):
     def test_unsupported_mode(self):
         with self.assertRaises(MyStoreError):
             dbmfile = DbmFileUnit(self._filepath, mode="yo")
+
+
+class BlockUnitTest(unittest.TestCase):
+    """
+    Test BlockUnit class.
+    """
+    def setUp(self):
+        self._filepath = os.path.join(tempfile.gettempdir(), "temp_block%s.blk" % os.getpid())
+        self.testdata = {str(i): ("value %s" % i).encode() * 30 for i in range(500)}
+        with BlockUnit(self._filepath, "w") as f:
+            for k, v in self.testdata.items():
+                f[k] = v
+
+    def tearDown(self):
+        if os.path.exists(self._filepath):
+            os.remove(self._filepath)
+
+    def test_get(self):
+        with BlockUnit(self._filepath, "r") as f:
+            self.assertEqual(f["10"], self.testdata["10"])
+            self.assertEqual(f[499], self.testdata["499"])
+            with self.assertRaises(KeyError):
+                f["500"]
+
+    def test_items(self):
+        with BlockUnit(self._filepath, "r") as f:
+            self.assertDictEqual(dict(f.items()), self.testdata)
+            self.assertEqual(sorted(f.keys()), sorted(self.testdata.keys()))
+
+    def test_blocks(self):
+        with BlockUnit(self._filepath, "r") as f:
+            self.assertGreater(len(f._index["blocks"]), 1)
+        self.assertLess(os.path.getsize(self._filepath),
+                        sum(len(v) for v in self.testdata.values()) / 10)
+
+    def test_update(self):
+        with BlockUnit(self._filepath, "W") as f:
+            f["10"] = b"new value"
+            f["1000"] = b"another value"
+        with BlockUnit(self._filepath, "r") as f:
+            self.assertEqual(f["10"], b"new value")
+            self.assertEqual(f["1000"], b"another value")
+            self.assertEqual(f["11"], self.testdata["11"])
+
+    def test_delete(self):
+        with BlockUnit(self._filepath, "W") as f:
+            del f["10"]
+            with self.assertRaises(KeyError):
+                del f["10"]
+        with BlockUnit(self._filepath, "r") as f:
+            self.assertNotIn("10", list(f.keys()))
+            self.assertEqual(f["11"], self.testdata["11"])
+
+    def test_nonexisting(self):
+        with self.assertRaises(BaseUnitDoesNotExist):
+            BlockUnit(self._filepath + "x", "r")
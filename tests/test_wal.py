@@ -0,0 +1,154 @@
+import unittest
+import os
+import threading
+from unittest import mock
+
+from mystore import DB
+from mystore.wal import WriteAheadLog, WAL_DIRNAME, LOCK_FILENAME, read_records
+
+from tests.helpers import DBTestsSetup
+
+
+class WriteAheadLogTest(DBTestsSetup, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.wal_dir = os.path.join(self.root_dir, WAL_DIRNAME)
+
+    def crash(self, db):
+        """ Leave unapplied records in a segment nobody holds a lock on. """
+        for segment in db.wal._segments:
+            segment.file.close()
+        db.wal._lock_file.close()
+
+    def test_writes_applied_in_batches(self):
+        self.db.enable_wal()
+        with self.db.writer() as writer:
+            writer[3] = {"value": "logged"}
+            with open(self.db.wal.path, "rb") as f:
+                self.assertListEqual([r[1:3] for r in read_records(f)], [("s", 3)])
+            with self.db.reader() as reader:
+                self.assertEqual(reader[3], self.data[3][1])  # not applied yet
+            writer.flush()
+            with self.db.reader() as reader:
+                self.assertEqual(reader[3], {"value": "logged"})
+            self.assertEqual(os.path.getsize(self.db.wal.path), 0)
+
+            writer.set_many((k, {"value": k}) for k in range(20, 30))
+            del writer[0]
+            with self.assertRaises(KeyError):
+                del writer[0]
+            writer._log([("d", 1, None)])   # applied with the next delete
+            with self.assertRaises(KeyError):
+                del writer[1000]
+        with self.db.reader() as reader:
+            self.assertIsNone(reader.get(0))
+            self.assertIsNone(reader.get(1))
+            self.assertEqual(reader[25], {"value": 25})
+        self.db.disable_wal()
+        self.assertListEqual(os.listdir(self.wal_dir), [LOCK_FILENAME])
+
+    def test_replay_on_load(self):
+        self.db.enable_wal()
+        writer = self.db.writer()
+        writer[3] = {"value": "logged"}
+        writer.set_many([(4, {"value": "lost"}), (100, {"value": "new"})])
+        del writer._pending[:]
+        self.crash(self.db)
+        with open(self.db.wal.path, "ab") as f:
+            f.write(b"\x00\x00\x01")    # torn record of an unfinished append
+
+        db = DB.load(self.root_dir)
+        with db.reader() as reader:
+            self.assertEqual(reader[3], {"value": "logged"})
+            self.assertEqual(reader[4], {"value": "lost"})
+            self.assertEqual(reader[100], {"value": "new"})
+        self.assertListEqual(os.listdir(self.wal_dir), [LOCK_FILENAME])
+
+    def test_crashed_segments_taken_over(self):
+        other_db = DB.load(self.root_dir).enable_wal()
+        other_writer = other_db.writer()
+        other_writer[5] = {"value": "older"}
+        self.db.enable_wal()
+        writer = self.db.writer()
+        writer[3] = {"value": "lost"}
+        writer[5] = {"value": "newer"}
+        self.crash(self.db)
+
+        # not replayed over writes of the running process:
+        self.assertEqual(0, DB.load(self.root_dir).recover())
+        other_writer[3] = {"value": "newest"}
+        other_writer.close()
+        other_db.disable_wal()
+        self.assertListEqual(os.listdir(self.wal_dir), [LOCK_FILENAME])
+        self.assertEqual(0, DB.load(self.root_dir).recover())
+        with self.db.reader() as reader:
+            self.assertEqual(reader[3], {"value": "newest"})
+            self.assertEqual(reader[5], {"value": "newer"})
+
+    def test_segments_of_running_processes_skipped(self):
+        self.db.enable_wal()
+        with self.db.writer() as writer:
+            writer.BATCH_SIZE = 100
+            writer[3] = {"value": "logged"}
+            self.assertEqual(0, DB.load(self.root_dir).recover())
+        self.assertEqual(0, self.db.recover())
+        with self.db.reader() as reader:
+            self.assertEqual(reader[3], {"value": "logged"})
+
+    def test_group_commit(self):
+        wal = WriteAheadLog(self.wal_dir, commit_delay=0.05)
+        barrier = threading.Barrier(8)
+
+        def commit(i):
+            seq, lsn = wal.append([("s", i, b"value")])
+            barrier.wait()
+            wal.commit(lsn)
+
+        threads = [threading.Thread(target=commit, args=(i,)) for i in range(8)]
+        with mock.patch("os.fsync") as fsync:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertLess(fsync.call_count, 8)
+        self.assertEqual(wal.fsyncs, fsync.call_count)
+        wal.applied(range(1, 9))
+        path = wal.path
+        wal.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_flush_after_rotation(self):
+        self.db.enable_wal(segment_bytes=1000)
+        value = os.urandom(3000).hex()
+        with self.db.writer() as writer:
+            old_path = self.db.wal.path
+            writer[3] = {"value": value}     # bigger than a segment
+            self.assertNotEqual(old_path, self.db.wal.path)
+            writer.flush()
+            self.assertFalse(os.path.exists(old_path))
+            writer[4] = {"value": "next"}
+        with self.db.reader() as reader:
+            self.assertEqual(reader[3], {"value": value})
+            self.assertEqual(reader[4], {"value": "next"})
+
+    def test_segments_rotated(self):
+        self.db.enable_wal(segment_bytes=1000)
+        segments = lambda: [fn for fn in os.listdir(self.wal_dir) if fn != LOCK_FILENAME]
+        with self.db.writer() as slow_writer, self.db.writer() as busy_writer:
+            slow_writer.BATCH_SIZE = 1000
+            busy_writer.BATCH_SIZE = 10
+            slow_writer[3] = {"value": "slow"}
+            counts = []
+            for k in range(20, 220):
+                busy_writer[k] = {"value": k}
+                counts.append(len(segments()))
+            # old segments are removed, but the one with slow_writer's record:
+            self.assertEqual(2, min(counts[-10:]))
+            self.assertEqual(3, max(counts))
+            slow_writer.flush()
+            self.assertEqual(len(segments()), 1)
+        self.db.disable_wal()
+        self.assertListEqual(segments(), [])
+        with self.db.reader() as reader:
+            self.assertEqual(reader[3], {"value": "slow"})
+            self.assertEqual(reader[219], {"value": 219})